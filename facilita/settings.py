@@ -69,12 +69,15 @@ TEMPLATES = [
 WSGI_APPLICATION = 'facilita.wsgi.application'
 ASGI_APPLICATION = 'facilita.asgi.application'
 
+# Redis
+REDIS_URL = os.getenv('REDIS_URL', 'redis://localhost:6379/0')
+
 # Configuração do Channels
 CHANNEL_LAYERS = {
     'default': {
         'BACKEND': 'channels_redis.core.RedisChannelLayer',
         'CONFIG': {
-            "hosts": [os.getenv('REDIS_URL', 'redis://localhost:6379/0')],
+            "hosts": [REDIS_URL],
         },
     },
 }
@@ -148,13 +151,37 @@ AUTHENTICATION_BACKENDS = [
 ]
 
 # Configurações do Celery
-CELERY_BROKER_URL = os.getenv('REDIS_URL', 'redis://localhost:6379/0')
-CELERY_RESULT_BACKEND = os.getenv('REDIS_URL', 'redis://localhost:6379/0')
+CELERY_BROKER_URL = REDIS_URL
+CELERY_RESULT_BACKEND = REDIS_URL
 CELERY_ACCEPT_CONTENT = ['json']
 CELERY_TASK_SERIALIZER = 'json'
 CELERY_RESULT_SERIALIZER = 'json'
 CELERY_TIMEZONE = 'Africa/Luanda'
 
+# Threads do executor que envia notificações e atualizações WebSocket após o commit
+FILA_EFEITOS_MAX_THREADS = int(os.getenv('FILA_EFEITOS_MAX_THREADS', '4'))
+
+# Respostas guardadas para repetições com o mesmo cabeçalho Idempotency-Key
+IDEMPOTENCIA_TTL_SEGUNDOS = int(os.getenv('IDEMPOTENCIA_TTL_SEGUNDOS', '86400'))
+
+# Blocos de números de senha reservados para totens que trabalham offline
+TOTEM_TAMANHO_BLOCO = int(os.getenv('TOTEM_TAMANHO_BLOCO', '50'))
+TOTEM_VALIDADE_BLOCO_HORAS = int(os.getenv('TOTEM_VALIDADE_BLOCO_HORAS', '4'))
+
+# Modelos de ML versionados em disco; cada worker guarda em memória só os mais usados
+MODELOS_ML_DIR = os.getenv('MODELOS_ML_DIR', str(BASE_DIR / 'modelos_ml'))
+MODELOS_ML_MEMORIA_MB = int(os.getenv('MODELOS_ML_MEMORIA_MB', '256'))
+# Modelos carregados no mestre do gunicorn antes do fork dos workers (gunicorn.conf.py),
+# para que todos partilhem a mesma cópia (ver benchmark_memoria_modelos)
+MODELOS_ML_PRECARREGAR = os.getenv('MODELOS_ML_PRECARREGAR', 'True') == 'True'
+# O treino corre no worker Celery, com outro disco: as versões publicadas chegam aos workers web pelo Redis
+MODELOS_ML_DISTRIBUIR = os.getenv('MODELOS_ML_DISTRIBUIR', 'True') == 'True'
+# floresta, floresta_compacta, gradiente ou linear (ver benchmark_preditores)
+MODELOS_ML_TIPO = os.getenv('MODELOS_ML_TIPO', 'floresta_compacta')
+# Só se treina de novo uma fila com pelo menos estas amostras novas, ou quando o tempo médio de serviço deriva esta fração
+TREINO_MINIMO_NOVAS_AMOSTRAS = int(os.getenv('TREINO_MINIMO_NOVAS_AMOSTRAS', '50'))
+TREINO_LIMITE_DERIVA = float(os.getenv('TREINO_LIMITE_DERIVA', '0.15'))
+
 # Configurações do django-celery-beat
 CELERY_BEAT_SCHEDULER = 'django_celery_beat.schedulers:DatabaseScheduler'
 
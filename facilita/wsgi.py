@@ -13,4 +13,4 @@ application = ProtocolTypeRouter({
             sistema.routing.websocket_urlpatterns
         )
     ),
-})
\ No newline at end of file
+})
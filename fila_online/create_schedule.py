@@ -13,4 +13,56 @@ PeriodicTask.objects.get_or_create(
     task='fila_online.tasks.treinar_modelos_periodicamente',
     interval=schedule,
     defaults={'enabled': True}
-)
\ No newline at end of file
+)
+
+# A virada depende do fuso de cada filial: verificar a cada 15 minutos
+schedule_virada, created = IntervalSchedule.objects.get_or_create(
+    every=15,
+    period=IntervalSchedule.MINUTES,
+)
+
+PeriodicTask.objects.get_or_create(
+    name='Virada Diária das Filas',
+    task='fila_online.tasks.virar_dia_filas',
+    interval=schedule_virada,
+    defaults={'enabled': True}
+)
+
+# Expiração das senhas chamadas: só lê as vencidas, pode correr com frequência
+schedule_expiracao, created = IntervalSchedule.objects.get_or_create(
+    every=30,
+    period=IntervalSchedule.SECONDS,
+)
+
+PeriodicTask.objects.get_or_create(
+    name='Expirar Senhas Chamadas',
+    task='fila_online.tasks.expirar_chamadas_vencidas',
+    interval=schedule_expiracao,
+    defaults={'enabled': True}
+)
+
+# Médias guardadas na Fila: as leituras de tempo de espera não escrevem no banco
+schedule_tempos_medios, created = IntervalSchedule.objects.get_or_create(
+    every=5,
+    period=IntervalSchedule.MINUTES,
+)
+
+PeriodicTask.objects.get_or_create(
+    name='Atualizar Tempos de Espera Médios',
+    task='fila_online.tasks.atualizar_tempos_espera_medios',
+    interval=schedule_tempos_medios,
+    defaults={'enabled': True}
+)
+
+# Contadores do Redis que ficaram atrás de emissões pelo banco durante uma falha
+schedule_contadores, created = IntervalSchedule.objects.get_or_create(
+    every=1,
+    period=IntervalSchedule.MINUTES,
+)
+
+PeriodicTask.objects.get_or_create(
+    name='Reconciliar Contadores de Senhas',
+    task='fila_online.tasks.reconciliar_contadores_senhas',
+    interval=schedule_contadores,
+    defaults={'enabled': True}
+)
@@ -0,0 +1,97 @@
+import base64
+import hashlib
+import json
+import logging
+import redis
+from django.conf import settings
+from django.http import HttpResponse, JsonResponse
+
+logger = logging.getLogger(__name__)
+
+# Respostas são guardadas em bytes (podem ser PDFs), por isso sem decode_responses
+redis_client = redis.Redis.from_url(settings.REDIS_URL)
+
+class IdempotenciaMixin:
+    """Reproduz a primeira resposta quando um pedido é repetido com o mesmo Idempotency-Key.
+
+    A chave é válida por utilizador (cabeçalho Authorization) e por rota. Uma
+    repetição devolve a resposta guardada no Redis sem executar a view, e
+    portanto sem tocar no Postgres.
+    """
+    CABECALHO = 'Idempotency-Key'
+    METODOS = ('POST', 'PUT', 'PATCH', 'DELETE')
+    TAMANHO_MAXIMO_CHAVE = 255
+    TTL_BLOQUEIO_SEGUNDOS = 60
+    CABECALHOS_GUARDADOS = ('Content-Type', 'Content-Disposition')
+
+    def _chave_idempotencia(self, request, chave):
+        escopo = f"{request.headers.get('Authorization', '')}|{request.path}|{chave}"
+        return f"idempotencia:{hashlib.sha256(escopo.encode('utf-8')).hexdigest()}"
+
+    def _impressao_pedido(self, request):
+        return hashlib.sha256(request.method.encode('utf-8') + b'|' + request.body).hexdigest()
+
+    def _guardar_resposta(self, chave_resposta, impressao, resposta):
+        if hasattr(resposta, 'render') and not resposta.is_rendered:
+            resposta.render()
+        dados = {
+            'impressao': impressao,
+            'status': resposta.status_code,
+            'conteudo': base64.b64encode(resposta.content).decode('ascii'),
+            'cabecalhos': {nome: resposta[nome] for nome in self.CABECALHOS_GUARDADOS if resposta.has_header(nome)}
+        }
+        redis_client.setex(chave_resposta, settings.IDEMPOTENCIA_TTL_SEGUNDOS, json.dumps(dados))
+
+    def _reproduzir_resposta(self, dados):
+        resposta = HttpResponse(
+            base64.b64decode(dados['conteudo']),
+            status=dados['status'],
+            headers=dados['cabecalhos']
+        )
+        resposta['Idempotent-Replayed'] = 'true'
+        return resposta
+
+    def dispatch(self, request, *args, **kwargs):
+        chave = request.headers.get(self.CABECALHO)
+        if request.method not in self.METODOS or not chave:
+            return super().dispatch(request, *args, **kwargs)
+
+        if len(chave) > self.TAMANHO_MAXIMO_CHAVE:
+            logger.warning(f"Idempotency-Key demasiado longa em {request.path}")
+            return JsonResponse({'erro': f'{self.CABECALHO} inválido'}, status=400)
+
+        chave_resposta = self._chave_idempotencia(request, chave)
+        chave_bloqueio = f"{chave_resposta}:processando"
+        impressao = self._impressao_pedido(request)
+
+        try:
+            guardada = redis_client.get(chave_resposta)
+            if guardada:
+                dados = json.loads(guardada)
+                if dados['impressao'] != impressao:
+                    logger.warning(f"Idempotency-Key reutilizada com outro corpo em {request.path}")
+                    return JsonResponse({'erro': f'{self.CABECALHO} já usado com outro pedido'}, status=422)
+                logger.info(f"Resposta idempotente reproduzida para {request.path}")
+                return self._reproduzir_resposta(dados)
+
+            if not redis_client.set(chave_bloqueio, 1, nx=True, ex=self.TTL_BLOQUEIO_SEGUNDOS):
+                logger.warning(f"Pedido com a mesma Idempotency-Key ainda em processamento em {request.path}")
+                return JsonResponse({'erro': 'Pedido em processamento. Tente novamente em instantes.'}, status=409)
+        except redis.RedisError as e:
+            logger.warning(f"Erro ao acessar Redis para idempotência em {request.path}: {e}. Prosseguindo sem idempotência.")
+            return super().dispatch(request, *args, **kwargs)
+
+        try:
+            resposta = super().dispatch(request, *args, **kwargs)
+            # Erros 5xx podem ser transitórios: deixar o cliente tentar de novo
+            if resposta.status_code < 500:
+                try:
+                    self._guardar_resposta(chave_resposta, impressao, resposta)
+                except redis.RedisError as e:
+                    logger.warning(f"Erro ao guardar resposta idempotente para {request.path}: {e}")
+            return resposta
+        finally:
+            try:
+                redis_client.delete(chave_bloqueio)
+            except redis.RedisError as e:
+                logger.warning(f"Erro ao libertar bloqueio de idempotência para {request.path}: {e}")
@@ -0,0 +1,96 @@
+import threading
+import time
+import uuid
+from datetime import timedelta
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.db.models import F
+from django.utils import timezone
+from fila_online.models import Fila, Ticket
+from fila_online.services import ServicoFila, AlocadorSenhas
+import logging
+
+logger = logging.getLogger(__name__)
+
+class Command(BaseCommand):
+    help = (
+        'Mede o débito de "chamar próximo" com vários balcões em simultâneo. '
+        'Usa uma fila de teste aberta: cria senhas fictícias e apaga-as no fim.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('fila_id', help='ID de uma fila de teste (aberta)')
+        parser.add_argument('--senhas', type=int, default=600, help='Senhas criadas por rodada')
+        parser.add_argument('--balcoes', default='1,2,4,8,12', help='Números de balcões a testar, separados por vírgula')
+
+    def _semear(self, fila, quantidade):
+        ultimo = AlocadorSenhas.alocar(fila, quantidade)
+        agora = timezone.now()
+        senhas = [
+            Ticket(
+                id=uuid.uuid4(),
+                fila=fila,
+                usuario_id=None,
+                numero_ticket=numero,
+                codigo_qr=f"BENCH-{uuid.uuid4().hex[:16]}",
+                prioridade=0,
+                e_fisico=True,
+                status='Pendente',
+                emitido_em=agora,
+                expira_em=agora + timedelta(hours=4)
+            ) for numero in range(ultimo - quantidade + 1, ultimo + 1)
+        ]
+        Ticket.objects.bulk_create(senhas)
+        Fila.objects.filter(id=fila.id).update(tickets_ativos=F('tickets_ativos') + quantidade)
+        AlocadorSenhas.reconciliar(fila.id)
+        return [senha.id for senha in senhas]
+
+    def _balcao(self, fila, balcao, chamadas, erros):
+        try:
+            while True:
+                try:
+                    senha = ServicoFila.chamar_proximo(fila.servico, filial_id=fila.departamento.filial_id, balcao=balcao)
+                except ValueError:
+                    break
+                chamadas.append(senha.id)
+        except Exception as e:
+            erros.append(str(e))
+        finally:
+            connections.close_all()
+
+    def _rodada(self, fila, num_balcoes, quantidade):
+        semeadas = self._semear(fila, quantidade)
+        chamadas, erros = [], []
+        threads = [
+            threading.Thread(target=self._balcao, args=(fila, (i % fila.num_balcoes) + 1, chamadas, erros))
+            for i in range(num_balcoes)
+        ]
+        inicio = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        duracao = time.perf_counter() - inicio
+
+        Ticket.objects.filter(id__in=semeadas).delete()
+        AlocadorSenhas.reconciliar(fila.id)
+        return len(chamadas), len(chamadas) - len(set(chamadas)), duracao, erros
+
+    def handle(self, *args, **options):
+        try:
+            fila = Fila.objects.select_related('departamento').get(id=options['fila_id'])
+        except Fila.DoesNotExist:
+            raise CommandError('Fila não encontrada')
+        if not ServicoFila.esta_fila_aberta(fila):
+            raise CommandError('A fila de teste tem de estar aberta')
+        if connections['default'].vendor != 'postgresql':
+            self.stdout.write(self.style.WARNING('Sem Postgres não há SKIP LOCKED: os resultados não são representativos'))
+
+        self.stdout.write(f"{'balcões':>8} {'chamadas':>9} {'repetidas':>10} {'segundos':>9} {'chamadas/s':>11}")
+        for num_balcoes in [int(n) for n in options['balcoes'].split(',')]:
+            total, repetidas, duracao, erros = self._rodada(fila, num_balcoes, options['senhas'])
+            self.stdout.write(f"{num_balcoes:>8} {total:>9} {repetidas:>10} {duracao:>9.2f} {total / duracao:>11.1f}")
+            for erro in erros:
+                self.stdout.write(self.style.ERROR(f"  erro num balcão: {erro}"))
+            if repetidas:
+                self.stdout.write(self.style.ERROR(f"  {repetidas} senhas chamadas por mais de um balcão"))
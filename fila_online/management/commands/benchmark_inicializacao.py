@@ -0,0 +1,79 @@
+import json
+import os
+import subprocess
+import sys
+import numpy as np
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Corre num processo novo a cada repetição: os módulos já importados por este não contam
+SCRIPT_MEDICAO = '''
+import json, sys, time
+inicio = time.perf_counter()
+from django.db import connections
+consultas = []
+def contar(execute, sql, params, many, context):
+    consultas.append(sql)
+    return execute(sql, params, many, context)
+connections['default'].execute_wrappers.append(contar)
+
+import django
+django.setup()
+setup = time.perf_counter()
+consultas_setup = len(consultas)
+
+from django.urls import get_resolver
+get_resolver().url_patterns
+urls = time.perf_counter()
+consultas_urls = len(consultas) - consultas_setup
+sklearn_importado = 'sklearn' in sys.modules
+
+from fila_online.ml_models import preditor_tempo_espera, preditor_recomendacao_servico
+antes_uso = time.perf_counter()
+preditor_tempo_espera.obter()
+preditor_recomendacao_servico.obter()
+primeiro_uso = time.perf_counter()
+
+print(json.dumps({
+    'setup': setup - inicio,
+    'urls': urls - setup,
+    'primeiro_uso': primeiro_uso - antes_uso,
+    'consultas_arranque': consultas_setup + consultas_urls,
+    'consultas_primeiro_uso': len(consultas) - consultas_setup - consultas_urls,
+    'sklearn_no_arranque': sklearn_importado,
+}))
+'''
+
+class Command(BaseCommand):
+    help = (
+        'Mede o arranque de um processo: django.setup(), carregamento das URLs (importa views, '
+        'services e ml_models), consultas ao banco feitas até aí e o custo do primeiro uso dos preditores.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeticoes', type=int, default=5, help='Processos novos medidos')
+
+    def _medir(self):
+        processo = subprocess.run(
+            [sys.executable, '-c', SCRIPT_MEDICAO],
+            cwd=settings.BASE_DIR,
+            env={**os.environ, 'DJANGO_SETTINGS_MODULE': os.environ.get('DJANGO_SETTINGS_MODULE', 'facilita.settings')},
+            capture_output=True,
+            text=True
+        )
+        if processo.returncode != 0:
+            raise CommandError(f"Falha ao medir o arranque:\n{processo.stderr[-2000:]}")
+        return json.loads(processo.stdout.strip().splitlines()[-1])
+
+    def handle(self, *args, **options):
+        medidas = [self._medir() for _ in range(max(1, options['repeticoes']))]
+        for nome, rotulo in [('setup', 'django.setup()'), ('urls', 'carregar URLs'), ('primeiro_uso', 'primeiro uso dos preditores')]:
+            tempos = np.array([medida[nome] for medida in medidas]) * 1000
+            self.stdout.write(f"{rotulo:<28} mediana {np.median(tempos):>8.0f} ms   máx {tempos.max():>8.0f} ms")
+        ultima = medidas[-1]
+        self.stdout.write(f"{'consultas no arranque':<28} {ultima['consultas_arranque']:>8}")
+        self.stdout.write(f"{'consultas no primeiro uso':<28} {ultima['consultas_primeiro_uso']:>8}")
+        self.stdout.write(f"{'sklearn importado no arranque':<28} {'sim' if ultima['sklearn_no_arranque'] else 'não':>8}")
@@ -0,0 +1,103 @@
+import gc
+import multiprocessing
+import os
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from fila_online.ml_models import RegistroModelos, PreditorTempoEspera
+import logging
+
+logger = logging.getLogger(__name__)
+
+# (nome, carregar no mestre antes do fork, mmap_mode)
+CENARIOS = [
+    ('por_worker', False, None),
+    ('preload', True, None),
+    ('preload_mmap', True, 'r'),
+]
+
+def _memoria_processo():
+    """RSS, PSS e memória privada do processo em KiB (PSS divide as páginas partilhadas pelos processos que as usam)."""
+    campos = {}
+    try:
+        with open('/proc/self/smaps_rollup') as f:
+            for linha in f:
+                partes = linha.split()
+                if len(partes) == 3 and partes[2] == 'kB':
+                    campos[partes[0].rstrip(':')] = int(partes[1])
+    except FileNotFoundError:
+        with open('/proc/self/status') as f:
+            for linha in f:
+                if linha.startswith('VmRSS:'):
+                    campos['Rss'] = campos['Pss'] = int(linha.split()[1])
+    privada = campos.get('Private_Clean', 0) + campos.get('Private_Dirty', 0)
+    return campos.get('Rss', 0), campos.get('Pss', 0), privada
+
+def _usar_modelos(registro):
+    """Uma previsão por modelo, como um worker a responder a pedidos de várias filas."""
+    for chave in registro.chaves():
+        artefacto = registro.obter(chave)
+        if artefacto is not None:
+            linha = np.zeros((1, artefacto['scaler'].n_features_in_))
+            artefacto['modelo'].predict(artefacto['scaler'].transform(linha))
+
+def _worker(registro, carregar, barreira, resultados):
+    if carregar:
+        registro.precarregar()
+    _usar_modelos(registro)
+    barreira.wait()  # Medir com todos os workers vivos, para o PSS repartir as páginas partilhadas
+    resultados.put(_memoria_processo())
+    barreira.wait()
+
+class Command(BaseCommand):
+    help = (
+        'Mede a memória por worker com os modelos de tempo de espera carregados: cada worker '
+        'carrega os seus (por_worker), o mestre carrega antes do fork (preload, como gunicorn --preload) '
+        'e o mesmo com os arrays mapeados do ficheiro (preload_mmap, que só poupa memória com os '
+        'tipos de ml_models.TIPOS_MAPEAVEIS).'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=4, help='Processos criados por cenário')
+
+    def _cenario(self, carregar_no_mestre, mmap_mode, workers):
+        registro = RegistroModelos(PreditorTempoEspera.DIRETORIO_MODELOS, float('inf'), mmap_mode=mmap_mode)
+        if carregar_no_mestre:
+            registro.precarregar()
+            gc.freeze()
+        contexto = multiprocessing.get_context('fork')
+        barreira = contexto.Barrier(workers)
+        resultados = contexto.Queue()
+        processos = [
+            contexto.Process(target=_worker, args=(registro, not carregar_no_mestre, barreira, resultados))
+            for _ in range(workers)
+        ]
+        for processo in processos:
+            processo.start()
+        medidas = [resultados.get() for _ in processos]
+        for processo in processos:
+            processo.join()
+        gc.unfreeze()
+        return np.array(medidas, dtype=float) / 1024
+
+    def handle(self, *args, **options):
+        workers = options['workers']
+        if workers < 1:
+            raise CommandError('--workers tem de ser pelo menos 1')
+        registro = RegistroModelos(PreditorTempoEspera.DIRETORIO_MODELOS, 0)
+        chaves = registro.chaves()
+        if not chaves:
+            raise CommandError('Nenhum modelo publicado: corra treinar_modelos_ml primeiro')
+        tamanho = sum(
+            os.path.getsize(os.path.join(registro.diretorio, chave, f"{registro.versao_atual(chave)}.joblib"))
+            for chave in chaves
+        )
+        connections.close_all()  # Os workers não usam o banco
+
+        self.stdout.write(f"{len(chaves)} modelos ({tamanho / 1024 / 1024:.1f} MiB em disco), {workers} workers")
+        self.stdout.write(f"{'cenário':<14} {'RSS/worker':>11} {'PSS/worker':>11} {'privada/worker':>15} {'PSS total':>10}")
+        for nome, carregar_no_mestre, mmap_mode in CENARIOS:
+            medidas = self._cenario(carregar_no_mestre, mmap_mode, workers)
+            rss, pss, privada = medidas.mean(axis=0)
+            self.stdout.write(f"{nome:<14} {rss:>11.1f} {pss:>11.1f} {privada:>15.1f} {medidas[:, 1].sum():>10.1f}")
+        self.stdout.write('Valores em MiB. PSS total aproxima a memória que os workers ocupam juntos.')
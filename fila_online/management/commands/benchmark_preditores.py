@@ -0,0 +1,85 @@
+import pickle
+import time
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+from sklearn.metrics import mean_absolute_error, r2_score
+from sklearn.model_selection import train_test_split
+from sklearn.preprocessing import StandardScaler
+from fila_online.ml_models import (
+    TIPOS_MODELO, criar_modelo, preparar_para_inferencia,
+    preditor_tempo_espera, preditor_recomendacao_servico
+)
+import logging
+
+logger = logging.getLogger(__name__)
+
+class Command(BaseCommand):
+    help = (
+        'Compara as opções de modelo (TIPOS_MODELO): latência p50/p99 de uma previsão '
+        'de uma linha (scaler + predict), erro absoluto médio, R² e tamanho serializado.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--preditor', choices=['tempo_espera', 'recomendacao'], default='tempo_espera')
+        parser.add_argument('--fila', dest='fila_id', default=None, help='Usar só o histórico desta fila (tempo_espera)')
+        parser.add_argument('--sintetico', type=int, default=0, help='Gerar N amostras sintéticas em vez de ler o histórico')
+        parser.add_argument('--repeticoes', type=int, default=2000, help='Previsões de uma linha medidas por modelo')
+
+    def _dados_tempo_espera(self, fila_id):
+        partes = list(preditor_tempo_espera.preparar_dados_filas([fila_id] if fila_id else None, amostras_minimas=1).values())
+        if not partes:
+            return None, None
+        return np.concatenate([X for X, _ in partes]), np.concatenate([y for _, y in partes])
+
+    def _dados_sinteticos(self, quantidade):
+        aleatorio = np.random.default_rng(42)
+        X = np.column_stack([
+            aleatorio.integers(0, 120, quantidade),
+            aleatorio.integers(0, 150, quantidade),
+            aleatorio.integers(0, 3, quantidade),
+            aleatorio.integers(7, 19, quantidade),
+            aleatorio.integers(1, 8, quantidade),
+            aleatorio.choice([50, 100, 200], quantidade),
+            aleatorio.integers(0, 100, quantidade),
+        ]).astype(float)
+        y = X[:, 0] * 4 / X[:, 4] * (1 - 0.1 * X[:, 2]) + aleatorio.gamma(2, 1.5, quantidade)
+        return X, y
+
+    def handle(self, *args, **options):
+        if options['sintetico']:
+            X, y = self._dados_sinteticos(options['sintetico'])
+        elif options['preditor'] == 'tempo_espera':
+            X, y = self._dados_tempo_espera(options['fila_id'])
+        else:
+            X, y = preditor_recomendacao_servico.preparar_dados()
+        if X is None or len(X) < 20:
+            raise CommandError('Histórico insuficiente: use --sintetico N')
+
+        X, y = np.asarray(X, dtype=float), np.asarray(y, dtype=float)
+        X_treino, X_teste, y_treino, y_teste = train_test_split(X, y, test_size=0.2, random_state=42)
+        scaler = StandardScaler().fit(X_treino)
+        X_treino_escalado, X_teste_escalado = scaler.transform(X_treino), scaler.transform(X_teste)
+        linhas = X_teste[np.arange(options['repeticoes']) % len(X_teste)]
+
+        self.stdout.write(f"{len(X_treino)} amostras de treino, {len(X_teste)} de teste")
+        self.stdout.write(f"{'modelo':<18} {'treino s':>9} {'p50 µs':>9} {'p99 µs':>9} {'MAE':>8} {'R²':>7} {'KiB':>9}")
+        for tipo in TIPOS_MODELO:
+            modelo = criar_modelo(tipo)
+            inicio = time.perf_counter()
+            modelo.fit(X_treino_escalado, y_treino)
+            duracao_treino = time.perf_counter() - inicio
+            preparar_para_inferencia(modelo)
+
+            previsto = modelo.predict(X_teste_escalado)
+            latencias = []
+            for linha in linhas:
+                inicio = time.perf_counter()
+                modelo.predict(scaler.transform(linha.reshape(1, -1)))
+                latencias.append(time.perf_counter() - inicio)
+            p50, p99 = np.percentile(latencias, [50, 99]) * 1e6
+
+            self.stdout.write(
+                f"{tipo:<18} {duracao_treino:>9.2f} {p50:>9.0f} {p99:>9.0f} "
+                f"{mean_absolute_error(y_teste, previsto):>8.2f} {r2_score(y_teste, previsto):>7.2f} "
+                f"{len(pickle.dumps(modelo)) / 1024:>9.0f}"
+            )
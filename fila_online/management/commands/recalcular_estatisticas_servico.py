@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from fila_online.models import Fila, Ticket
+import logging
+
+logger = logging.getLogger(__name__)
+
+class Command(BaseCommand):
+    help = 'Recalcula as estatísticas incrementais de tempo de serviço das filas a partir do histórico de senhas atendidas'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--fila', dest='fila_id', default=None, help='Recalcular apenas esta fila')
+
+    def handle(self, *args, **options):
+        filas_ids = Fila.objects.values_list('id', flat=True)
+        if options['fila_id']:
+            filas_ids = filas_ids.filter(id=options['fila_id'])
+            if not filas_ids:
+                raise CommandError('Fila não encontrada')
+
+        for fila_id in list(filas_ids):
+            with transaction.atomic():
+                fila = Fila.objects.select_for_update().get(id=fila_id)
+                fila.reiniciar_estatisticas_servico()
+                tempos = Ticket.objects.filter(
+                    fila_id=fila_id,
+                    status='Atendido',
+                    tempo_servico__gt=0
+                ).order_by('atendido_em').values_list('tempo_servico', 'atendido_em')
+                for tempo_servico, atendido_em in tempos.iterator(chunk_size=2000):
+                    fila.registrar_tempo_servico(tempo_servico, atendido_em.hour if atendido_em else None)
+                fila.save(update_fields=Fila.CAMPOS_ESTATISTICAS_SERVICO)
+            logger.info(f"Estatísticas de serviço recalculadas para fila_id={fila_id}: {fila.atendimentos_contagem} atendimentos")
+            self.stdout.write(f"{fila.servico}: {fila.atendimentos_contagem} atendimentos, média {fila.tempo_servico_media:.1f} min")
+
+        self.stdout.write(self.style.SUCCESS('Estatísticas de serviço recalculadas'))
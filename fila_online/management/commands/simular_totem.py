@@ -0,0 +1,106 @@
+import json
+import random
+import uuid
+import urllib.error
+import urllib.request
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+import logging
+
+logger = logging.getLogger(__name__)
+
+class Command(BaseCommand):
+    help = 'Simula um totem offline: reserva blocos de senhas, imprime localmente e sincroniza em lote'
+
+    def add_arguments(self, parser):
+        parser.add_argument('fila_id', help='ID da fila servida pelo totem')
+        parser.add_argument('--url', default='http://localhost:8000/api/fila_online', help='URL base da API fila_online')
+        parser.add_argument('--totem', default='totem-simulado', help='Identificador do totem')
+        parser.add_argument('--token', required=True, help='Token de autenticação da conta do totem')
+        parser.add_argument('--senhas', type=int, default=120, help='Número de senhas a imprimir')
+        parser.add_argument('--bloco', type=int, default=None, help='Tamanho do bloco (padrão: TOTEM_TAMANHO_BLOCO)')
+        parser.add_argument('--sincronizar-a-cada', type=int, default=10, help='Senhas impressas entre sincronizações')
+        parser.add_argument('--taxa-falha', type=float, default=0.3, help='Probabilidade de a rede falhar em cada pedido')
+
+    def _pedido(self, url, dados):
+        if random.random() < self.taxa_falha:
+            raise urllib.error.URLError('rede indisponível (simulada)')
+        pedido = urllib.request.Request(
+            url,
+            data=json.dumps(dados).encode('utf-8'),
+            headers={'Content-Type': 'application/json', 'Authorization': f'Bearer {self.token}'},
+            method='POST'
+        )
+        try:
+            with urllib.request.urlopen(pedido, timeout=5) as resposta:
+                return json.loads(resposta.read())
+        except urllib.error.HTTPError as e:
+            raise CommandError(f"Servidor recusou o pedido ({e.code}): {e.read().decode('utf-8', 'replace')}")
+
+    def _reservar(self):
+        dados = {'quantidade': self.tamanho_bloco} if self.tamanho_bloco else {}
+        bloco = self._pedido(f"{self.url}/filas/{self.fila_id}/totens/{self.totem}/blocos/", dados)
+        self.blocos.append({**bloco, 'proximo': bloco['numero_inicial'], 'pendentes': []})
+        self.stdout.write(f"Bloco reservado: {bloco['prefixo']}{bloco['numero_inicial']}-{bloco['prefixo']}{bloco['numero_final']}")
+
+    def _sincronizar(self, encerrar=False):
+        for bloco in self.blocos:
+            esgotado = bloco['proximo'] > bloco['numero_final']
+            if not bloco['pendentes'] and not (encerrar or esgotado):
+                continue
+            try:
+                resultado = self._pedido(
+                    f"{self.url}/totens/{self.totem}/blocos/{bloco['reserva_id']}/sincronizar/",
+                    {'senhas': bloco['pendentes'], 'encerrar': encerrar or esgotado}
+                )
+            except urllib.error.URLError as e:
+                self.stdout.write(self.style.WARNING(f"Sincronização adiada ({len(bloco['pendentes'])} senhas): {e.reason}"))
+                return
+            self.stdout.write(f"Sincronizadas {resultado['sincronizadas']} senhas do bloco {bloco['reserva_id']} ({resultado['repetidas']} repetidas)")
+            bloco['pendentes'] = []
+        self.blocos = [b for b in self.blocos if b['proximo'] <= b['numero_final'] or b['pendentes']]
+
+    def _bloco_disponivel(self):
+        for bloco in self.blocos:
+            if bloco['proximo'] <= bloco['numero_final']:
+                return bloco
+        try:
+            self._reservar()
+        except urllib.error.URLError as e:
+            self.stdout.write(self.style.WARNING(f"Sem rede para reservar novo bloco: {e.reason}"))
+            return None
+        return self.blocos[-1]
+
+    def handle(self, *args, **options):
+        self.url = options['url'].rstrip('/')
+        self.fila_id = options['fila_id']
+        self.totem = options['totem']
+        self.token = options['token']
+        self.tamanho_bloco = options['bloco']
+        self.taxa_falha = options['taxa_falha']
+        self.blocos = []
+
+        impressas = recusadas = 0
+        for i in range(options['senhas']):
+            bloco = self._bloco_disponivel()
+            if not bloco:
+                recusadas += 1
+                continue
+
+            senha = {
+                'numero_senha': bloco['proximo'],
+                'codigo_qr': f"QR-{uuid.uuid4().hex[:8]}",
+                'emitido_em': timezone.now().isoformat()
+            }
+            bloco['proximo'] += 1
+            bloco['pendentes'].append(senha)
+            impressas += 1
+            logger.debug(f"Totem {self.totem} imprimiu {bloco['prefixo']}{senha['numero_senha']}")
+
+            if (i + 1) % options['sincronizar_a_cada'] == 0:
+                self._sincronizar()
+
+        # No fim do turno a rede volta: enviar tudo o que ficou pendente
+        self.taxa_falha = 0
+        self._sincronizar(encerrar=True)
+        self.stdout.write(self.style.SUCCESS(f"Totem {self.totem}: {impressas} senhas impressas, {recusadas} sem número disponível"))
@@ -1,5 +1,4 @@
 from django.core.management.base import BaseCommand
-from fila_online.models import Fila
 from fila_online.ml_models import preditor_tempo_espera, preditor_recomendacao_servico
 import logging
 
@@ -8,13 +7,20 @@ logger = logging.getLogger(__name__)
 class Command(BaseCommand):
     help = 'Treina os modelos de machine learning periodicamente'
 
-    def handle(self, *args, **kwargs):
+    def add_arguments(self, parser):
+        parser.add_argument('--processos', type=int, default=1, help='Treinar filas e setores em N processos (0 = um por núcleo)')
+
+    def handle(self, *args, **options):
         try:
             logger.info("Iniciando treinamento periódico dos modelos de ML.")
-            filas = Fila.objects.all()
-            for fila in filas:
-                logger.info(f"Treinando PreditorTempoEspera para fila_id={fila.id}")
-                preditor_tempo_espera.treinar(fila.id)
+            if options['processos'] == 1:
+                resultado = preditor_tempo_espera.treinar_todas()
+            else:
+                resultado = preditor_tempo_espera.treinar_paralelo(options['processos'] or None)
+            logger.info(
+                f"PreditorTempoEspera: {resultado['publicados']} de {resultado['alvos']} modelos publicados, "
+                f"{resultado['ignoradas']} filas sem dados novos ignoradas"
+            )
             logger.info("Treinando PreditorRecomendacaoServico")
             preditor_recomendacao_servico.treinar()
             logger.info("Treinamento periódico concluído.")
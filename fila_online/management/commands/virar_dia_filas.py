@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+from fila_online.services import ServicoFila
+import logging
+
+logger = logging.getLogger(__name__)
+
+class Command(BaseCommand):
+    help = 'Encerra o dia das filas: resumo diário, cancelamento de senhas pendentes e reposição dos contadores'
+
+    def handle(self, *args, **kwargs):
+        try:
+            resultado = ServicoFila.virar_dia_filas()
+            self.stdout.write(self.style.SUCCESS(
+                f"Virada concluída: {resultado['filas']} filas, "
+                f"{resultado['senhas_encerradas']} senhas encerradas, {resultado['resumos']} resumos"
+            ))
+        except Exception as e:
+            logger.error(f"Erro na virada diária das filas: {str(e)}")
+            self.stdout.write(self.style.ERROR(f'Erro na virada diária: {str(e)}'))
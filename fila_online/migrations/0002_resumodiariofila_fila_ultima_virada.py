@@ -0,0 +1,47 @@
+# Generated by Django 5.0.6 on 2026-10-17 01:25
+
+import django.db.models.deletion
+import django.utils.timezone
+import uuid
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('fila_online', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ResumoDiarioFila',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('data', models.DateField()),
+                ('emitidas', models.IntegerField(default=0)),
+                ('atendidas', models.IntegerField(default=0)),
+                ('canceladas', models.IntegerField(default=0)),
+                ('nao_atendidas', models.IntegerField(default=0)),
+                ('tempo_medio_servico', models.FloatField(blank=True, null=True)),
+                ('criado_em', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='fila',
+            name='ultima_virada',
+            field=models.DateField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='resumodiariofila',
+            name='fila',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='resumos_diarios', to='fila_online.fila'),
+        ),
+        migrations.AddIndex(
+            model_name='resumodiariofila',
+            index=models.Index(fields=['data'], name='idx_resumo_diario_data'),
+        ),
+        migrations.AddConstraint(
+            model_name='resumodiariofila',
+            constraint=models.UniqueConstraint(fields=('fila', 'data'), name='uniq_resumo_diario_fila_data'),
+        ),
+    ]
@@ -0,0 +1,42 @@
+# Generated by Django 5.0.6 on 2026-10-17 01:27
+
+import django.db.models.deletion
+import django.utils.timezone
+import uuid
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('fila_online', '0002_resumodiariofila_fila_ultima_virada'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReservaBlocoTotem',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('totem_id', models.CharField(max_length=50)),
+                ('numero_inicial', models.IntegerField()),
+                ('numero_final', models.IntegerField()),
+                ('emitidas', models.IntegerField(default=0)),
+                ('reservado_em', models.DateTimeField(default=django.utils.timezone.now)),
+                ('expira_em', models.DateTimeField()),
+                ('encerrada', models.BooleanField(default=False)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='reservablocototem',
+            name='fila',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='reservas_totem', to='fila_online.fila'),
+        ),
+        migrations.AddIndex(
+            model_name='reservablocototem',
+            index=models.Index(fields=['fila', 'totem_id'], name='idx_reserva_totem_fila'),
+        ),
+        migrations.AddIndex(
+            model_name='reservablocototem',
+            index=models.Index(fields=['expira_em'], name='idx_reserva_totem_expira'),
+        ),
+    ]
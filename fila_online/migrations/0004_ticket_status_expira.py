@@ -0,0 +1,17 @@
+# Generated by Django 5.0.6 on 2026-10-17 01:34
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('fila_online', '0003_reservablocototem'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='ticket',
+            index=models.Index(fields=['status', 'expira_em'], name='idx_ticket_status_expira'),
+        ),
+    ]
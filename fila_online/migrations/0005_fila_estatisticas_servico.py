@@ -0,0 +1,38 @@
+# Generated by Django 5.0.6 on 2026-10-17 01:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('fila_online', '0004_ticket_status_expira'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='fila',
+            name='atendimentos_contagem',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='fila',
+            name='tempo_servico_ewma',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='fila',
+            name='tempo_servico_histograma',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+        migrations.AddField(
+            model_name='fila',
+            name='tempo_servico_m2',
+            field=models.FloatField(default=0),
+        ),
+        migrations.AddField(
+            model_name='fila',
+            name='tempo_servico_media',
+            field=models.FloatField(default=0),
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 5.0.6 on 2026-10-17 01:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('fila_online', '0005_fila_estatisticas_servico'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='fila',
+            name='motor_tempo_espera',
+            field=models.CharField(choices=[('automatico', 'Automático (modelo treinado, senão Erlang C)'), ('modelo', 'Modelo de ML'), ('erlang_c', 'Erlang C (M/M/c)')], default='automatico', max_length=20),
+        ),
+        migrations.AddIndex(
+            model_name='ticket',
+            index=models.Index(fields=['fila', 'emitido_em'], name='idx_ticket_fila_emitido'),
+        ),
+    ]
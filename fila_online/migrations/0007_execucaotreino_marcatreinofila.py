@@ -0,0 +1,49 @@
+# Generated by Django 5.0.6 on 2026-10-17 01:49
+
+import django.db.models.deletion
+import django.utils.timezone
+import uuid
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('fila_online', '0006_fila_motor_tempo_espera'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ExecucaoTreino',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('modo', models.CharField(max_length=20)),
+                ('iniciada_em', models.DateTimeField(default=django.utils.timezone.now)),
+                ('concluida_em', models.DateTimeField(blank=True, null=True)),
+                ('filas_avaliadas', models.IntegerField(default=0)),
+                ('filas_treinadas', models.IntegerField(default=0)),
+                ('filas_ignoradas', models.IntegerField(default=0)),
+                ('modelos_publicados', models.IntegerField(default=0)),
+                ('detalhes', models.JSONField(blank=True, default=dict)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='MarcaTreinoFila',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('ultimo_atendimento', models.DateTimeField(blank=True, null=True)),
+                ('amostras', models.IntegerField(default=0)),
+                ('tempo_servico_media', models.FloatField(blank=True, null=True)),
+                ('treinado_em', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='execucaotreino',
+            index=models.Index(fields=['iniciada_em'], name='idx_execucao_treino_inicio'),
+        ),
+        migrations.AddField(
+            model_name='marcatreinofila',
+            name='fila',
+            field=models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='marca_treino', to='fila_online.fila'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.0.6 on 2026-10-17 01:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('fila_online', '0007_execucaotreino_marcatreinofila'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='fila',
+            name='tempo_servico_horas',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.0.6 on 2026-10-17 02:18
+
+import django.db.models.deletion
+import django.utils.timezone
+import uuid
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('fila_online', '0008_fila_tempo_servico_horas'),
+        ('sistema', '0002_filial_fuso_horario'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Totem',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('codigo', models.CharField(max_length=50, unique=True)),
+                ('ativo', models.BooleanField(default=True)),
+                ('criado_em', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='totem',
+            name='filial',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='totens', to='sistema.filial'),
+        ),
+    ]
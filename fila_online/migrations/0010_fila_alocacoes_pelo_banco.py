@@ -0,0 +1,18 @@
+# Generated by Django 5.0.6 on 2026-10-17 02:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('fila_online', '0009_totem'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='fila',
+            name='alocacoes_pelo_banco',
+            field=models.IntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.0.6 on 2026-10-17 02:28
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('fila_online', '0010_fila_alocacoes_pelo_banco'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='fila',
+            name='tempo_servico_histograma',
+        ),
+    ]
@@ -0,0 +1,49 @@
+from django.db import migrations
+
+ALFA_EWMA_SERVICO = 0.1  # Fila.ALFA_EWMA_SERVICO; os modelos históricos não têm os métodos de Fila
+
+
+def preencher_estatisticas_servico(apps, schema_editor):
+    """Recalcula a partir do histórico as estatísticas incrementais de todas as filas com senhas atendidas.
+
+    Mesmo as filas que já têm contagem só viram os atendimentos posteriores à 0005.
+    """
+    Fila = apps.get_model('fila_online', 'Fila')
+    Ticket = apps.get_model('fila_online', 'Ticket')
+    for fila in Fila.objects.only('id').iterator():
+        tempos = Ticket.objects.filter(
+            fila_id=fila.id,
+            status='Atendido',
+            tempo_servico__gt=0
+        ).order_by('atendido_em').values_list('tempo_servico', 'atendido_em')
+        contagem, media, m2, ewma, horas = 0, 0.0, 0.0, None, {}
+        for minutos, atendido_em in tempos.iterator(chunk_size=2000):
+            contagem += 1
+            delta = minutos - media
+            media += delta / contagem
+            m2 += delta * (minutos - media)
+            ewma = minutos if ewma is None else ewma + ALFA_EWMA_SERVICO * (minutos - ewma)
+            if atendido_em:
+                contagem_hora, media_hora = horas.get(str(atendido_em.hour), (0, 0))
+                contagem_hora += 1
+                horas[str(atendido_em.hour)] = [contagem_hora, media_hora + (minutos - media_hora) / contagem_hora]
+        if not contagem:
+            continue
+        Fila.objects.filter(id=fila.id).update(
+            atendimentos_contagem=contagem,
+            tempo_servico_media=media,
+            tempo_servico_m2=m2,
+            tempo_servico_ewma=ewma,
+            tempo_servico_horas=horas
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('fila_online', '0011_remove_fila_tempo_servico_histograma'),
+    ]
+
+    operations = [
+        migrations.RunPython(preencher_estatisticas_servico, migrations.RunPython.noop),
+    ]
@@ -1,375 +1,1185 @@
 import logging
-import pandas as pd
 import numpy as np
-from sklearn.ensemble import RandomForestRegressor
-from sklearn.model_selection import train_test_split
-from sklearn.preprocessing import StandardScaler
+import gc
+import importlib
+import io
 import joblib
 import os
-from datetime import datetime, timedelta
+import multiprocessing
+import redis
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta, timezone as dt_timezone
+from itertools import islice
+from zlib import crc32
+from django.core.exceptions import ValidationError
+from django.db import connections
+from django.db.models import Avg, Count, F, Max, Q
+from django.db.models.functions import ExtractHour
 from django.utils import timezone
-from fila_online.models import Fila, Ticket, Departamento
+from django.utils.crypto import constant_time_compare, salted_hmac
+from django.utils.text import slugify
+from fila_online.models import Fila, Ticket, ExecucaoTreino, MarcaTreinoFila
 from django.conf import settings
 
 logger = logging.getLogger(__name__)
 logger.debug("Iniciando carregamento do módulo preditores_ml")
 
-# Instanciar os preditores globalmente dentro de um try-except
-try:
-    logger.debug("Instanciando preditor_tempo_espera e preditor_recomendacao_servico")
-    preditor_tempo_espera = None
-    preditor_recomendacao_servico = None
-except Exception as e:
-    logger.error(f"Erro ao inicializar o módulo preditores_ml: {e}")
-    raise
+# Opções de modelo: as previsões são feitas linha a linha no caminho dos pedidos,
+# por isso o padrão é uma floresta pequena e de profundidade limitada.
+# (módulo, classe, parâmetros): o sklearn só é importado quando se cria ou carrega
+# um modelo, porque a importação custa mais de um segundo no arranque do processo
+TIPOS_MODELO = {
+    'floresta': ('sklearn.ensemble', 'RandomForestRegressor', {'n_estimators': 100, 'random_state': 42, 'n_jobs': -1}),
+    'floresta_compacta': ('sklearn.ensemble', 'RandomForestRegressor', {
+        'n_estimators': 20, 'max_depth': 8, 'min_samples_leaf': 5, 'random_state': 42, 'n_jobs': -1
+    }),
+    'gradiente': ('sklearn.ensemble', 'HistGradientBoostingRegressor', {'max_iter': 100, 'max_depth': 6, 'random_state': 42}),
+    'linear': ('sklearn.linear_model', 'Ridge', {'alpha': 1.0}),
+}
+# Tipos cujos arrays continuam a ser os do ficheiro quando carregados com mmap_mode='r'.
+# As árvores das florestas copiam os nós para estruturas próprias ao carregar, por isso
+# mapeá-las não poupa memória nenhuma
+TIPOS_MAPEAVEIS = {'gradiente', 'linear'}
+
+def criar_modelo(tipo=None, n_jobs=None):
+    """Modelo novo do tipo pedido (padrão: settings.MODELOS_ML_TIPO).
+
+    n_jobs limita as threads de treino quando já há vários treinos em paralelo.
+    """
+    tipo = tipo or settings.MODELOS_ML_TIPO
+    if tipo not in TIPOS_MODELO:
+        raise ValueError(f"Tipo de modelo desconhecido: {tipo}")
+    modulo, classe, parametros = TIPOS_MODELO[tipo]
+    modelo = getattr(importlib.import_module(modulo), classe)(**parametros)
+    if n_jobs and 'n_jobs' in modelo.get_params():
+        modelo.set_params(n_jobs=n_jobs)
+    return modelo
+
+def modo_mmap():
+    """mmap_mode para carregar os artefactos do tipo configurado (ver TIPOS_MAPEAVEIS)."""
+    return 'r' if settings.MODELOS_ML_TIPO in TIPOS_MAPEAVEIS else None
+
+def codificar_setor(setor):
+    """Código numérico estável do setor (hash() de str muda a cada processo)."""
+    return crc32(setor.encode('utf-8')) % 100 if setor else 0
+
+def preparar_para_inferencia(modelo):
+    """Previsões numa só thread: para uma linha, distribuir árvores por threads custa mais do que poupa."""
+    if 'n_jobs' in modelo.get_params():
+        modelo.set_params(n_jobs=1)
+    return modelo
+
+class RegistroModelos:
+    """Artefactos de modelo versionados em disco, carregados sob pedido e guardados num LRU limitado em memória.
+
+    Cada chave (ex.: "fila_<id>", "setor_<nome>") tem uma pasta com versões
+    v<timestamp>.joblib e um ficheiro ATUAL que aponta para a versão em uso.
+    O tamanho de cada artefacto em memória é aproximado pelo tamanho do ficheiro.
+
+    Os ficheiros são gravados sem compressão para que joblib.load(mmap_mode='r')
+    mapeie os arrays NumPy em vez de os copiar: processos que carregam a mesma
+    versão partilham essas páginas através do page cache do sistema. Só serve aos
+    tipos de modelo que mantêm esses arrays (ver TIPOS_MAPEAVEIS).
+
+    Quando muda a versão em uso de uma chave já carregada, os pedidos continuam a
+    receber a versão anterior enquanto a nova é carregada numa thread à parte.
+
+    A versão em uso de cada chave fica em memória: publicar e o distribuidor
+    atualizam-na, e um ficheiro ATUAL mudado por outro processo sem anúncio é lido
+    de novo ao fim de VALIDADE_VERSAO_SEGUNDOS.
+    """
+    FICHEIRO_ATUAL = 'ATUAL'
+    VERSOES_GUARDADAS = 3
+    VALIDADE_VERSAO_SEGUNDOS = 60
+
+    def __init__(self, diretorio, memoria_maxima_bytes, mmap_mode=None):
+        self.diretorio = diretorio
+        self.memoria_maxima_bytes = memoria_maxima_bytes
+        self.mmap_mode = mmap_mode
+        self.distribuidor = None  # DistribuidorModelos que anuncia as versões publicadas aqui
+        self._carregados = OrderedDict()  # chave -> (versao, artefacto, tamanho)
+        self._memoria_usada = 0
+        self._em_carregamento = set()
+        self._versoes_em_uso = {}  # chave -> (versao, lida_em)
+        self._bloqueio = threading.Lock()
+
+    def _pasta(self, chave):
+        return os.path.join(self.diretorio, chave)
+
+    @staticmethod
+    def numero_versao(versao):
+        return int(versao[1:]) if versao else 0
+
+    def versao_atual(self, chave):
+        try:
+            with open(os.path.join(self._pasta(chave), self.FICHEIRO_ATUAL)) as f:
+                return f.read().strip() or None
+        except FileNotFoundError:
+            return None
+
+    def versao_em_uso(self, chave):
+        """Versão em uso lida do ficheiro ATUAL no máximo uma vez a cada VALIDADE_VERSAO_SEGUNDOS."""
+        em_uso = self._versoes_em_uso.get(chave)
+        if em_uso and time.monotonic() - em_uso[1] < self.VALIDADE_VERSAO_SEGUNDOS:
+            return em_uso[0]
+        versao = self.versao_atual(chave)
+        self._versoes_em_uso[chave] = (versao, time.monotonic())
+        return versao
+
+    def esquecer_versoes(self, chave=None):
+        """Obriga a próxima previsão a ler de novo o ficheiro ATUAL (de uma chave ou de todas)."""
+        if chave is None:
+            self._versoes_em_uso.clear()
+        else:
+            self._versoes_em_uso.pop(chave, None)
+
+    def obter(self, chave):
+        """Devolve o artefacto em uso para a chave, ou None se nunca foi treinado."""
+        versao = self.versao_em_uso(chave)
+        if not versao:
+            return None
+        with self._bloqueio:
+            carregado = self._carregados.get(chave)
+            if carregado:
+                self._carregados.move_to_end(chave)
+        if carregado is None:
+            return self._carregar(chave, versao)
+        if carregado[0] != versao:
+            self._carregar_em_segundo_plano(chave, versao)
+        return carregado[1]
+
+    def _carregar(self, chave, versao):
+        caminho = os.path.join(self._pasta(chave), f"{versao}.joblib")
+        try:
+            artefacto = joblib.load(caminho, mmap_mode=self.mmap_mode)
+            tamanho = os.path.getsize(caminho)
+        except (OSError, EOFError) as e:
+            logger.error(f"Erro ao carregar modelo {chave} ({versao}): {e}")
+            return None
+
+        with self._bloqueio:
+            anterior = self._carregados.pop(chave, None)
+            if anterior:
+                self._memoria_usada -= anterior[2]
+            self._carregados[chave] = (versao, artefacto, tamanho)
+            self._memoria_usada += tamanho
+            while self._memoria_usada > self.memoria_maxima_bytes and len(self._carregados) > 1:
+                chave_antiga, (_, _, tamanho_antigo) = self._carregados.popitem(last=False)
+                self._memoria_usada -= tamanho_antigo
+                logger.debug(f"Modelo {chave_antiga} descarregado da memória (LRU)")
+        logger.debug(f"Modelo {chave} ({versao}) carregado: {tamanho / 1024:.0f} KiB")
+        return artefacto
+
+    def _carregar_em_segundo_plano(self, chave, versao):
+        with self._bloqueio:
+            if (chave, versao) in self._em_carregamento:
+                return
+            self._em_carregamento.add((chave, versao))
+
+        def carregar():
+            try:
+                self._carregar(chave, versao)
+            finally:
+                with self._bloqueio:
+                    self._em_carregamento.discard((chave, versao))
+
+        threading.Thread(target=carregar, name=f"carregar-{chave}", daemon=True).start()
+
+    def salvar(self, chave, artefacto):
+        """Grava uma nova versão e passa a usá-la."""
+        versao = self.gravar(chave, artefacto)
+        self.publicar(chave, versao)
+        return versao
+
+    @staticmethod
+    def nova_versao():
+        return f"v{int(time.time() * 1000)}"
+
+    @staticmethod
+    def serializar(artefacto):
+        """Bytes do ficheiro que gravar escreveria, para levar o artefacto a outro processo."""
+        buffer = io.BytesIO()
+        joblib.dump(artefacto, buffer, compress=0)
+        return buffer.getvalue()
+
+    def gravar(self, chave, artefacto):
+        """Grava uma nova versão sem a pôr em uso (ver publicar)."""
+        pasta = self._pasta(chave)
+        os.makedirs(pasta, exist_ok=True)
+        versao = self.nova_versao()
+        caminho_temporario = os.path.join(pasta, f".{versao}.tmp")
+        joblib.dump(artefacto, caminho_temporario, compress=0)
+        os.replace(caminho_temporario, os.path.join(pasta, f"{versao}.joblib"))
+        return versao
+
+    def escrever(self, chave, versao, dados):
+        """Grava no disco local uma versão recebida de outro processo (bytes do ficheiro), sem a pôr em uso."""
+        pasta = self._pasta(chave)
+        os.makedirs(pasta, exist_ok=True)
+        caminho = os.path.join(pasta, f"{versao}.joblib")
+        if not os.path.exists(caminho):
+            caminho_temporario = os.path.join(pasta, f".{versao}.{os.getpid()}.tmp")
+            with open(caminho_temporario, 'wb') as f:
+                f.write(dados)
+            os.replace(caminho_temporario, caminho)
+
+    def instalar(self, chave, versao, dados):
+        """Põe em uso uma versão recebida de outro processo (bytes do ficheiro), já carregada em memória."""
+        self.escrever(chave, versao, dados)
+        if self._carregar(chave, versao) is not None:
+            self.publicar(chave, versao, anunciar=False)
+
+    def publicar(self, chave, versao, anunciar=True):
+        """Passa a usar a versão indicada; mantém as VERSOES_GUARDADAS mais recentes.
+
+        Com anunciar, a versão é enviada aos outros processos pelo distribuidor.
+        """
+        pasta = self._pasta(chave)
+        caminho_atual = os.path.join(pasta, self.FICHEIRO_ATUAL)
+        with open(f"{caminho_atual}.{os.getpid()}.tmp", 'w') as f:
+            f.write(versao)
+        os.replace(f"{caminho_atual}.{os.getpid()}.tmp", caminho_atual)
+        self._versoes_em_uso[chave] = (versao, time.monotonic())
+
+        versoes = sorted(
+            (nome for nome in os.listdir(pasta) if nome.endswith('.joblib')),
+            key=lambda nome: self.numero_versao(nome[:-len('.joblib')])
+        )
+        for nome in versoes[:-self.VERSOES_GUARDADAS]:
+            try:
+                os.remove(os.path.join(pasta, nome))
+            except FileNotFoundError:
+                pass  # Outro processo com o mesmo disco já o apagou
+        logger.info(f"Modelo {chave} publicado na versão {versao}")
+        if anunciar and self.distribuidor:
+            self.distribuidor.enviar(chave, versao)
+
+    def memoria_usada(self):
+        with self._bloqueio:
+            return self._memoria_usada, len(self._carregados)
+
+    def chaves(self):
+        """Chaves com uma versão em uso."""
+        if not os.path.isdir(self.diretorio):
+            return []
+        return sorted(chave for chave in os.listdir(self.diretorio) if self.versao_atual(chave))
+
+    def precarregar(self):
+        """Carrega as versões em uso até ao limite de memória. Devolve quantas ficaram carregadas."""
+        for chave in self.chaves():
+            if self.obter(chave) is not None and self.memoria_usada()[0] >= self.memoria_maxima_bytes:
+                break
+        return self.memoria_usada()[1]
+
+class DistribuidorModelos:
+    """Leva as versões publicadas num processo (o worker Celery que treina) aos restantes (workers web).
+
+    Os serviços não partilham disco, por isso publicar grava também o ficheiro
+    no Redis, num hash com a versão e os bytes escritos de uma só vez, e anuncia-o
+    no CANAL. Cada processo que faz previsões tem uma thread que ouve o canal,
+    descarrega a versão nova para o seu disco, carrega-a e só então a põe em uso.
+    Os anúncios perdidos (ligação em baixo, processo a arrancar) são recuperados
+    pela reconciliação que corre ao subscrever e a cada INTERVALO_RECONCILIACAO_SEGUNDOS.
+
+    Os artefactos são pickles e joblib.load executa o que lá estiver: cada um vai
+    para o Redis com uma assinatura HMAC derivada da SECRET_KEY, partilhada pelos
+    serviços, e quem os recebe recusa os que não a tenham válida.
+
+    Nos treinos distribuídos pelo Celery, o Redis serve também de área de troca da
+    execução: o histórico lido uma vez para todos os alvos e os artefactos treinados
+    por cada worker, que o worker que publica lê de lá em vez do seu disco.
+    """
+    PREFIXO_CHAVE = 'modelos_ml'
+    CANAL = 'modelos_ml:publicados'
+    INTERVALO_RECONCILIACAO_SEGUNDOS = 60
+    ESPERA_APOS_ERRO_SEGUNDOS = 5
+    VALIDADE_TREINO_SEGUNDOS = 6 * 3600
+
+    def __init__(self, registro, nome):
+        self.registro = registro
+        self.nome = nome
+        self._cliente = None
+        self._pid_ouvinte = None
+        self._bloqueio = threading.Lock()
+        registro.distribuidor = self
+
+    def _redis(self):
+        # Bytes, sem decode_responses: os artefactos são binários
+        if self._cliente is None:
+            self._cliente = redis.Redis.from_url(settings.REDIS_URL)
+        return self._cliente
+
+    def fechar(self):
+        """Fecha as ligações ao Redis; a próxima chamada abre outras."""
+        if self._cliente is not None:
+            self._cliente.connection_pool.disconnect()
+            self._cliente = None
+
+    def _chave(self, chave):
+        return f"{self.PREFIXO_CHAVE}:{self.nome}:{chave}"
+
+    def _chave_indice(self):
+        return f"{self.PREFIXO_CHAVE}:{self.nome}:chaves"
+
+    def _assinar(self, chave, versao, dados):
+        valor = f"{self.nome}:{chave}:{versao}:".encode() + dados
+        return salted_hmac('fila_online.DistribuidorModelos', valor, algorithm='sha256').hexdigest()
+
+    def _assinatura_valida(self, chave, versao, dados, assinatura):
+        if assinatura and constant_time_compare(self._assinar(chave, versao, dados), assinatura):
+            return True
+        logger.error(f"Modelo {chave} ({versao}) recusado: assinatura em falta ou inválida")
+        return False
+
+    def _chave_treino(self, execucao_id):
+        return f"{self.PREFIXO_CHAVE}:{self.nome}:treino:{execucao_id}"
+
+    def guardar_dados_treino(self, execucao_id, dados):
+        """Guarda o histórico de treino da execução, {fila_id: (X, y)}, em arrays NumPy sem pickle."""
+        campos = {}
+        for fila_id, (X, y) in dados.items():
+            buffer = io.BytesIO()
+            np.savez(buffer, X=X, y=y)
+            campos[f"dados:{fila_id}"] = buffer.getvalue()
+        pipe = self._redis().pipeline()
+        if campos:
+            pipe.hset(self._chave_treino(execucao_id), mapping=campos)
+        pipe.expire(self._chave_treino(execucao_id), self.VALIDADE_TREINO_SEGUNDOS)
+        pipe.execute()
+
+    def ler_dados_treino(self, execucao_id, filas_ids):
+        """Partes (X, y) das filas indicadas guardadas por guardar_dados_treino; as filas sem dados ficam de fora."""
+        if not filas_ids:
+            return []
+        partes = []
+        for dados in self._redis().hmget(self._chave_treino(execucao_id), [f"dados:{fila_id}" for fila_id in filas_ids]):
+            if dados:
+                with np.load(io.BytesIO(dados), allow_pickle=False) as arrays:
+                    partes.append((arrays['X'], arrays['y']))
+        return partes
+
+    def guardar_artefacto_treino(self, execucao_id, chave, versao, dados):
+        """Guarda os bytes de uma versão treinada por um worker até a execução ser publicada."""
+        pipe = self._redis().pipeline()
+        pipe.hset(self._chave_treino(execucao_id), mapping={
+            f"artefacto:{chave}:{versao}": dados,
+            f"assinatura:{chave}:{versao}": self._assinar(chave, versao, dados),
+        })
+        pipe.expire(self._chave_treino(execucao_id), self.VALIDADE_TREINO_SEGUNDOS)
+        pipe.execute()
+
+    def ler_artefacto_treino(self, execucao_id, chave, versao):
+        """Bytes guardados por guardar_artefacto_treino, ou None se faltam ou a assinatura não confere."""
+        dados, assinatura = self._redis().hmget(
+            self._chave_treino(execucao_id), [f"artefacto:{chave}:{versao}", f"assinatura:{chave}:{versao}"]
+        )
+        if dados is None or not self._assinatura_valida(chave, versao, dados, assinatura and assinatura.decode()):
+            return None
+        return dados
+
+    def descartar_treino(self, execucao_id):
+        self._redis().delete(self._chave_treino(execucao_id))
+
+    def enviar(self, chave, versao):
+        """Guarda a versão no Redis e anuncia-a; sem Redis, os outros processos ficam com a versão anterior."""
+        if not settings.MODELOS_ML_DISTRIBUIR:
+            return
+        try:
+            with open(os.path.join(self.registro._pasta(chave), f"{versao}.joblib"), 'rb') as f:
+                dados = f.read()
+            pipe = self._redis().pipeline()
+            pipe.hset(self._chave(chave), mapping={
+                'versao': versao, 'dados': dados, 'assinatura': self._assinar(chave, versao, dados)
+            })
+            pipe.sadd(self._chave_indice(), chave)
+            pipe.publish(self.CANAL, f"{self.nome} {chave} {versao}")
+            pipe.execute()
+            logger.debug(f"Modelo {chave} ({versao}) enviado para o Redis: {len(dados) / 1024:.0f} KiB")
+        except (OSError, redis.RedisError) as e:
+            logger.warning(f"Erro ao distribuir modelo {chave} ({versao}): {e}")
+
+    def receber(self, chave, versao_anunciada=None):
+        """Instala a versão guardada no Redis se for mais recente do que a local e a assinatura conferir."""
+        self.registro.esquecer_versoes(chave)  # Outro processo com o mesmo disco pode já a ter instalado
+        local = self.registro.numero_versao(self.registro.versao_atual(chave))
+        if versao_anunciada and self.registro.numero_versao(versao_anunciada) <= local:
+            return False
+        versao, dados, assinatura = self._redis().hmget(self._chave(chave), ['versao', 'dados', 'assinatura'])
+        if not versao or not dados or self.registro.numero_versao(versao.decode()) <= local:
+            return False
+        if not self._assinatura_valida(chave, versao.decode(), dados, assinatura and assinatura.decode()):
+            return False
+        self.registro.instalar(chave, versao.decode(), dados)
+        logger.info(f"Modelo {chave} atualizado para {versao.decode()} a partir do Redis")
+        return True
+
+    def reconciliar(self):
+        """Compara as versões do Redis com as locais e instala as que estão em falta. Devolve quantas instalou."""
+        self.registro.esquecer_versoes()
+        chaves = sorted(chave.decode() for chave in self._redis().smembers(self._chave_indice()))
+        if not chaves:
+            return 0
+        pipe = self._redis().pipeline()
+        for chave in chaves:
+            pipe.hget(self._chave(chave), 'versao')
+        instaladas = 0
+        for chave, versao in zip(chaves, pipe.execute()):
+            if versao:
+                instaladas += self.receber(chave, versao.decode())
+        return instaladas
+
+    def iniciar(self):
+        """Arranca a thread que ouve o canal, uma vez por processo (também depois de um fork)."""
+        if not settings.MODELOS_ML_DISTRIBUIR or self._pid_ouvinte == os.getpid():
+            return
+        with self._bloqueio:
+            if self._pid_ouvinte == os.getpid():
+                return
+            self._pid_ouvinte = os.getpid()
+            self._cliente = None  # A ligação herdada do processo pai não pode ser partilhada
+            threading.Thread(target=self._ouvir, name=f"modelos-{self.nome}", daemon=True).start()
+
+    def _ouvir(self):
+        while True:
+            try:
+                pubsub = self._redis().pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(self.CANAL)
+                self.reconciliar()
+                ultima_reconciliacao = time.monotonic()
+                while True:
+                    mensagem = pubsub.get_message(timeout=self.INTERVALO_RECONCILIACAO_SEGUNDOS)
+                    if mensagem and mensagem['type'] == 'message':
+                        nome, chave, versao = mensagem['data'].decode().split(' ')
+                        if nome == self.nome:
+                            self.receber(chave, versao)
+                    if time.monotonic() - ultima_reconciliacao >= self.INTERVALO_RECONCILIACAO_SEGUNDOS:
+                        self.reconciliar()
+                        ultima_reconciliacao = time.monotonic()
+            except redis.RedisError as e:
+                logger.warning(f"Ligação ao canal de modelos perdida: {e}")
+            except Exception as e:
+                logger.error(f"Erro ao sincronizar modelos {self.nome}: {e}")
+            time.sleep(self.ESPERA_APOS_ERRO_SEGUNDOS)
 
-# Definição das classes fora do try-except
 class PreditorTempoEspera:
-    CAMINHO_MODELO = os.path.join(settings.BASE_DIR, "preditor_tempo_espera.joblib")
-    CAMINHO_SCALER = os.path.join(settings.BASE_DIR, "scaler_tempo_espera.joblib")
+    """Um modelo por fila; filas sem histórico suficiente usam o modelo partilhado do seu setor."""
+    DIRETORIO_MODELOS = os.path.join(settings.MODELOS_ML_DIR, "tempo_espera")
     AMOSTRAS_MINIMAS = 10
     DIAS_MAXIMOS = 30
+    TAMANHO_BLOCO_TREINO = 5000
 
     def __init__(self):
-        self.modelo = RandomForestRegressor(n_estimators=100, random_state=42, n_jobs=-1)
-        self.scaler = StandardScaler()
-        self.esta_treinado = {}
-        self.tempos_fallback = {}  # Cache de tempos médios por fila
-        self.carregar_modelo()
-
-    def carregar_modelo(self):
-        """Carrega o modelo e o scaler salvos, se existirem."""
-        try:
-            if os.path.exists(self.CAMINHO_MODELO) and os.path.exists(self.CAMINHO_SCALER):
-                self.modelo = joblib.load(self.CAMINHO_MODELO)
-                self.scaler = joblib.load(self.CAMINHO_SCALER)
-                self.esta_treinado = {str(fila.id): True for fila in Fila.objects.all()}
-                logger.info("Modelo de previsão de tempo de espera carregado com sucesso.")
-            else:
-                logger.info("Modelo de tempo de espera não encontrado. Será treinado por fila na primeira execução.")
-            # Inicializar fallbacks
-            self._calcular_tempos_fallback()
-        except Exception as e:
-            logger.error(f"Erro ao carregar o modelo de tempo de espera: {e}")
-            self.esta_treinado = {}
+        self.registro = RegistroModelos(
+            self.DIRETORIO_MODELOS,
+            settings.MODELOS_ML_MEMORIA_MB * 1024 * 1024,
+            mmap_mode=modo_mmap()
+        )
+        self.distribuidor = DistribuidorModelos(self.registro, 'tempo_espera')
+        self._tempos_fallback = None  # Cache de tempos médios por fila, calculado no primeiro uso
 
-    def salvar_modelo(self):
-        """Salva o modelo e o scaler em disco."""
-        try:
-            joblib.dump(self.modelo, self.CAMINHO_MODELO)
-            joblib.dump(self.scaler, self.CAMINHO_SCALER)
-            logger.info("Modelo de previsão de tempo de espera salvo com sucesso.")
-        except Exception as e:
-            logger.error(f"Erro ao salvar o modelo de tempo de espera: {e}")
+    @staticmethod
+    def chave_fila(fila_id):
+        return f"fila_{fila_id}"
+
+    @staticmethod
+    def chave_setor(setor):
+        return f"setor_{slugify(setor or 'geral') or 'geral'}"
+
+    def modelo_para(self, fila):
+        """Artefacto usado para a fila: o próprio, senão o do setor, senão None."""
+        self.distribuidor.iniciar()
+        artefacto = self.registro.obter(self.chave_fila(fila.id))
+        if artefacto is None:
+            artefacto = self.registro.obter(self.chave_setor(fila.departamento.setor))
+        return artefacto
+
+    @property
+    def tempos_fallback(self):
+        # Não se consulta o banco ao criar o preditor: com --preload isso aconteceria no mestre do gunicorn
+        if self._tempos_fallback is None:
+            self._calcular_tempos_fallback()
+        return self._tempos_fallback or {}
 
     def _calcular_tempos_fallback(self):
         """Calcula tempos médios de espera por fila para uso como fallback."""
         try:
-            filas = Fila.objects.all()
-            for fila in filas:
-                tickets = Ticket.objects.filter(
-                    fila_id=fila.id,
-                    status='Atendido',
-                    tempo_servico__isnull=False,
-                    tempo_servico__gt=0
-                )[:100]
-                if tickets:
-                    tempo_medio = np.mean([t.tempo_servico for t in tickets])
-                    self.tempos_fallback[str(fila.id)] = round(tempo_medio, 1)
-                else:
-                    self.tempos_fallback[str(fila.id)] = fila.tempo_espera_medio or 30
-            logger.debug(f"Tempos fallback calculados para {len(self.tempos_fallback)} filas")
+            filas = Fila.objects.values_list('id', 'atendimentos_contagem', 'tempo_servico_media', 'tempo_espera_medio')
+            self._tempos_fallback = {
+                str(fila_id): round(media, 1) if contagem else (tempo_espera_medio or 30)
+                for fila_id, contagem, media, tempo_espera_medio in filas.iterator(chunk_size=2000)
+            }
+            logger.debug(f"Tempos fallback calculados para {len(self._tempos_fallback)} filas")
         except Exception as e:
             logger.error(f"Erro ao calcular tempos fallback: {e}")
+            self._tempos_fallback = {}
 
-    def preparar_dados(self, fila_id, dias=DIAS_MAXIMOS):
-        """Prepara os dados históricos para treinamento por fila."""
-        try:
-            fila = Fila.objects.get(id=fila_id)
-        except Fila.DoesNotExist:
-            logger.error(f"Fila não encontrada: fila_id={fila_id}")
-            return None, None
+    def preparar_dados_filas(self, filas_ids=None, dias=DIAS_MAXIMOS, amostras_minimas=AMOSTRAS_MINIMAS):
+        """Dados de treino de várias filas numa só consulta, lidos em blocos para arrays NumPy.
+
+        Devolve {fila_id: (X, y)} só com as filas que têm pelo menos amostras_minimas.
+        """
+        filas = Fila.objects.all() if filas_ids is None else Fila.objects.filter(id__in=filas_ids)
+        constantes = {
+            fila_id: (ticket_atual, tickets_ativos, num_balcoes or 1, limite_diario or 100, codificar_setor(setor))
+            for fila_id, ticket_atual, tickets_ativos, num_balcoes, limite_diario, setor in filas.values_list(
+                'id', 'ticket_atual', 'tickets_ativos', 'num_balcoes', 'limite_diario', 'departamento__setor'
+            )
+        }
+        if not constantes:
+            return {}
 
-        data_inicio = timezone.now() - timedelta(days=dias)
-        tickets = Ticket.objects.filter(
-            fila_id=fila_id,
+        consulta = Ticket.objects.filter(
+            fila_id__in=list(constantes),
             status='Atendido',
-            emitido_em__gte=data_inicio,
-            tempo_servico__isnull=False,
+            emitido_em__gte=timezone.now() - timedelta(days=dias),
             tempo_servico__gt=0
-        )
+        ).annotate(
+            hora_do_dia=ExtractHour('emitido_em', tzinfo=dt_timezone.utc)
+        ).values_list('fila_id', 'numero_ticket', 'prioridade', 'hora_do_dia', 'tempo_servico')
 
-        if tickets.count() < self.AMOSTRAS_MINIMAS:
-            logger.warning(f"Dados insuficientes para fila_id={fila_id}: {tickets.count()} amostras")
-            return None, None
+        indices = {fila_id: i for i, fila_id in enumerate(constantes)}
+        blocos = {}
+        linhas = consulta.iterator(chunk_size=self.TAMANHO_BLOCO_TREINO)
+        while True:
+            bloco = list(islice(linhas, self.TAMANHO_BLOCO_TREINO))
+            if not bloco:
+                break
+            codigos = np.fromiter((indices[linha[0]] for linha in bloco), dtype=np.int64, count=len(bloco))
+            valores = np.array([linha[1:] for linha in bloco], dtype=float)
+            valores[:, 1] = np.nan_to_num(valores[:, 1])  # prioridade nula
+            for codigo in np.unique(codigos):
+                blocos.setdefault(codigo, []).append(valores[codigos == codigo])
 
-        dados = []
-        for ticket in tickets:
-            posicao = max(0, ticket.numero_ticket - fila.ticket_atual)
-            hora_do_dia = ticket.emitido_em.hour
-            setor_codificado = hash(fila.departamento.setor) % 100 if fila.departamento.setor else 0
-            dados.append({
-                'posicao': posicao,
-                'tickets_ativos': fila.tickets_ativos,
-                'prioridade': ticket.prioridade or 0,
-                'hora_do_dia': hora_do_dia,
-                'num_balcoes': fila.num_balcoes or 1,
-                'limite_diario': fila.limite_diario or 100,
-                'setor_codificado': setor_codificado,
-                'tempo_servico': ticket.tempo_servico
-            })
+        filas_ids = list(constantes)
+        dados = {}
+        for codigo, partes in blocos.items():
+            valores = np.concatenate(partes)
+            if len(valores) < amostras_minimas:
+                continue
+            fila_id = filas_ids[codigo]
+            ticket_atual, tickets_ativos, num_balcoes, limite_diario, setor_codificado = constantes[fila_id]
+            X = np.empty((len(valores), 7), dtype=float)
+            X[:, 0] = np.maximum(valores[:, 0] - ticket_atual, 0)
+            X[:, 1] = tickets_ativos
+            X[:, 2] = valores[:, 1]
+            X[:, 3] = valores[:, 2]
+            X[:, 4] = num_balcoes
+            X[:, 5] = limite_diario
+            X[:, 6] = setor_codificado
+            dados[fila_id] = (X, valores[:, 3])
+        logger.debug(f"Dados preparados para {len(dados)} filas: {sum(len(y) for _, y in dados.values())} amostras")
+        return dados
 
-        df = pd.DataFrame(dados)
-        X = df[['posicao', 'tickets_ativos', 'prioridade', 'hora_do_dia', 'num_balcoes', 'limite_diario', 'setor_codificado']]
-        y = df['tempo_servico']
-        logger.debug(f"Dados preparados para fila_id={fila_id}: {len(dados)} amostras")
+    def preparar_dados(self, fila_id, dias=DIAS_MAXIMOS, amostras_minimas=AMOSTRAS_MINIMAS):
+        """Prepara os dados históricos para treinamento por fila."""
+        X, y = next(iter(self.preparar_dados_filas([fila_id], dias, amostras_minimas).values()), (None, None))
+        if X is None:
+            logger.warning(f"Dados insuficientes para fila_id={fila_id}")
         return X, y
 
-    def treinar(self, fila_id):
-        """Treina o modelo com dados históricos de uma fila específica."""
+    def _ajustar(self, chave, X, y, publicar=True, n_jobs=None):
+        """Treina um modelo e um scaler novos e grava-os no registo. Devolve (versão, R²)."""
+        artefacto = self._criar_artefacto(X, y, n_jobs)
+        versao = self.registro.salvar(chave, artefacto) if publicar else self.registro.gravar(chave, artefacto)
+        return versao, artefacto['pontuacao']
+
+    def _criar_artefacto(self, X, y, n_jobs=None):
+        """Treina um modelo e um scaler novos. Devolve o artefacto, ainda por gravar."""
+        from sklearn.model_selection import train_test_split
+        from sklearn.preprocessing import StandardScaler
+        X_treino, X_teste, y_treino, y_teste = train_test_split(X, y, test_size=0.2, random_state=42)
+        scaler = StandardScaler()
+        modelo = criar_modelo(n_jobs=n_jobs)
+        X_treino_escalado = scaler.fit_transform(X_treino)
+        modelo.fit(X_treino_escalado, y_treino)
+        preparar_para_inferencia(modelo)
+        pontuacao = modelo.score(scaler.transform(X_teste), y_teste)
+        return {
+            'tipo': settings.MODELOS_ML_TIPO,
+            'modelo': modelo,
+            'scaler': scaler,
+            'amostras': len(X),
+            'pontuacao': pontuacao,
+            'treinado_em': timezone.now().isoformat()
+        }
+
+    def treinar(self, fila_id, publicar=True, n_jobs=None):
+        """Treina o modelo de uma fila específica. Devolve a versão gravada, ou None."""
         try:
             X, y = self.preparar_dados(fila_id)
             if X is None or y is None:
-                self.esta_treinado[fila_id] = False
-                return False
-
-            X_treino, X_teste, y_treino, y_teste = train_test_split(X, y, test_size=0.2, random_state=42)
-            X_treino_escalado = self.scaler.fit_transform(X_treino)
-            X_teste_escalado = self.scaler.transform(X_teste)
-            self.modelo.fit(X_treino_escalado, y_treino)
-            self.esta_treinado[fila_id] = True
-            pontuacao = self.modelo.score(X_teste_escalado, y_teste)
+                return None
+            versao, pontuacao = self._ajustar(self.chave_fila(fila_id), X, y, publicar, n_jobs)
             logger.info(f"Modelo treinado para fila_id={fila_id}. Pontuação R²: {pontuacao:.2f}")
-            self.salvar_modelo()
-            self._calcular_tempos_fallback()  # Atualizar fallbacks após treinamento
-            return True
+            if publicar:
+                self._calcular_tempos_fallback()  # Atualizar fallbacks após treinamento
+            return versao
         except Exception as e:
             logger.error(f"Erro ao treinar modelo para fila_id={fila_id}: {e}")
-            self.esta_treinado[fila_id] = False
-            return False
+            return None
+
+    def _treinar_setor(self, setor, partes, publicar=True, n_jobs=None):
+        if sum(len(y) for _, y in partes) < self.AMOSTRAS_MINIMAS:
+            logger.warning(f"Dados insuficientes para o setor {setor}")
+            return None
+        X = np.concatenate([X for X, _ in partes])
+        y = np.concatenate([y for _, y in partes])
+        versao, pontuacao = self._ajustar(self.chave_setor(setor), X, y, publicar, n_jobs)
+        logger.info(f"Modelo do setor {setor} treinado com {len(X)} amostras. Pontuação R²: {pontuacao:.2f}")
+        return versao
+
+    def treinar_setor(self, setor, publicar=True, n_jobs=None):
+        """Treina o modelo partilhado de um setor com os dados de todas as suas filas."""
+        try:
+            filas_ids = Fila.objects.filter(departamento__setor=setor).values_list('id', flat=True)
+            partes = list(self.preparar_dados_filas(filas_ids, amostras_minimas=1).values())
+            return self._treinar_setor(setor, partes, publicar, n_jobs)
+        except Exception as e:
+            logger.error(f"Erro ao treinar modelo do setor {setor}: {e}")
+            return None
+
+    def dados_dos_alvos(self, alvos):
+        """Lê numa só consulta o histórico de que os alvos de planear_treino precisam.
+
+        Devolve ({fila_id: (X, y)}, {alvo: [fila_id]}), com os ids como texto e as
+        filas de cada alvo: a própria, ou as do setor que têm dados.
+        """
+        filas_alvo = {nome for tipo, nome in alvos if tipo == 'fila'}
+        setores_alvo = {nome for tipo, nome in alvos if tipo == 'setor'}
+        setores = {str(fila_id): setor for fila_id, setor in Fila.objects.values_list('id', 'departamento__setor')}
+        lidas = [fila_id for fila_id, setor in setores.items() if fila_id in filas_alvo or setor in setores_alvo]
+        dados = {str(fila_id): valores for fila_id, valores in self.preparar_dados_filas(lidas, amostras_minimas=1).items()}
+        filas_por_alvo = {}
+        for tipo, nome in alvos:
+            if tipo == 'fila':
+                filas = [nome] if nome in dados else []
+            else:
+                filas = [fila_id for fila_id, setor in setores.items() if setor == nome and fila_id in dados]
+            filas_por_alvo[(tipo, nome)] = filas
+        return dados, filas_por_alvo
+
+    def treinar_alvo(self, alvo, partes, n_jobs=None):
+        """Treina um alvo de planear_treino com as partes (X, y) já lidas. Devolve (chave, artefacto) ou None."""
+        tipo, nome = alvo
+        chave = self.chave_fila(nome) if tipo == 'fila' else self.chave_setor(nome)
+        if sum(len(y) for _, y in partes) < self.AMOSTRAS_MINIMAS:
+            logger.warning(f"Dados insuficientes para {chave}")
+            return None
+        X = np.concatenate([X for X, _ in partes])
+        y = np.concatenate([y for _, y in partes])
+        artefacto = self._criar_artefacto(X, y, n_jobs)
+        logger.info(f"Modelo {chave} treinado com {len(X)} amostras. Pontuação R²: {artefacto['pontuacao']:.2f}")
+        return chave, artefacto
+
+    def treinar_todas(self):
+        """Treina as filas e setores escolhidos por planear_treino a partir de uma só leitura do histórico."""
+        execucao, alvos = self.planear_treino('sequencial')
+        dados, filas_por_alvo = self.dados_dos_alvos(alvos)
+
+        versoes = []
+        for tipo, nome in alvos:
+            try:
+                treinado = self.treinar_alvo((tipo, nome), [dados[fila_id] for fila_id in filas_por_alvo[(tipo, nome)]])
+                if treinado:
+                    chave, artefacto = treinado
+                    versoes.append((chave, self.registro.gravar(chave, artefacto)))
+            except Exception as e:
+                logger.error(f"Erro ao treinar modelo {tipo} {nome}: {e}")
+        self.publicar_versoes(versoes, execucao.id)
+        return {'alvos': len(alvos), 'publicados': len(versoes), 'ignoradas': execucao.filas_ignoradas}
+
+    def _motivo_treino(self, linha, marca):
+        """Porque é que a fila precisa de um modelo novo, ou None se o publicado ainda serve."""
+        if marca is None:
+            return 'sem modelo'
+        if linha['novas'] >= settings.TREINO_MINIMO_NOVAS_AMOSTRAS:
+            return f"{linha['novas']} amostras novas"
+        media_anterior = marca['tempo_servico_media']
+        if media_anterior and linha['media'] is not None:
+            deriva = abs(linha['media'] - media_anterior) / media_anterior
+            if deriva >= settings.TREINO_LIMITE_DERIVA:
+                return f"deriva de {deriva:.0%} no tempo de serviço"
+        return None
+
+    def planear_treino(self, modo):
+        """Escolhe o que treinar e regista a execução.
+
+        Uma fila só é treinada de novo se não tem marca de treino, se tem pelo menos
+        TREINO_MINIMO_NOVAS_AMOSTRAS atendimentos depois da marca ou se o tempo médio de
+        serviço se afastou TREINO_LIMITE_DERIVA do que o modelo publicado viu. O setor é
+        treinado de novo quando alguma das suas filas o é. Devolve (ExecucaoTreino, alvos),
+        com os alvos como [tipo, nome] para treinos independentes.
+        """
+        estatisticas = Ticket.objects.filter(
+            status='Atendido',
+            emitido_em__gte=timezone.now() - timedelta(days=self.DIAS_MAXIMOS),
+            tempo_servico__gt=0
+        ).values('fila_id').annotate(
+            amostras=Count('id'),
+            novas=Count('id', filter=(
+                Q(fila__marca_treino__isnull=True) |
+                Q(atendido_em__gt=F('fila__marca_treino__ultimo_atendimento'))
+            )),
+            ultimo=Max('atendido_em'),
+            media=Avg('tempo_servico')
+        )
+        marcas = {
+            str(marca['fila_id']): marca
+            for marca in MarcaTreinoFila.objects.values('fila_id', 'tempo_servico_media')
+        }
+        setores = {str(fila_id): setor for fila_id, setor in Fila.objects.values_list('id', 'departamento__setor')}
+
+        treinar, ignoradas = {}, {}
+        for linha in estatisticas:
+            fila_id = str(linha['fila_id'])
+            resumo = {
+                'setor': setores.get(fila_id),
+                'amostras': linha['amostras'],
+                'novas': linha['novas'],
+                'ultimo': linha['ultimo'].isoformat() if linha['ultimo'] else None,
+                'media': linha['media'],
+            }
+            motivo = self._motivo_treino(linha, marcas.get(fila_id))
+            resumo['motivo'] = motivo or 'sem dados novos'
+            (treinar if motivo else ignoradas)[fila_id] = resumo
+        for fila_id, setor in setores.items():
+            if fila_id not in treinar and fila_id not in ignoradas:
+                ignoradas[fila_id] = {'setor': setor, 'motivo': 'sem histórico'}
+
+        alvos = [['fila', fila_id] for fila_id, resumo in treinar.items() if resumo['amostras'] >= self.AMOSTRAS_MINIMAS]
+        alvos += [['setor', setor] for setor in dict.fromkeys(resumo['setor'] for resumo in treinar.values())]
+        execucao = ExecucaoTreino.objects.create(
+            modo=modo,
+            filas_avaliadas=len(setores),
+            filas_treinadas=len(treinar),
+            filas_ignoradas=len(ignoradas),
+            detalhes={'treinar': treinar, 'ignoradas': ignoradas}
+        )
+        logger.info(f"Treino {execucao.id}: {len(treinar)} filas a treinar, {len(ignoradas)} ignoradas, {len(alvos)} alvos")
+        return execucao, alvos
+
+    def publicar_versoes(self, versoes, execucao_id=None):
+        """Põe em uso, de uma vez, as versões gravadas pelos treinos: [(chave, versão)].
+
+        Com execucao_id, avança a marca de treino das filas planeadas cujo modelo
+        (o próprio ou, nas filas com pouco histórico, o do setor) foi publicado.
+        """
+        for chave, versao in versoes:
+            self.registro.publicar(chave, versao)
+        self._calcular_tempos_fallback()
+        logger.info(f"{len(versoes)} modelos de tempo de espera publicados")
+        if not execucao_id:
+            return
+
+        execucao = ExecucaoTreino.objects.get(id=execucao_id)
+        publicadas = {chave for chave, _ in versoes}
+        agora = timezone.now()
+        for fila_id, resumo in execucao.detalhes.get('treinar', {}).items():
+            if resumo['amostras'] >= self.AMOSTRAS_MINIMAS:
+                chave = self.chave_fila(fila_id)
+            else:
+                chave = self.chave_setor(resumo['setor'])
+            if chave not in publicadas:
+                continue
+            MarcaTreinoFila.objects.update_or_create(fila_id=fila_id, defaults={
+                'ultimo_atendimento': datetime.fromisoformat(resumo['ultimo']) if resumo['ultimo'] else None,
+                'amostras': resumo['amostras'],
+                'tempo_servico_media': resumo['media'],
+                'treinado_em': agora,
+            })
+        execucao.modelos_publicados = len(versoes)
+        execucao.concluida_em = agora
+        execucao.save(update_fields=['modelos_publicados', 'concluida_em'])
+
+    def treinar_paralelo(self, processos=None):
+        """Treina cada fila e setor planeado num processo à parte e só no fim publica as novas versões."""
+        execucao, alvos = self.planear_treino('paralelo')
+        dados, filas_por_alvo = self.dados_dos_alvos(alvos)
+        partes = [[dados[fila_id] for fila_id in filas_por_alvo[tuple(alvo)]] for alvo in alvos]
+        connections.close_all()  # Os processos filhos não herdam a ligação ao banco
+        with ProcessPoolExecutor(max_workers=processos, mp_context=multiprocessing.get_context('fork')) as executor:
+            resultados = list(executor.map(treinar_alvo_tempo_espera, alvos, partes))
+        versoes = [resultado for resultado in resultados if resultado]
+        self.publicar_versoes(versoes, execucao.id)
+        return {'alvos': len(alvos), 'publicados': len(versoes), 'ignoradas': execucao.filas_ignoradas}
+
+    def preparar_treino_distribuido(self, execucao, alvos):
+        """Lê o histórico dos alvos uma vez e guarda-o no Redis para os workers do chord.
+
+        Devolve os argumentos de cada tarefa de treino: [tipo, nome, filas_ids].
+        """
+        dados, filas_por_alvo = self.dados_dos_alvos(alvos)
+        self.distribuidor.guardar_dados_treino(execucao.id, dados)
+        return [[tipo, nome, filas_por_alvo[(tipo, nome)]] for tipo, nome in alvos]
+
+    def treinar_alvo_distribuido(self, execucao_id, alvo, filas_ids):
+        """Treina um alvo com o histórico da execução e deixa o artefacto no Redis. Devolve (chave, versão) ou None."""
+        treinado = self.treinar_alvo(alvo, self.distribuidor.ler_dados_treino(execucao_id, filas_ids), n_jobs=1)
+        if not treinado:
+            return None
+        chave, artefacto = treinado
+        versao = self.registro.nova_versao()
+        self.distribuidor.guardar_artefacto_treino(execucao_id, chave, versao, self.registro.serializar(artefacto))
+        return chave, versao
+
+    def publicar_treino_distribuido(self, execucao_id, versoes):
+        """Copia para o disco local os artefactos treinados pelos workers e publica-os de uma vez."""
+        recebidas = []
+        for chave, versao in versoes:
+            dados = self.distribuidor.ler_artefacto_treino(execucao_id, chave, versao)
+            if dados is None:
+                logger.warning(f"Artefacto {chave} ({versao}) da execução {execucao_id} não encontrado no Redis")
+                continue
+            self.registro.escrever(chave, versao, dados)
+            recebidas.append((chave, versao))
+        self.publicar_versoes(recebidas, execucao_id)
+        self.distribuidor.descartar_treino(execucao_id)
+        return recebidas
+
+    def _caracteristicas(self, fila, posicoes, tickets_ativos, prioridades, hora_do_dia):
+        setor_codificado = codificar_setor(fila.departamento.setor)
+        caracteristicas = np.empty((len(posicoes), 7), dtype=float)
+        caracteristicas[:, 0] = np.maximum(np.asarray(posicoes, dtype=float), 0)
+        caracteristicas[:, 1] = max(0, tickets_ativos)
+        caracteristicas[:, 2] = np.asarray(prioridades, dtype=float)
+        caracteristicas[:, 3] = max(0, min(23, hora_do_dia))
+        caracteristicas[:, 4] = fila.num_balcoes or 1
+        caracteristicas[:, 5] = fila.limite_diario or 100
+        caracteristicas[:, 6] = setor_codificado
+        return caracteristicas
 
     def prever(self, fila_id, posicao, tickets_ativos, prioridade, hora_do_dia):
         """Faz uma previsão do tempo de espera para uma fila."""
+        fila_id = str(fila_id)
         try:
-            if not isinstance(fila_id, str) or not fila_id:
-                logger.error(f"fila_id inválido: {fila_id}")
-                return self.tempos_fallback.get(fila_id, 30)
+            fila = Fila.objects.select_related('departamento').get(id=fila_id)
+        except (Fila.DoesNotExist, ValidationError):
+            logger.error(f"Fila não encontrada: fila_id={fila_id}")
+            return self.tempos_fallback.get(fila_id, 30)
+        return float(self.prever_lote(fila, [posicao], tickets_ativos, [prioridade or 0], hora_do_dia)[0])
 
-            try:
-                fila = Fila.objects.get(id=fila_id)
-            except Fila.DoesNotExist:
-                logger.error(f"Fila não encontrada: fila_id={fila_id}")
-                return self.tempos_fallback.get(fila_id, 30)
-
-            if fila_id not in self.esta_treinado or not self.esta_treinado[fila_id]:
-                logger.warning(f"Modelo não treinado para fila_id={fila_id}. Usando fallback.")
-                return self.tempos_fallback.get(fila_id, fila.tempo_espera_medio or 30)
-
-            setor_codificado = hash(fila.departamento.setor) % 100 if fila.departamento.setor else 0
-            caracteristicas = np.array([[
-                max(0, posicao),
-                max(0, tickets_ativos),
-                prioridade or 0,
-                max(0, min(23, hora_do_dia)),
-                fila.num_balcoes or 1,
-                fila.limite_diario or 100,
-                setor_codificado
-            ]])
-            caracteristicas_escaladas = self.scaler.transform(caracteristicas)
-            tempo_previsto = self.modelo.predict(caracteristicas_escaladas)[0]
-            tempo_previsto = max(0, tempo_previsto)
-            logger.debug(f"Previsão de tempo de espera para fila_id={fila_id}: {tempo_previsto:.1f} minutos")
-            return round(tempo_previsto, 1)
+    def prever_lote(self, fila, posicoes, tickets_ativos, prioridades, hora_do_dia):
+        """Prevê o tempo de espera de várias senhas da mesma fila com uma só chamada ao modelo."""
+        fila_id = str(fila.id)
+        fallback = self.tempos_fallback.get(fila_id, fila.tempo_espera_medio or 30)
+        artefacto = self.modelo_para(fila)
+        if artefacto is None:
+            logger.warning(f"Modelo não treinado para fila_id={fila_id}. Usando fallback.")
+            return np.full(len(posicoes), fallback, dtype=float)
+
+        try:
+            caracteristicas = self._caracteristicas(fila, posicoes, tickets_ativos, prioridades, hora_do_dia)
+            tempos_previstos = artefacto['modelo'].predict(artefacto['scaler'].transform(caracteristicas))
+            tempos_previstos *= CalibradorOnline.fator(fila, hora_do_dia)
+            logger.debug(f"Previsão em lote para fila_id={fila_id}: {len(posicoes)} senhas")
+            return np.round(np.maximum(tempos_previstos, 0), 1)
         except Exception as e:
-            logger.error(f"Erro ao prever tempo de espera para fila_id={fila_id}: {e}")
-            return self.tempos_fallback.get(fila_id, fila.tempo_espera_medio or 30)
+            logger.error(f"Erro ao prever tempos de espera em lote para fila_id={fila_id}: {e}")
+            return np.full(len(posicoes), fallback, dtype=float)
+
+def treinar_alvo_tempo_espera(alvo, partes):
+    """Treina um alvo de planear_treino com as partes já lidas e grava-o sem publicar. Devolve (chave, versão) ou None; usado por processos."""
+    try:
+        treinado = preditor_tempo_espera.treinar_alvo(alvo, partes, n_jobs=1)
+    except Exception as e:
+        logger.error(f"Erro ao treinar modelo {alvo[0]} {alvo[1]}: {e}")
+        return None
+    if not treinado:
+        return None
+    chave, artefacto = treinado
+    return chave, preditor_tempo_espera.registro.gravar(chave, artefacto)
+
+class EstimadorErlangC:
+    """Tempo de espera analítico de uma fila M/M/c, sem treino nem ficheiro de modelo.
+
+    tempo_servico é o intervalo médio entre atendimentos consecutivos da fila
+    (Fila.tempo_servico_media), medido com os balcões abertos a trabalhar em
+    paralelo: cada balcão demora em média S = tempo_servico * c e a fila atende
+    a uma taxa c*mu = 1 / tempo_servico. A carga oferecida é a = lambda * S.
+
+    A espera de uma posição é o Wq do M/M/c, C(c, a) / (c*mu - lambda), até
+    vagar um balcão, mais um atendimento completo (S) por cada grupo de c senhas
+    que ainda estão à frente. Com ocupação >= 1 não há regime estacionário:
+    todos os balcões estão ocupados e cada senha à frente custa tempo_servico.
+    """
+
+    @staticmethod
+    def probabilidade_espera(num_balcoes, carga):
+        """Fórmula de Erlang C: probabilidade de todos os balcões estarem ocupados."""
+        if carga >= num_balcoes:
+            return 1.0
+        erlang_b = 1.0
+        for k in range(1, num_balcoes + 1):
+            erlang_b = carga * erlang_b / (k + carga * erlang_b)
+        ocupacao = carga / num_balcoes
+        return erlang_b / (1 - ocupacao * (1 - erlang_b))
+
+    @staticmethod
+    def prever_lote(posicoes, taxa_chegada, tempo_servico, balcoes_abertos):
+        """Espera em minutos para cada posição (1 = próxima a ser chamada)."""
+        balcoes = max(1, balcoes_abertos or 1)
+        tempo_servico = max(tempo_servico or 0, 0.1)
+        taxa_chegada = max(taxa_chegada or 0, 0)
+        posicoes = np.maximum(np.asarray(posicoes, dtype=float), 1)
+
+        ocupacao = taxa_chegada * tempo_servico  # lambda / (c*mu)
+        if ocupacao >= 1:
+            return np.round(posicoes * tempo_servico, 1)
+
+        tempo_balcao = tempo_servico * balcoes
+        espera_balcao = EstimadorErlangC.probabilidade_espera(balcoes, taxa_chegada * tempo_balcao) * tempo_servico / (1 - ocupacao)
+        rodadas = np.floor((posicoes - 1) / balcoes)
+        return np.round(espera_balcao + rodadas * tempo_balcao, 1)
+
+class CalibradorOnline:
+    """Acompanha o ritmo de atendimento do dia sem esperar pelo próximo treino.
+
+    Fila.registrar_tempo_servico corre a cada presença validada e atualiza a EWMA
+    (últimos ~10 atendimentos) e a média de longo prazo de cada hora do dia. A razão
+    entre as duas mostra quanto o dia de hoje foge do habitual àquela hora e escala
+    as previsões do modelo treinado; o Erlang C usa a EWMA diretamente.
+    """
+    AMOSTRAS_MINIMAS_HORA = 20
+    FATOR_MINIMO = 0.5
+    FATOR_MAXIMO = 3.0
+
+    @staticmethod
+    def fator(fila, hora_do_dia):
+        """Multiplicador das previsões do modelo; 1 sem EWMA ou sem histórico suficiente naquela hora."""
+        referencia = fila.tempo_servico_hora(hora_do_dia, CalibradorOnline.AMOSTRAS_MINIMAS_HORA)
+        if fila.tempo_servico_ewma is None or not referencia:
+            return 1.0
+        return min(max(fila.tempo_servico_ewma / referencia, CalibradorOnline.FATOR_MINIMO), CalibradorOnline.FATOR_MAXIMO)
+
+    @staticmethod
+    def tempo_servico(fila, padrao=5):
+        """Tempo de serviço mais recente conhecido da fila: EWMA, senão média, senão padrao."""
+        if fila.tempo_servico_ewma:
+            return fila.tempo_servico_ewma
+        if fila.atendimentos_contagem:
+            return fila.tempo_servico_media
+        return padrao
 
 class PreditorRecomendacaoServico:
-    CAMINHO_MODELO = os.path.join(settings.BASE_DIR, "preditor_recomendacao_servico.joblib")
-    CAMINHO_SCALER = os.path.join(settings.BASE_DIR, "scaler_recomendacao_servico.joblib")
+    """Modelo e scaler num só artefacto do registo, distribuído como os de tempo de espera."""
+    DIRETORIO_MODELOS = os.path.join(settings.MODELOS_ML_DIR, "recomendacao")
+    CHAVE_MODELO = 'servicos'
     AMOSTRAS_MINIMAS = 5
     PONTUACAO_PADRAO = 0.5
 
     def __init__(self):
-        self.modelo = RandomForestRegressor(n_estimators=100, random_state=42, n_jobs=-1)
-        self.scaler = StandardScaler()
-        self.esta_treinado = False
-        self.pontuacoes_fallback = {}  # Cache de pontuações médias por fila
-        self.carregar_modelo()
-
-    def carregar_modelo(self):
-        """Carrega o modelo e o scaler salvos, se existirem."""
-        try:
-            if os.path.exists(self.CAMINHO_MODELO) and os.path.exists(self.CAMINHO_SCALER):
-                self.modelo = joblib.load(self.CAMINHO_MODELO)
-                self.scaler = joblib.load(self.CAMINHO_SCALER)
-                self.esta_treinado = True
-                logger.info("Modelo de recomendação de serviços carregado com sucesso.")
-            else:
-                logger.info("Modelo de recomendação não encontrado. Será treinado na primeira execução.")
-            self._calcular_pontuacoes_fallback()
-        except Exception as e:
-            logger.error(f"Erro ao carregar o modelo de recomendação: {e}")
-            self.esta_treinado = False
+        self.registro = RegistroModelos(
+            self.DIRETORIO_MODELOS,
+            settings.MODELOS_ML_MEMORIA_MB * 1024 * 1024,
+            mmap_mode=modo_mmap()
+        )
+        self.distribuidor = DistribuidorModelos(self.registro, 'recomendacao')
+        self._pontuacoes_fallback = None  # Cache de pontuações médias por fila, calculado no primeiro uso
 
-    def salvar_modelo(self):
-        """Salva o modelo e o scaler em disco."""
-        try:
-            joblib.dump(self.modelo, self.CAMINHO_MODELO)
-            joblib.dump(self.scaler, self.CAMINHO_SCALER)
-            logger.info("Modelo de recomendação de serviços salvo com sucesso.")
-        except Exception as e:
-            logger.error(f"Erro ao salvar o modelo de recomendação: {e}")
+    @property
+    def esta_treinado(self):
+        return self.registro.versao_atual(self.CHAVE_MODELO) is not None
+
+    def artefacto(self):
+        """Modelo e scaler em uso, ou None se ainda não foi treinado."""
+        self.distribuidor.iniciar()
+        return self.registro.obter(self.CHAVE_MODELO)
+
+    @property
+    def pontuacoes_fallback(self):
+        if self._pontuacoes_fallback is None:
+            self._calcular_pontuacoes_fallback()
+        return self._pontuacoes_fallback or {}
 
     def _calcular_pontuacoes_fallback(self):
         """Calcula pontuações médias de qualidade por fila para uso como fallback."""
         try:
-            filas = Fila.objects.all()
-            for fila in filas:
-                tickets = Ticket.objects.filter(
-                    fila_id=fila.id,
-                    status='Atendido',
-                    tempo_servico__isnull=False,
-                    tempo_servico__gt=0
-                )[:100]
-                if tickets:
-                    tempos_servico = [t.tempo_servico for t in tickets]
-                    tempo_medio = np.mean(tempos_servico)
-                    disponibilidade = max(0, fila.limite_diario - fila.tickets_ativos) / max(1, fila.limite_diario)
+            filas = Fila.objects.values_list('id', 'atendimentos_contagem', 'tempo_servico_media', 'limite_diario', 'tickets_ativos')
+            pontuacoes = {}
+            for fila_id, contagem, tempo_medio, limite_diario, tickets_ativos in filas.iterator(chunk_size=2000):
+                if contagem:
+                    disponibilidade = max(0, limite_diario - tickets_ativos) / max(1, limite_diario)
                     pontuacao = (1 / (1 + tempo_medio / 60)) * disponibilidade
-                    self.pontuacoes_fallback[str(fila.id)] = max(0, min(1, round(pontuacao, 2)))
+                    pontuacoes[str(fila_id)] = max(0, min(1, round(pontuacao, 2)))
                 else:
-                    self.pontuacoes_fallback[str(fila.id)] = self.PONTUACAO_PADRAO
-            logger.debug(f"Pontuações fallback calculadas para {len(self.pontuacoes_fallback)} filas")
+                    pontuacoes[str(fila_id)] = self.PONTUACAO_PADRAO
+            self._pontuacoes_fallback = pontuacoes
+            logger.debug(f"Pontuações fallback calculadas para {len(pontuacoes)} filas")
         except Exception as e:
             logger.error(f"Erro ao calcular pontuações fallback: {e}")
+            self._pontuacoes_fallback = {}
 
     def preparar_dados(self):
         """Prepara os dados históricos para treinamento do modelo de recomendação."""
         try:
-            filas = Fila.objects.all()
-            if not filas:
-                logger.warning("Nenhuma fila disponível para treinamento do modelo de recomendação.")
+            # Mesmas estatísticas incrementais que prever() usa: uma consulta à Fila, sem ler senhas
+            filas = Fila.objects.filter(atendimentos_contagem__gt=0).values_list(
+                'tempo_servico_media', 'tempo_servico_m2', 'atendimentos_contagem',
+                'num_balcoes', 'tickets_ativos', 'limite_diario', 'departamento__setor'
+            )
+            linhas = [
+                (media, m2, contagem, num_balcoes or 1, tickets_ativos, limite_diario or 100, codificar_setor(setor))
+                for media, m2, contagem, num_balcoes, tickets_ativos, limite_diario, setor in filas.iterator(chunk_size=2000)
+            ]
+            if not linhas:
+                logger.warning("Nenhuma fila com atendimentos para treinamento do modelo de recomendação.")
                 return None, None
 
-            dados = []
-            for fila in filas:
-                tickets = Ticket.objects.filter(
-                    fila_id=fila.id,
-                    status='Atendido',
-                    tempo_servico__isnull=False,
-                    tempo_servico__gt=0
-                )
-                if not tickets:
-                    continue
-
-                tempos_servico = [t.tempo_servico for t in tickets]
-                tempo_medio_servico = np.mean(tempos_servico)
-                desvio_padrao_servico = np.std(tempos_servico) if len(tempos_servico) > 1 else 0
-                tempo_servico_por_balcao = tempo_medio_servico / max(1, fila.num_balcoes or 1)
-                taxa_ocupacao = fila.tickets_ativos / max(1, fila.limite_diario or 100)
-                disponibilidade = max(0, fila.limite_diario - fila.tickets_ativos)
-                setor_codificado = hash(fila.departamento.setor) % 100 if fila.departamento.setor else 0
-                pontuacao_qualidade = (disponibilidade / max(1, fila.limite_diario)) * (1 / (1 + tempo_medio_servico / 60))
-                pontuacao_qualidade = max(0, min(1, pontuacao_qualidade))
-
-                dados.append({
-                    'tempo_medio_servico': tempo_medio_servico,
-                    'desvio_padrao_servico': desvio_padrao_servico,
-                    'tempo_servico_por_balcao': tempo_servico_por_balcao,
-                    'taxa_ocupacao': taxa_ocupacao,
-                    'disponibilidade': disponibilidade,
-                    'setor_codificado': setor_codificado,
-                    'hora_do_dia': timezone.now().hour,
-                    'dia_da_semana': timezone.now().weekday(),
-                    'pontuacao_qualidade': pontuacao_qualidade
-                })
+            valores = np.array(linhas, dtype=float)
+            media, m2, contagem, num_balcoes, tickets_ativos, limite_diario, setor_codificado = valores.T
+            disponibilidade = np.maximum(limite_diario - tickets_ativos, 0)
+            agora = timezone.now()
+            dados = np.column_stack([
+                media,
+                np.where(contagem > 1, np.sqrt(m2 / contagem), 0),
+                media / num_balcoes,
+                tickets_ativos / limite_diario,
+                disponibilidade,
+                setor_codificado,
+                np.full(len(valores), agora.hour),
+                np.full(len(valores), agora.weekday()),
+            ])
+            pontuacao_qualidade = np.clip((disponibilidade / limite_diario) * (1 / (1 + media / 60)), 0, 1)
 
             if len(dados) < self.AMOSTRAS_MINIMAS:
                 logger.warning(f"Dados insuficientes para treinamento do modelo de recomendação: {len(dados)} amostras")
                 return None, None
 
-            df = pd.DataFrame(dados)
-            X = df[['tempo_medio_servico', 'desvio_padrao_servico', 'tempo_servico_por_balcao', 'taxa_ocupacao', 'disponibilidade', 'setor_codificado', 'hora_do_dia', 'dia_da_semana']]
-            y = df['pontuacao_qualidade']
+            X, y = dados, pontuacao_qualidade
             logger.debug(f"Dados preparados para modelo de recomendação: {len(dados)} amostras")
             return X, y
         except Exception as e:
             logger.error(f"Erro ao preparar dados: {e}")
-            self.esta_treinado = False
+            return None, None
 
     def treinar(self):
         """Treina o modelo com dados históricos."""
+        from sklearn.model_selection import train_test_split
+        from sklearn.preprocessing import StandardScaler
         try:
             X, y = self.preparar_dados()
             if X is None or y is None:
-                self.esta_treinado = False
                 return
 
             X_treino, X_teste, y_treino, y_teste = train_test_split(X, y, test_size=0.2, random_state=42)
-            X_treino_escalado = self.scaler.fit_transform(X_treino)
-            X_teste_escalado = self.scaler.transform(X_teste)
-            self.modelo.fit(X_treino_escalado, y_treino)
-            self.esta_treinado = True
-            pontuacao = self.modelo.score(X_teste_escalado, y_teste)
+            scaler = StandardScaler()
+            X_treino_escalado = scaler.fit_transform(X_treino)
+            X_teste_escalado = scaler.transform(X_teste)
+            modelo = criar_modelo()
+            modelo.fit(X_treino_escalado, y_treino)
+            preparar_para_inferencia(modelo)
+            pontuacao = modelo.score(X_teste_escalado, y_teste)
+            self.registro.salvar(self.CHAVE_MODELO, {
+                'tipo': settings.MODELOS_ML_TIPO,
+                'modelo': modelo,
+                'scaler': scaler,
+                'amostras': len(X),
+                'pontuacao': pontuacao,
+                'treinado_em': timezone.now().isoformat()
+            })
             logger.info(f"Modelo de recomendação treinado com sucesso. Pontuação R²: {pontuacao:.2f}")
-            self.salvar_modelo()
             self._calcular_pontuacoes_fallback()  # Atualizar fallbacks após treinamento
         except Exception as e:
             logger.error(f"Erro ao treinar o modelo de recomendação: {e}")
-            self.esta_treinado = False
 
-    def prever(self, fila):
-        """Faz uma previsão da pontuação de qualidade de atendimento para uma fila."""
-        try:
-            if not fila or not hasattr(fila, 'id'):
-                logger.error("Objeto fila inválido")
-                return self.pontuacoes_fallback.get(str(fila.id), self.PONTUACAO_PADRAO) if fila else self.PONTUACAO_PADRAO
-
-            if not self.esta_treinado:
-                logger.warning("Modelo de recomendação não treinado. Usando fallback.")
-                return self.pontuacoes_fallback.get(str(fila.id), self.PONTUACAO_PADRAO)
-
-            tickets = Ticket.objects.filter(
-                fila_id=fila.id,
-                status='Atendido',
-                tempo_servico__isnull=False,
-                tempo_servico__gt=0
-            )
-            tempos_servico = [t.tempo_servico for t in tickets]
-            tempo_medio_servico = np.mean(tempos_servico) if tempos_servico else 30
-            desvio_padrao_servico = np.std(tempos_servico) if len(tempos_servico) > 1 else 0
-            tempo_servico_por_balcao = tempo_medio_servico / max(1, fila.num_balcoes or 1)
-            taxa_ocupacao = fila.tickets_ativos / max(1, fila.limite_diario or 100)
-            disponibilidade = max(0, fila.limite_diario - fila.tickets_ativos)
-            setor_codificado = hash(fila.departamento.setor) % 100 if fila.departamento.setor else 0
-
-            caracteristicas = np.array([[
+    def _caracteristicas(self, filas):
+        """Uma linha por fila, só com campos da própria Fila (estatísticas incrementais e ocupação)."""
+        agora = timezone.now()
+        setores = {}
+        linhas = []
+        for fila in filas:
+            setor = fila.departamento.setor
+            if setor not in setores:
+                setores[setor] = codificar_setor(setor)
+            tempo_medio_servico = fila.tempo_servico_media if fila.atendimentos_contagem else 30
+            linhas.append((
                 tempo_medio_servico,
-                desvio_padrao_servico,
-                tempo_servico_por_balcao,
-                taxa_ocupacao,
-                disponibilidade,
-                setor_codificado,
-                timezone.now().hour,
-                timezone.now().weekday()
-            ]])
-            caracteristicas_escaladas = self.scaler.transform(caracteristicas)
-            pontuacao_qualidade = self.modelo.predict(caracteristicas_escaladas)[0]
-            pontuacao_qualidade = max(0, min(1, pontuacao_qualidade))
-            logger.debug(f"Previsão de qualidade para fila_id={fila.id}: {pontuacao_qualidade:.2f}")
-            return pontuacao_qualidade
+                fila.tempo_servico_desvio,
+                tempo_medio_servico / max(1, fila.num_balcoes or 1),
+                fila.tickets_ativos / max(1, fila.limite_diario or 100),
+                max(0, fila.limite_diario - fila.tickets_ativos),
+                setores[setor],
+                agora.hour,
+                agora.weekday()
+            ))
+        return np.array(linhas, dtype=float)
+
+    def prever_lote(self, filas):
+        """Pontuação de qualidade de várias filas com uma só chamada ao modelo, na ordem recebida."""
+        filas = list(filas)
+        if not filas:
+            return []
+        artefacto = self.artefacto()
+        if artefacto is None:
+            logger.warning("Modelo de recomendação não treinado. Usando fallback.")
+            return [self.pontuacoes_fallback.get(str(fila.id), self.PONTUACAO_PADRAO) for fila in filas]
+        try:
+            caracteristicas_escaladas = artefacto['scaler'].transform(self._caracteristicas(filas))
+            pontuacoes = np.clip(artefacto['modelo'].predict(caracteristicas_escaladas), 0, 1)
+            logger.debug(f"Previsão de qualidade em lote: {len(filas)} filas")
+            return [float(pontuacao) for pontuacao in pontuacoes]
         except Exception as e:
-            logger.error(f"Erro ao prever qualidade para fila_id={fila.id}: {e}")
-            return self.pontuacoes_fallback.get(str(fila.id), self.PONTUACAO_PADRAO)
-
-# Instanciar os preditores após a definição das classes
-try:
-    preditor_tempo_espera = PreditorTempoEspera()
-    preditor_recomendacao_servico = PreditorRecomendacaoServico()
-    logger.debug("Instâncias criadas com sucesso")
-except Exception as e:
-    logger.error(f"Erro ao instanciar preditores: {e}")
-    raise
+            logger.error(f"Erro ao prever qualidade em lote para {len(filas)} filas: {e}")
+            return [self.pontuacoes_fallback.get(str(fila.id), self.PONTUACAO_PADRAO) for fila in filas]
+
+    def prever(self, fila):
+        """Faz uma previsão da pontuação de qualidade de atendimento para uma fila."""
+        if not fila or not hasattr(fila, 'id'):
+            logger.error("Objeto fila inválido")
+            return self.PONTUACAO_PADRAO
+        return self.prever_lote([fila])[0]
+
+class PreditorPreguicoso:
+    """Cria o preditor no primeiro uso e delega-lhe os atributos.
+
+    Importar este módulo (services, views, tasks, qualquer manage.py) não consulta
+    o banco nem carrega modelos; isso acontece no primeiro pedido que precisa de
+    uma previsão, ou antes do fork com precarregar_modelos.
+    """
+
+    def __init__(self, classe):
+        self._classe = classe
+        self._instancia = None
+        self._bloqueio = threading.Lock()
+
+    def obter(self):
+        if self._instancia is None:
+            with self._bloqueio:
+                if self._instancia is None:
+                    logger.debug(f"Instanciando {self._classe.__name__}")
+                    self._instancia = self._classe()
+        return self._instancia
+
+    def __getattr__(self, nome):
+        return getattr(self.obter(), nome)
+
+preditor_tempo_espera = PreditorPreguicoso(PreditorTempoEspera)
+preditor_recomendacao_servico = PreditorPreguicoso(PreditorRecomendacaoServico)
+
+def precarregar_modelos():
+    """Carrega os modelos em uso antes do fork dos workers (hook on_starting em gunicorn.conf.py).
+
+    gc.freeze() tira os objetos já criados das recolhas do GC, que de outro modo
+    escreveriam nos seus cabeçalhos e fariam cada worker copiar as páginas partilhadas.
+    Antes disso traz do Redis as versões publicadas noutro serviço. No fim fecha as
+    ligações ao banco e ao Redis abertas aqui, para os workers não herdarem os mesmos sockets.
+    """
+    carregados, memoria = 0, 0
+    for preditor in (preditor_tempo_espera, preditor_recomendacao_servico):
+        if settings.MODELOS_ML_DISTRIBUIR:
+            try:
+                preditor.distribuidor.reconciliar()
+            except redis.RedisError as e:
+                logger.warning(f"Erro ao obter modelos do Redis antes do arranque: {e}")
+        carregados += preditor.registro.precarregar()
+        memoria += preditor.registro.memoria_usada()[0]
+        preditor.distribuidor.fechar()
+    connections.close_all()
+    gc.freeze()
+    logger.info(f"{carregados} modelos pré-carregados ({memoria / 1024 / 1024:.1f} MiB)")
+    return carregados
 
 logger.debug("Módulo preditores_ml carregado com sucesso")
\ No newline at end of file
@@ -1,6 +1,7 @@
 from django.db import models
 from django.contrib.auth.models import User
 from django.utils import timezone
+import math
 import uuid
 from sistema.models import Instituicao, Filial, Categoria
 
@@ -14,6 +15,11 @@ class DiaSemana(models.TextChoices):
     SABADO = 'Sábado', 'Sábado'
     DOMINGO = 'Domingo', 'Domingo'
 
+class MotorTempoEspera(models.TextChoices):
+    AUTOMATICO = 'automatico', 'Automático (modelo treinado, senão Erlang C)'
+    MODELO = 'modelo', 'Modelo de ML'
+    ERLANG_C = 'erlang_c', 'Erlang C (M/M/c)'
+
 # Departamento
 class Departamento(models.Model):
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
@@ -47,6 +53,22 @@ class Fila(models.Model):
     ultimo_tempo_servico = models.FloatField(null=True, blank=True)
     num_balcoes = models.IntegerField(default=1)
     ultimo_balcao = models.IntegerField(default=0)
+    ultima_virada = models.DateField(null=True, blank=True)
+    motor_tempo_espera = models.CharField(max_length=20, choices=MotorTempoEspera.choices, default=MotorTempoEspera.AUTOMATICO)
+    # Senhas numeradas pelo banco (Redis indisponível) desde a última reposição do contador do Redis
+    alocacoes_pelo_banco = models.IntegerField(default=0)
+    # Estatísticas incrementais do tempo de serviço (minutos), atualizadas a cada atendimento
+    atendimentos_contagem = models.IntegerField(default=0)
+    tempo_servico_media = models.FloatField(default=0)
+    tempo_servico_m2 = models.FloatField(default=0)
+    tempo_servico_ewma = models.FloatField(null=True, blank=True)
+    tempo_servico_horas = models.JSONField(default=dict, blank=True)  # {"hora UTC": [contagem, média]}
+
+    ALFA_EWMA_SERVICO = 0.1
+    CAMPOS_ESTATISTICAS_SERVICO = [
+        'atendimentos_contagem', 'tempo_servico_media', 'tempo_servico_m2',
+        'tempo_servico_ewma', 'tempo_servico_horas'
+    ]
 
     class Meta:
         indexes = [
@@ -60,6 +82,44 @@ class Fila(models.Model):
     def __str__(self):
         return f"{self.servico} no {self.departamento.nome}"
 
+    def registrar_tempo_servico(self, minutos, hora=None):
+        """Acrescenta um tempo de serviço às estatísticas (média e variância de Welford, EWMA e média da hora do dia)."""
+        if minutos is None or minutos <= 0:
+            return
+        self.atendimentos_contagem += 1
+        delta = minutos - self.tempo_servico_media
+        self.tempo_servico_media += delta / self.atendimentos_contagem
+        self.tempo_servico_m2 += delta * (minutos - self.tempo_servico_media)
+        if self.tempo_servico_ewma is None:
+            self.tempo_servico_ewma = minutos
+        else:
+            self.tempo_servico_ewma += self.ALFA_EWMA_SERVICO * (minutos - self.tempo_servico_ewma)
+        if hora is not None:
+            horas = dict(self.tempo_servico_horas or {})
+            contagem, media = horas.get(str(hora), (0, 0))
+            contagem += 1
+            horas[str(hora)] = [contagem, media + (minutos - media) / contagem]
+            self.tempo_servico_horas = horas
+
+    def reiniciar_estatisticas_servico(self):
+        self.atendimentos_contagem = 0
+        self.tempo_servico_media = 0
+        self.tempo_servico_m2 = 0
+        self.tempo_servico_ewma = None
+        self.tempo_servico_horas = {}
+
+    @property
+    def tempo_servico_desvio(self):
+        """Desvio padrão populacional, como np.std."""
+        if self.atendimentos_contagem < 2:
+            return 0
+        return math.sqrt(self.tempo_servico_m2 / self.atendimentos_contagem)
+
+    def tempo_servico_hora(self, hora, amostras_minimas=1):
+        """Média do tempo de serviço naquela hora do dia (UTC); None com menos de amostras_minimas."""
+        contagem, media = (self.tempo_servico_horas or {}).get(str(hora), (0, 0))
+        return media if contagem >= amostras_minimas else None
+
 # Ticket
 class Ticket(models.Model):
     STATUS_ESCOLHAS = [
@@ -86,17 +146,124 @@ class Ticket(models.Model):
     dados_recibo = models.TextField(null=True, blank=True)
     troca_disponivel = models.BooleanField(default=False)
 
+    # Senhas emitidas no balcão ou no totem não têm conta: no banco o usuário fica nulo
+    # (a FK não aceita o marcador) e nas respostas da API aparece USUARIO_PRESENCIAL
+    USUARIO_PRESENCIAL = 'PRESENCIAL'
+
     class Meta:
         indexes = [
             models.Index(fields=['id']),
             models.Index(fields=['fila']),
             models.Index(fields=['usuario']),
             models.Index(fields=['codigo_qr']),
+            models.Index(fields=['status', 'expira_em'], name='idx_ticket_status_expira'),
+            models.Index(fields=['fila', 'emitido_em'], name='idx_ticket_fila_emitido'),
         ]
 
     def __str__(self):
         return f"Ticket {self.numero_ticket} para Fila {self.fila.servico}"
 
+    @property
+    def e_presencial(self):
+        return self.usuario_id is None
+
+    @property
+    def usuario_exibido(self):
+        return self.USUARIO_PRESENCIAL if self.e_presencial else str(self.usuario_id)
+
+# ResumoDiarioFila
+class ResumoDiarioFila(models.Model):
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    fila = models.ForeignKey(Fila, on_delete=models.CASCADE, related_name='resumos_diarios')
+    data = models.DateField()
+    emitidas = models.IntegerField(default=0)
+    atendidas = models.IntegerField(default=0)
+    canceladas = models.IntegerField(default=0)
+    nao_atendidas = models.IntegerField(default=0)
+    tempo_medio_servico = models.FloatField(null=True, blank=True)
+    criado_em = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['fila', 'data'], name='uniq_resumo_diario_fila_data'),
+        ]
+        indexes = [
+            models.Index(fields=['data'], name='idx_resumo_diario_data'),
+        ]
+
+    def __str__(self):
+        return f"Resumo de {self.fila.servico} em {self.data}"
+
+# Totem
+class Totem(models.Model):
+    """Totem registrado numa filial; só totens ativos da filial da fila podem reservar blocos."""
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    codigo = models.CharField(max_length=50, unique=True)
+    filial = models.ForeignKey(Filial, on_delete=models.CASCADE, related_name='totens')
+    ativo = models.BooleanField(default=True)
+    criado_em = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        return f"Totem {self.codigo} da filial {self.filial.nome}"
+
+# ReservaBlocoTotem
+class ReservaBlocoTotem(models.Model):
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    fila = models.ForeignKey(Fila, on_delete=models.CASCADE, related_name='reservas_totem')
+    totem_id = models.CharField(max_length=50)
+    numero_inicial = models.IntegerField()
+    numero_final = models.IntegerField()
+    emitidas = models.IntegerField(default=0)
+    reservado_em = models.DateTimeField(default=timezone.now)
+    expira_em = models.DateTimeField()
+    encerrada = models.BooleanField(default=False)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['fila', 'totem_id'], name='idx_reserva_totem_fila'),
+            models.Index(fields=['expira_em'], name='idx_reserva_totem_expira'),
+        ]
+
+    @property
+    def quantidade(self):
+        return self.numero_final - self.numero_inicial + 1
+
+    def __str__(self):
+        return f"Bloco {self.numero_inicial}-{self.numero_final} do totem {self.totem_id} para {self.fila.servico}"
+
+# MarcaTreinoFila
+class MarcaTreinoFila(models.Model):
+    """Até onde o histórico da fila já entrou num modelo publicado."""
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    fila = models.OneToOneField(Fila, on_delete=models.CASCADE, related_name='marca_treino')
+    ultimo_atendimento = models.DateTimeField(null=True, blank=True)
+    amostras = models.IntegerField(default=0)
+    tempo_servico_media = models.FloatField(null=True, blank=True)
+    treinado_em = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        return f"Treino de {self.fila.servico} até {self.ultimo_atendimento}"
+
+# ExecucaoTreino
+class ExecucaoTreino(models.Model):
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    modo = models.CharField(max_length=20)
+    iniciada_em = models.DateTimeField(default=timezone.now)
+    concluida_em = models.DateTimeField(null=True, blank=True)
+    filas_avaliadas = models.IntegerField(default=0)
+    filas_treinadas = models.IntegerField(default=0)
+    filas_ignoradas = models.IntegerField(default=0)
+    modelos_publicados = models.IntegerField(default=0)
+    detalhes = models.JSONField(default=dict, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['iniciada_em'], name='idx_execucao_treino_inicio'),
+        ]
+
+    def __str__(self):
+        return f"Treino {self.modo} em {self.iniciada_em}: {self.filas_treinadas} treinadas, {self.filas_ignoradas} ignoradas"
+
 # HorarioFila
 class HorarioFila(models.Model):
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
@@ -15,7 +15,7 @@ class FilaSerializer(serializers.ModelSerializer):
     
     class Meta:
         model = Fila
-        fields = ['id', 'departamento', 'servico', 'categoria', 'prefixo', 'hora_abertura', 'hora_fechamento', 'limite_diario', 'tickets_ativos', 'ticket_atual', 'tempo_espera_medio', 'num_balcoes']
+        fields = ['id', 'departamento', 'servico', 'categoria', 'prefixo', 'hora_abertura', 'hora_fechamento', 'limite_diario', 'tickets_ativos', 'ticket_atual', 'tempo_espera_medio', 'num_balcoes', 'motor_tempo_espera']
 
 class TicketSerializer(serializers.ModelSerializer):
     fila = FilaSerializer(read_only=True)
@@ -2,20 +2,24 @@ import logging
 import uuid
 import numpy as np
 from django.utils import timezone
-from datetime import datetime, timedelta
-from django.db.models import Q, Max
+from datetime import datetime, timedelta, time
+from zoneinfo import ZoneInfo
+from django.db.models import Q, Max, F, Count, Avg, Sum, OuterRef, Subquery
+from django.db.models.functions import Coalesce, Greatest
 from django.conf import settings
 from geopy.distance import geodesic
 import redis
 import json
+import time as relogio
+from concurrent.futures import ThreadPoolExecutor
 from channels.layers import get_channel_layer
 from asgiref.sync import async_to_sync
 from firebase_admin import messaging
 from django.core.exceptions import ObjectDoesNotExist
-from django.db import transaction
-from fila_online.models import Fila, HorarioFila, Ticket, Departamento, Categoria, EtiquetaServico
+from django.db import transaction, connection, close_old_connections
+from fila_online.models import Fila, HorarioFila, Ticket, Departamento, Categoria, EtiquetaServico, ResumoDiarioFila, ReservaBlocoTotem, Totem, MotorTempoEspera
 from sistema.models import PerfilUsuario, PreferenciaUsuario, LogAuditoria, Instituicao, Filial
-from .ml_models import preditor_tempo_espera, preditor_recomendacao_servico
+from .ml_models import preditor_tempo_espera, preditor_recomendacao_servico, EstimadorErlangC, CalibradorOnline
 from .utils.pdf_generator import gerar_pdf_senha  # Assumindo que o gerador de PDF foi renomeado
 
 logger = logging.getLogger(__name__)
@@ -23,11 +27,491 @@ logger = logging.getLogger(__name__)
 # Configuração do Redis
 redis_client = redis.Redis(host=settings.REDIS_HOST, port=settings.REDIS_PORT, db=0, decode_responses=True)
 
+# Notificações FCM e difusões WebSocket correm aqui, depois do commit, fora da thread do pedido
+executor_efeitos = ThreadPoolExecutor(max_workers=settings.FILA_EFEITOS_MAX_THREADS, thread_name_prefix='efeitos_fila')
+
+class AlocadorSenhas:
+    """Distribui números de senha por fila e por dia sem bloquear a linha da Fila.
+
+    O caminho normal é um INCRBY no Redis (uma chave por fila e por dia local da
+    filial, o mesmo dia que virar_dia_filas fecha). Se o Redis não responder, o
+    número é calculado no Postgres sob um advisory lock da transação corrente, de
+    modo que duas emissões nunca recebem o mesmo número. Cada emissão pelo banco
+    incrementa Fila.alocacoes_pelo_banco; o primeiro processo que voltar a usar o
+    Redis para essa fila, ou a tarefa reconciliar_contadores_senhas, eleva o
+    contador ao maior número gravado antes de continuar.
+    """
+    PREFIXO_CHAVE = 'alocador_senha'
+    TTL_CONTADOR_SEGUNDOS = 2 * 24 * 3600
+
+    @staticmethod
+    def _chave(fila_id, dia):
+        return f"{AlocadorSenhas.PREFIXO_CHAVE}:{fila_id}:{dia.strftime('%Y%m%d')}"
+
+    @staticmethod
+    def _dia_local(fila, agora=None):
+        """Dia corrente e fuso da filial da fila."""
+        try:
+            fuso = ZoneInfo(fila.departamento.filial.fuso_horario)
+        except Exception:
+            logger.error(f"Fuso horário inválido na filial da fila_id={fila.id}; usando {settings.TIME_ZONE}")
+            fuso = timezone.get_default_timezone()
+        return (agora or timezone.now()).astimezone(fuso).date(), fuso
+
+    @staticmethod
+    def _maior_numero_do_dia(fila_id, dia, fuso):
+        """Maior número já usado no dia: senhas gravadas e blocos reservados a totens, sincronizados ou não."""
+        inicio = datetime.combine(dia, time.min, tzinfo=fuso)
+        fim = inicio + timedelta(days=1)
+        maior = Ticket.objects.filter(fila_id=fila_id, emitido_em__gte=inicio, emitido_em__lt=fim)\
+            .aggregate(maior=Max('numero_ticket'))['maior']
+        maior_bloco = ReservaBlocoTotem.objects.filter(fila_id=fila_id, reservado_em__gte=inicio, reservado_em__lt=fim)\
+            .aggregate(maior=Max('numero_final'))['maior']
+        return max(maior or 0, maior_bloco or 0)
+
+    @staticmethod
+    def _semear_contador(chave, fila_id, dia, fuso):
+        """Inicializa o contador do dia a partir do Postgres (arranque a frio ou Redis limpo)."""
+        if redis_client.exists(chave):
+            return
+        maior = AlocadorSenhas._maior_numero_do_dia(fila_id, dia, fuso)
+        # NX: se outro processo semeou entretanto, prevalece o valor dele
+        redis_client.set(chave, maior, nx=True, ex=AlocadorSenhas.TTL_CONTADOR_SEGUNDOS)
+        logger.debug(f"Contador de senhas semeado para fila_id={fila_id} em {dia}: {maior}")
+
+    @staticmethod
+    def _elevar_contador(chave, maior):
+        """Sobe o contador para `maior` se estiver abaixo; nunca o baixa, por causa dos INCRBY concorrentes."""
+        with redis_client.pipeline() as pipe:
+            while True:
+                try:
+                    pipe.watch(chave)
+                    atual = pipe.get(chave)
+                    if atual is not None and int(atual) >= maior:
+                        pipe.unwatch()
+                        return atual
+                    pipe.multi()
+                    pipe.set(chave, maior, ex=AlocadorSenhas.TTL_CONTADOR_SEGUNDOS)
+                    pipe.execute()
+                    return atual
+                except redis.WatchError:
+                    continue
+
+    @staticmethod
+    def _repor_contador(chave, fila_id, dia, fuso, alocacoes_pelo_banco):
+        """Eleva o contador do Redis depois de emissões pelo banco e limpa a marca da Fila.
+
+        A marca só é limpa se nenhuma outra emissão pelo banco a incrementou entretanto;
+        se o Redis falhar aqui, fica para a próxima tentativa.
+        """
+        maior = AlocadorSenhas._maior_numero_do_dia(fila_id, dia, fuso)
+        anterior = AlocadorSenhas._elevar_contador(chave, maior)
+        if alocacoes_pelo_banco:
+            Fila.objects.filter(id=fila_id, alocacoes_pelo_banco=alocacoes_pelo_banco).update(alocacoes_pelo_banco=0)
+        if anterior is None or int(anterior) < maior:
+            logger.info(f"Contador de senhas da fila_id={fila_id} reposto: {anterior} -> {maior}")
+        return maior
+
+    @staticmethod
+    def _alocar_no_banco(fila_id, dia, fuso, quantidade):
+        """Alternativa sem Redis: serializa apenas os emissores da mesma fila até ao commit."""
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT pg_advisory_xact_lock(hashtext(%s))", [AlocadorSenhas._chave(fila_id, dia)])
+        else:
+            Fila.objects.select_for_update().filter(id=fila_id).first()
+        # Visível a todos os processos: o contador do Redis deixa de estar em dia com o commit
+        Fila.objects.filter(id=fila_id).update(alocacoes_pelo_banco=F('alocacoes_pelo_banco') + 1)
+        return AlocadorSenhas._maior_numero_do_dia(fila_id, dia, fuso) + quantidade
+
+    @staticmethod
+    def alocar(fila, quantidade=1):
+        """Reserva `quantidade` números consecutivos e devolve o último.
+
+        Deve ser chamado dentro de uma transação; o bloco reservado é
+        [ultimo - quantidade + 1, ultimo].
+        """
+        if quantidade < 1:
+            raise ValueError("Quantidade de senhas inválida")
+
+        dia, fuso = AlocadorSenhas._dia_local(fila)
+        chave = AlocadorSenhas._chave(fila.id, dia)
+        try:
+            if fila.alocacoes_pelo_banco:
+                AlocadorSenhas._repor_contador(chave, fila.id, dia, fuso, fila.alocacoes_pelo_banco)
+                fila.alocacoes_pelo_banco = 0
+            AlocadorSenhas._semear_contador(chave, fila.id, dia, fuso)
+            ultimo = redis_client.incrby(chave, quantidade)
+            logger.debug(f"Senhas {ultimo - quantidade + 1}-{ultimo} alocadas via Redis para fila_id={fila.id}")
+            return ultimo
+        except redis.RedisError as e:
+            logger.warning(f"Erro ao alocar senha no Redis para fila_id={fila.id}: {e}. Usando advisory lock no banco.")
+            return AlocadorSenhas._alocar_no_banco(fila.id, dia, fuso, quantidade)
+
+    @staticmethod
+    def reservar_vaga(fila, quantidade=1):
+        """Incrementa tickets_ativos num único UPDATE condicional, respeitando o limite diário."""
+        atualizadas = Fila.objects.filter(
+            id=fila.id,
+            tickets_ativos__lte=F('limite_diario') - quantidade
+        ).update(tickets_ativos=F('tickets_ativos') + quantidade)
+        if not atualizadas:
+            logger.warning(f"Fila {fila.id} sem vagas para {quantidade} senha(s): limite diário {fila.limite_diario}")
+            raise ValueError("Limite diário atingido")
+        fila.refresh_from_db(fields=['tickets_ativos'])
+
+    @staticmethod
+    def reconciliar(fila_id):
+        """Alinha o contador do Redis e o tickets_ativos da Fila com os tickets gravados."""
+        fila = Fila.objects.select_related('departamento__filial').get(id=fila_id)
+        dia, fuso = AlocadorSenhas._dia_local(fila)
+        try:
+            maior = AlocadorSenhas._repor_contador(AlocadorSenhas._chave(fila_id, dia), fila_id, dia, fuso, fila.alocacoes_pelo_banco)
+        except redis.RedisError as e:
+            logger.warning(f"Erro ao reconciliar contador no Redis para fila_id={fila_id}: {e}")
+            maior = AlocadorSenhas._maior_numero_do_dia(fila_id, dia, fuso)
+
+        # Contagem e escrita num só UPDATE, como em virar_dia_filas: não perde emissões concorrentes
+        pendentes = Ticket.objects.filter(
+            fila_id=OuterRef('id'), status='Pendente'
+        ).values('fila_id').annotate(total=Count('id')).values('total')
+        Fila.objects.filter(id=fila_id).update(tickets_ativos=Coalesce(Subquery(pendentes), 0))
+        try:
+            IndiceFilaViva.reconstruir(fila_id)
+        except redis.RedisError as e:
+            logger.warning(f"Erro ao reconstruir índice da fila_id={fila_id}: {e}")
+        return maior
+
+    @staticmethod
+    def reconciliar_atrasados():
+        """Reconcilia as filas que emitiram pelo banco e ainda não voltaram a usar o Redis."""
+        filas_ids = list(Fila.objects.filter(alocacoes_pelo_banco__gt=0).values_list('id', flat=True))
+        for fila_id in filas_ids:
+            AlocadorSenhas.reconciliar(fila_id)
+        return len(filas_ids)
+
+class IndiceFilaViva:
+    """Índice das senhas pendentes de cada fila num ZSET do Redis.
+
+    A pontuação segue a ordem de atendimento (prioridade decrescente, depois
+    número), por isso os próximos a chamar são um ZRANGE e a posição real é um
+    ZRANK. O Postgres continua a ser a fonte de verdade: sem a chave de
+    controlo o índice é reconstruído a partir das senhas pendentes, e a chave
+    expira para que um índice que se desviou (ex.: processo morto entre o
+    commit e o ZREM) seja refeito periodicamente.
+    """
+    PREFIXO_CHAVE = 'fila_viva'
+    PESO_PRIORIDADE = 10_000_000
+    TTL_BLOQUEIO_SEGUNDOS = 30
+    TTL_PRONTO_SEGUNDOS = 10 * 60
+
+    @staticmethod
+    def _chave(fila_id):
+        return f"{IndiceFilaViva.PREFIXO_CHAVE}:{fila_id}"
+
+    @staticmethod
+    def _chave_pronto(fila_id):
+        return f"{IndiceFilaViva.PREFIXO_CHAVE}:{fila_id}:pronto"
+
+    @staticmethod
+    def pontuacao(prioridade, numero_ticket):
+        return -(prioridade or 0) * IndiceFilaViva.PESO_PRIORIDADE + numero_ticket
+
+    @staticmethod
+    def reconstruir(fila_id):
+        """Carrega as senhas pendentes do Postgres sem apagar entradas adicionadas entretanto."""
+        chave_bloqueio = f"{IndiceFilaViva._chave(fila_id)}:reconstruindo"
+        if not redis_client.set(chave_bloqueio, 1, nx=True, ex=IndiceFilaViva.TTL_BLOQUEIO_SEGUNDOS):
+            return False
+        try:
+            chave = IndiceFilaViva._chave(fila_id)
+            membros = {
+                str(senha_id): IndiceFilaViva.pontuacao(prioridade, numero)
+                for senha_id, prioridade, numero in Ticket.objects.filter(fila_id=fila_id, status='Pendente')
+                .values_list('id', 'prioridade', 'numero_ticket')
+            }
+            # Entradas fora da leitura podem ser emissões confirmadas depois dela: só sai o que já não está pendente
+            extras = set(redis_client.zrange(chave, 0, -1)) - membros.keys()
+            if extras:
+                ainda_pendentes = {str(i) for i in Ticket.objects.filter(id__in=extras, status='Pendente').values_list('id', flat=True)}
+                extras -= ainda_pendentes
+
+            pipe = redis_client.pipeline()
+            if membros:
+                pipe.zadd(chave, membros)
+            if extras:
+                pipe.zrem(chave, *extras)
+            pipe.set(IndiceFilaViva._chave_pronto(fila_id), 1, ex=IndiceFilaViva.TTL_PRONTO_SEGUNDOS)
+            pipe.execute()
+            logger.info(f"Índice da fila_id={fila_id} reconstruído: {len(membros)} senhas pendentes, {len(extras)} removidas")
+            return True
+        finally:
+            redis_client.delete(chave_bloqueio)
+
+    @staticmethod
+    def garantir(fila_id):
+        """Confirma que o índice está carregado; reconstrói no arranque a frio."""
+        if redis_client.exists(IndiceFilaViva._chave_pronto(fila_id)):
+            return True
+        return IndiceFilaViva.reconstruir(fila_id)
+
+    @staticmethod
+    def invalidar(filas_ids):
+        """Força a reconstrução no próximo acesso (ex.: após cancelamentos em massa)."""
+        try:
+            chaves = [IndiceFilaViva._chave_pronto(fila_id) for fila_id in filas_ids]
+            if chaves:
+                redis_client.delete(*chaves)
+        except redis.RedisError as e:
+            logger.warning(f"Erro ao invalidar índice de filas no Redis: {e}")
+
+    @staticmethod
+    def adicionar(senhas):
+        try:
+            pipe = redis_client.pipeline()
+            for senha in senhas:
+                pipe.zadd(IndiceFilaViva._chave(senha.fila_id), {str(senha.id): IndiceFilaViva.pontuacao(senha.prioridade, senha.numero_ticket)})
+            pipe.execute()
+        except redis.RedisError as e:
+            logger.warning(f"Erro ao adicionar {len(senhas)} senha(s) ao índice no Redis: {e}. Índice será reconstruído.")
+            IndiceFilaViva.invalidar({senha.fila_id for senha in senhas})
+
+    @staticmethod
+    def remover(fila_id, senhas_ids):
+        try:
+            if senhas_ids:
+                redis_client.zrem(IndiceFilaViva._chave(fila_id), *[str(senha_id) for senha_id in senhas_ids])
+        except redis.RedisError as e:
+            logger.warning(f"Erro ao remover senhas do índice da fila_id={fila_id}: {e}. Índice será reconstruído.")
+            IndiceFilaViva.invalidar([fila_id])
+
+    @staticmethod
+    def adicionar_apos_commit(senhas):
+        senhas = list(senhas)
+        transaction.on_commit(lambda: IndiceFilaViva.adicionar(senhas))
+
+    @staticmethod
+    def remover_apos_commit(fila_id, senhas_ids):
+        senhas_ids = list(senhas_ids)
+        transaction.on_commit(lambda: IndiceFilaViva.remover(fila_id, senhas_ids))
+
+    @staticmethod
+    def consultar_proximos(fila_id, inicio, quantidade):
+        """Ids nas posições [inicio, inicio + quantidade) sem os retirar, ou None se o índice não estiver disponível.
+
+        Quem chama retira-os com remover_apos_commit: um rollback deixa-os no índice.
+        """
+        try:
+            if not IndiceFilaViva.garantir(fila_id):
+                return None
+            return redis_client.zrange(IndiceFilaViva._chave(fila_id), inicio, inicio + quantidade - 1)
+        except redis.RedisError as e:
+            logger.warning(f"Erro ao consultar próximas senhas no índice da fila_id={fila_id}: {e}. Usando o banco.")
+            return None
+
+    @staticmethod
+    def posicao(fila_id, senha_id):
+        """Posição 1-based da senha entre as pendentes, ou None se não estiver no índice."""
+        try:
+            if not IndiceFilaViva.garantir(fila_id):
+                return None
+            rank = redis_client.zrank(IndiceFilaViva._chave(fila_id), str(senha_id))
+            return rank + 1 if rank is not None else None
+        except redis.RedisError as e:
+            logger.warning(f"Erro ao consultar posição no índice da fila_id={fila_id}: {e}")
+            return None
+
+    @staticmethod
+    def contar_a_frente(fila_id, prioridade, numero_ticket):
+        """Número de senhas pendentes que serão chamadas antes de (prioridade, numero_ticket)."""
+        try:
+            if not IndiceFilaViva.garantir(fila_id):
+                return None
+            return redis_client.zcount(
+                IndiceFilaViva._chave(fila_id), '-inf', f"({IndiceFilaViva.pontuacao(prioridade, numero_ticket)}"
+            )
+        except redis.RedisError as e:
+            logger.warning(f"Erro ao contar senhas à frente no índice da fila_id={fila_id}: {e}")
+            return None
+
+    @staticmethod
+    def contar_a_frente_lote(fila_id, senhas):
+        """Como contar_a_frente, para uma lista de (prioridade, numero_ticket), numa só ida ao Redis."""
+        try:
+            if not IndiceFilaViva.garantir(fila_id):
+                return None
+            chave = IndiceFilaViva._chave(fila_id)
+            pipe = redis_client.pipeline(transaction=False)
+            for prioridade, numero_ticket in senhas:
+                pipe.zcount(chave, '-inf', f"({IndiceFilaViva.pontuacao(prioridade, numero_ticket)}")
+            return pipe.execute()
+        except redis.RedisError as e:
+            logger.warning(f"Erro ao contar senhas à frente no índice da fila_id={fila_id}: {e}")
+            return None
+
+class CacheTempoEspera:
+    """Estimativas de espera por fila num hash do Redis, com TTL curto.
+
+    O hash guarda um retrato da fila (aberta, ticket_atual, tickets_ativos,
+    tempo_espera_medio) e uma estimativa por "balde de posição:prioridade".
+    Emissão, chamada, validação, cancelamento e troca apagam o hash; no caso
+    comum uma estimativa custa uma ida ao Redis e nenhuma consulta ao banco.
+    """
+    PREFIXO_CHAVE = 'tempo_espera'
+    CAMPO_ESTADO = 'estado'
+    TTL_SEGUNDOS = 60
+
+    @staticmethod
+    def _chave(fila_id):
+        return f"{CacheTempoEspera.PREFIXO_CHAVE}:{fila_id}"
+
+    @staticmethod
+    def balde(posicao):
+        """Posições exatas até 10, depois em saltos de 5 (até 50) e de 20."""
+        if posicao <= 10:
+            return posicao
+        if posicao <= 50:
+            return -(-posicao // 5) * 5
+        return -(-posicao // 20) * 20
+
+    @staticmethod
+    def ler(fila_id, senhas):
+        """Devolve (estado, senhas à frente, estimativas) numa só ida ao Redis.
+
+        senhas é uma lista de (prioridade, numero_ticket). estado é None quando
+        não há retrato válido; senhas à frente é None quando o índice da fila
+        não está carregado.
+        """
+        try:
+            chave_indice = IndiceFilaViva._chave(fila_id)
+            pipe = redis_client.pipeline(transaction=False)
+            pipe.exists(IndiceFilaViva._chave_pronto(fila_id))
+            pipe.hgetall(CacheTempoEspera._chave(fila_id))
+            for prioridade, numero_ticket in senhas:
+                pipe.zcount(chave_indice, '-inf', f"({IndiceFilaViva.pontuacao(prioridade, numero_ticket)}")
+            pronto, campos, *a_frente = pipe.execute()
+        except redis.RedisError as e:
+            logger.warning(f"Erro ao ler cache de tempo de espera da fila_id={fila_id}: {e}. Prosseguindo sem cache.")
+            return None, None, {}
+
+        estado = json.loads(campos.pop(CacheTempoEspera.CAMPO_ESTADO)) if CacheTempoEspera.CAMPO_ESTADO in campos else None
+        if estado and relogio.time() - estado['gerado_em'] > CacheTempoEspera.TTL_SEGUNDOS:
+            estado, campos = None, {}
+        return estado, (a_frente if pronto else None), {campo: float(valor) for campo, valor in campos.items()}
+
+    @staticmethod
+    def guardar_estado(fila_id, estado):
+        estado = {**estado, 'gerado_em': relogio.time()}
+        try:
+            chave = CacheTempoEspera._chave(fila_id)
+            pipe = redis_client.pipeline()
+            pipe.delete(chave)
+            pipe.hset(chave, CacheTempoEspera.CAMPO_ESTADO, json.dumps(estado))
+            pipe.expire(chave, CacheTempoEspera.TTL_SEGUNDOS)
+            pipe.execute()
+        except redis.RedisError as e:
+            logger.warning(f"Erro ao guardar cache de tempo de espera da fila_id={fila_id}: {e}")
+        return estado
+
+    @staticmethod
+    def guardar_estimativas(fila_id, estimativas):
+        try:
+            chave = CacheTempoEspera._chave(fila_id)
+            pipe = redis_client.pipeline()
+            pipe.hset(chave, mapping=estimativas)
+            pipe.expire(chave, CacheTempoEspera.TTL_SEGUNDOS)
+            pipe.execute()
+        except redis.RedisError as e:
+            logger.warning(f"Erro ao guardar estimativas de espera da fila_id={fila_id}: {e}")
+
+    @staticmethod
+    def invalidar(filas_ids):
+        try:
+            chaves = [CacheTempoEspera._chave(fila_id) for fila_id in filas_ids]
+            if chaves:
+                redis_client.delete(*chaves)
+        except redis.RedisError as e:
+            logger.warning(f"Erro ao invalidar cache de tempo de espera: {e}")
+
+    @staticmethod
+    def invalidar_apos_commit(filas_ids):
+        filas_ids = list(filas_ids)
+        transaction.on_commit(lambda: CacheTempoEspera.invalidar(filas_ids))
+
+class AgendaExpiracao:
+    """Prazos de validação das senhas chamadas num ZSET do Redis (pontuação = expira_em).
+
+    A tarefa periódica lê só as senhas já vencidas, por isso o custo de cada
+    passagem é proporcional às expiradas e não a todas as senhas chamadas.
+    Sem a chave de controlo a agenda é recarregada do Postgres.
+    """
+    CHAVE = 'expiracao_chamadas'
+    CHAVE_PRONTO = 'expiracao_chamadas:pronto'
+
+    @staticmethod
+    def _garantir():
+        if redis_client.exists(AgendaExpiracao.CHAVE_PRONTO):
+            return
+        prazos = {
+            str(senha_id): expira_em.timestamp()
+            for senha_id, expira_em in Ticket.objects.filter(status='Chamado', expira_em__isnull=False)
+            .values_list('id', 'expira_em')
+        }
+        pipe = redis_client.pipeline()
+        if prazos:
+            pipe.zadd(AgendaExpiracao.CHAVE, prazos)
+        pipe.set(AgendaExpiracao.CHAVE_PRONTO, 1)
+        pipe.execute()
+        logger.info(f"Agenda de expiração recarregada do banco: {len(prazos)} senhas chamadas")
+
+    @staticmethod
+    def agendar(senhas):
+        try:
+            prazos = {str(senha.id): senha.expira_em.timestamp() for senha in senhas if senha.expira_em}
+            if prazos:
+                redis_client.zadd(AgendaExpiracao.CHAVE, prazos)
+        except redis.RedisError as e:
+            logger.warning(f"Erro ao agendar expiração de {len(senhas)} senha(s) no Redis: {e}. Agenda será recarregada.")
+            AgendaExpiracao.invalidar()
+
+    @staticmethod
+    def agendar_apos_commit(senhas):
+        senhas = list(senhas)
+        transaction.on_commit(lambda: AgendaExpiracao.agendar(senhas))
+
+    @staticmethod
+    def remover(senhas_ids):
+        try:
+            if senhas_ids:
+                redis_client.zrem(AgendaExpiracao.CHAVE, *[str(senha_id) for senha_id in senhas_ids])
+        except redis.RedisError as e:
+            logger.warning(f"Erro ao remover senhas da agenda de expiração: {e}")
+
+    @staticmethod
+    def invalidar():
+        try:
+            redis_client.delete(AgendaExpiracao.CHAVE_PRONTO)
+        except redis.RedisError as e:
+            logger.warning(f"Erro ao invalidar agenda de expiração: {e}")
+
+    @staticmethod
+    def vencidas(agora, limite):
+        """Ids com prazo até `agora`, ou None se o Redis não estiver disponível."""
+        try:
+            AgendaExpiracao._garantir()
+            return redis_client.zrangebyscore(AgendaExpiracao.CHAVE, '-inf', agora.timestamp(), start=0, num=limite)
+        except redis.RedisError as e:
+            logger.warning(f"Erro ao ler agenda de expiração no Redis: {e}. Usando o banco.")
+            return None
+
 class ServicoFila:
     MINUTOS_EXPIRACAO_PADRAO = 30
     MINUTOS_TIMEOUT_CHAMADA = 5
+    JANELA_TAXA_CHEGADA_MINUTOS = 60
     LIMITE_PROXIMIDADE_KM = 1.0
     LIMITE_PROXIMIDADE_PRESENCA_KM = 0.5
+    MAXIMO_SENHAS_LOTE = 500
+    LIMITE_EXPIRACAO_LOTE = 500
 
     @staticmethod
     def gerar_codigo_qr():
@@ -66,7 +550,7 @@ class ServicoFila:
             raise ValueError("Fila, departamento ou instituição associada à senha não encontrada")
 
         if posicao is None:
-            posicao = max(0, senha.numero_ticket - senha.fila.ticket_atual)
+            posicao = ServicoFila.calcular_posicao(senha)
         if tempo_espera is None:
             tempo_espera = ServicoFila.calcular_tempo_espera(
                 senha.fila.id, senha.numero_ticket, senha.prioridade
@@ -83,56 +567,150 @@ class ServicoFila:
 
     @staticmethod
     def calcular_tempo_espera(fila_id, numero_senha, prioridade=0):
-        try:
-            fila = Fila.objects.get(id=fila_id)
-        except ObjectDoesNotExist:
-            logger.error(f"Fila não encontrada para fila_id={fila_id}")
-            return 0
+        return ServicoFila.calcular_tempos_espera_lote(fila_id, [numero_senha], [prioridade])[0]
 
-        if not ServicoFila.esta_fila_aberta(fila):
+    @staticmethod
+    def calcular_tempos_espera_lote(fila_id, numeros, prioridades=None):
+        """Tempo de espera de várias senhas da mesma fila, na ordem recebida.
+
+        As estimativas em falta no cache são previstas com uma só chamada ao
+        modelo. Só lê do banco: os tempos médios guardados na Fila são
+        atualizados por atualizar_tempos_espera_medios.
+        """
+        if not numeros:
+            return []
+        prioridades = [prioridade or 0 for prioridade in (prioridades or [0] * len(numeros))]
+        estado, a_frente, estimativas = CacheTempoEspera.ler(fila_id, list(zip(prioridades, numeros)))
+
+        fila = None
+        if estado is None:
+            try:
+                fila = Fila.objects.select_related('departamento').get(id=fila_id)
+            except ObjectDoesNotExist:
+                logger.error(f"Fila não encontrada para fila_id={fila_id}")
+                return [0] * len(numeros)
+
+            inicio_janela = timezone.now() - timedelta(minutes=ServicoFila.JANELA_TAXA_CHEGADA_MINUTOS)
+            chegadas = Ticket.objects.filter(fila_id=fila_id, emitido_em__gte=inicio_janela).count()
+            # Balcões que chamaram alguém na janela; sem chamadas recentes assume-se todos os configurados
+            balcoes_abertos = Ticket.objects.filter(fila_id=fila_id, atendido_em__gte=inicio_janela)\
+                .exclude(balcao__isnull=True).values('balcao').distinct().count()
+            estado = CacheTempoEspera.guardar_estado(fila_id, {
+                'aberta': ServicoFila.esta_fila_aberta(fila),
+                'ticket_atual': fila.ticket_atual,
+                'tickets_ativos': fila.tickets_ativos,
+                'tempo_espera_medio': fila.tempo_espera_medio,
+                'taxa_chegada': chegadas / ServicoFila.JANELA_TAXA_CHEGADA_MINUTOS,
+                'balcoes_abertos': min(balcoes_abertos, fila.num_balcoes) or fila.num_balcoes
+            })
+            estimativas = {}
+
+        if not estado['aberta']:
             logger.warning(f"Fila {fila_id} está fechada para cálculo de tempo_espera")
-            return "N/A"
+            return ["N/A"] * len(numeros)
 
-        if fila.ticket_atual == 0:
-            fila.ticket_atual = 1
-            fila.save()
-            logger.debug(f"Atendimento ainda não começou para fila_id={fila_id}, inicializando ticket_atual=1")
+        if a_frente is None:
+            a_frente = IndiceFilaViva.contar_a_frente_lote(fila_id, list(zip(prioridades, numeros)))
 
-        posicao = max(0, numero_senha - fila.ticket_atual)
-        if posicao == 0:
-            logger.debug(f"Senha {numero_senha} está na posição 0, tempo_espera=0")
-            return 0
+        # Senhas em posições próximas partilham a mesma estimativa
+        campos = []
+        em_falta = {}
+        for i, (numero, prioridade) in enumerate(zip(numeros, prioridades)):
+            if numero == estado['ticket_atual']:
+                campos.append(None)
+                continue
+            posicao = a_frente[i] + 1 if a_frente is not None else max(0, numero - estado['ticket_atual'])
+            if posicao == 0:
+                campos.append(None)
+                continue
+            campo = f"{CacheTempoEspera.balde(posicao)}:{prioridade}"
+            campos.append(campo)
+            if campo not in estimativas:
+                em_falta[campo] = (CacheTempoEspera.balde(posicao), prioridade)
+
+        if em_falta:
+            fila = fila or Fila.objects.select_related('departamento').get(id=fila_id)
+            posicoes = np.array([posicao for posicao, _ in em_falta.values()], dtype=float)
+            prioridades_em_falta = np.array([prioridade for _, prioridade in em_falta.values()], dtype=float)
+
+            motor = fila.motor_tempo_espera
+            sem_modelo = motor != MotorTempoEspera.ERLANG_C and preditor_tempo_espera.modelo_para(fila) is None
+            if motor == MotorTempoEspera.MODELO and sem_modelo:
+                # MODELO só aceita previsões do modelo treinado: sem ele não há estimativa (o AUTOMATICO cai no Erlang C)
+                logger.warning(f"Fila {fila_id} com motor MODELO sem modelo treinado: tempo de espera indisponível")
+                return [estimativas.get(campo, "N/A") if campo else 0 for campo in campos]
+            if motor == MotorTempoEspera.ERLANG_C or sem_modelo:
+                tempo_servico = CalibradorOnline.tempo_servico(fila, estado['tempo_espera_medio'] or 5)
+                tempos_previstos = EstimadorErlangC.prever_lote(
+                    posicoes, estado['taxa_chegada'], tempo_servico, estado.get('balcoes_abertos') or fila.num_balcoes
+                )
+            else:
+                tempos_previstos = preditor_tempo_espera.prever_lote(
+                    fila, posicoes, estado['tickets_ativos'], prioridades_em_falta, timezone.now().hour
+                )
 
-        agora = timezone.now()
-        hora_do_dia = agora.hour
-        tempo_previsto = preditor_tempo_espera.prever(fila_id, posicao, fila.tickets_ativos, prioridade, hora_do_dia)
+            novas = {campo: round(float(tempo), 1) for campo, tempo in zip(em_falta, tempos_previstos)}
+            CacheTempoEspera.guardar_estimativas(fila_id, novas)
+            estimativas.update(novas)
 
-        if tempo_previsto is not None:
-            tempo_espera = tempo_previsto
-        else:
-            senhas_concluidas = Ticket.objects.filter(fila_id=fila_id, status='Atendido')
-            tempos_servico = [s.tempo_servico for s in senhas_concluidas if s.tempo_servico is not None and s.tempo_servico > 0]
+        logger.debug(f"Tempos de espera calculados para {len(numeros)} senhas na fila {fila_id} ({len(em_falta)} previstos)")
+        return [estimativas[campo] if campo else 0 for campo in campos]
 
-            if tempos_servico:
-                tempo_medio = np.mean(tempos_servico)
-                tempo_estimado = tempo_medio
-                logger.debug(f"Tempo médio de atendimento calculado: {tempo_medio} min")
-            else:
-                tempo_estimado = fila.tempo_espera_medio or 5
-                logger.debug(f"Nenhuma senha atendida, usando tempo padrão: {tempo_estimado} min")
+    @staticmethod
+    def atualizar_tempos_espera_medios():
+        """Copia a média incremental do tempo de serviço para tempo_espera_medio, só nas filas em que mudou."""
+        atualizadas = Fila.objects.filter(atendimentos_contagem__gt=0)\
+            .exclude(tempo_espera_medio=F('tempo_servico_media'))\
+            .update(tempo_espera_medio=F('tempo_servico_media'))
+        logger.debug(f"tempo_espera_medio atualizado em {atualizadas} filas")
+        return atualizadas
 
-            tempo_espera = posicao * tempo_estimado
-            if prioridade > 0:
-                tempo_espera *= (1 - prioridade * 0.1)
-            if fila.tickets_ativos > 10:
-                tempo_espera += (fila.tickets_ativos - 10) * 0.5
+    @staticmethod
+    def tempos_espera_senhas(senhas):
+        """Tempo de espera das senhas pendentes, agrupadas por fila. Devolve {senha.id: tempo}."""
+        por_fila = {}
+        for senha in senhas:
+            if senha.status == 'Pendente':
+                por_fila.setdefault(senha.fila_id, []).append(senha)
+
+        tempos = {}
+        for fila_id, senhas_fila in por_fila.items():
+            calculados = ServicoFila.calcular_tempos_espera_lote(
+                fila_id,
+                [senha.numero_ticket for senha in senhas_fila],
+                [senha.prioridade for senha in senhas_fila]
+            )
+            tempos.update(zip((senha.id for senha in senhas_fila), calculados))
+        return tempos
 
-            fila.tempo_espera_medio = tempo_estimado
-            fila.save()
+    @staticmethod
+    def posicoes_senhas(senhas):
+        """Como calcular_posicao para várias senhas, com uma ida ao Redis por fila. Devolve {senha.id: posição}."""
+        posicoes = {senha.id: 0 for senha in senhas}
+        por_fila = {}
+        for senha in senhas:
+            if senha.status == 'Pendente':
+                por_fila.setdefault(senha.fila_id, []).append(senha)
 
-        tempo_espera = round(tempo_espera, 1)
-        logger.debug(f"Tempo de espera calculado para senha {numero_senha} na fila {fila_id}: {tempo_espera} min (posicao={posicao}, prioridade={prioridade})")
-        return tempo_espera
+        for fila_id, senhas_fila in por_fila.items():
+            a_frente = IndiceFilaViva.contar_a_frente_lote(
+                fila_id, [(senha.prioridade, senha.numero_ticket) for senha in senhas_fila]
+            )
+            if a_frente is None:
+                posicoes.update((senha.id, max(0, senha.numero_ticket - senha.fila.ticket_atual)) for senha in senhas_fila)
+            else:
+                posicoes.update((senha.id, contagem + 1) for senha, contagem in zip(senhas_fila, a_frente))
+        return posicoes
+
+    @staticmethod
+    def calcular_posicao(senha):
+        """Posição real da senha entre as pendentes (prioridades e cancelamentos incluídos)."""
+        if senha.status != 'Pendente':
+            return 0
+        posicao = IndiceFilaViva.posicao(senha.fila_id, senha.id)
+        if posicao is None:
+            posicao = max(0, senha.numero_ticket - senha.fila.ticket_atual)
+        return posicao
 
     @staticmethod
     def calcular_distancia(lat_usuario, lon_usuario, filial):
@@ -194,9 +772,103 @@ class ServicoFila:
                 logger.error(f"Erro ao enviar notificação via WebSocket: {e}")
 
     @staticmethod
-    @transaction.atomic
+    def enviar_notificacoes_lote(notificacoes):
+        """Envia várias notificações (usuario_id, senha_id, mensagem) com um único pedido FCM."""
+        usuarios_ids = {usuario_id for usuario_id, _, _ in notificacoes if usuario_id}
+        tokens = dict(
+            PerfilUsuario.objects.filter(usuario_id__in=usuarios_ids, token_fcm__isnull=False)
+            .values_list('usuario_id', 'token_fcm')
+        ) if usuarios_ids else {}
+
+        mensagens_fcm = [
+            messaging.Message(
+                notification=messaging.Notification(title="Facilita 2.0", body=mensagem),
+                data={"senha_id": str(senha_id) or ""},
+                token=tokens[usuario_id]
+            ) for usuario_id, senha_id, mensagem in notificacoes if tokens.get(usuario_id)
+        ]
+        if mensagens_fcm:
+            try:
+                resposta = messaging.send_each(mensagens_fcm)
+                logger.info(f"Notificações FCM em lote: {resposta.success_count} enviadas, {resposta.failure_count} falhas")
+            except Exception as e:
+                logger.error(f"Erro ao enviar notificações FCM em lote: {e}")
+
+        try:
+            camada_canal = get_channel_layer()
+            for usuario_id, _, mensagem in notificacoes:
+                if usuario_id:
+                    async_to_sync(camada_canal.group_send)(
+                        f"usuario_{usuario_id}",
+                        {
+                            "type": "notificacao",
+                            "mensagem": {"usuario_id": str(usuario_id), "mensagem": mensagem}
+                        }
+                    )
+        except Exception as e:
+            logger.error(f"Erro ao enviar notificações via WebSocket: {e}")
+
+    @staticmethod
+    def difundir_chamadas_painel(instituicao_id, fila_id, chamadas):
+        """Um único evento de painel para várias chamadas simultâneas."""
+        try:
+            camada_canal = get_channel_layer()
+            async_to_sync(camada_canal.group_send)(
+                f"painel_{instituicao_id}",
+                {
+                    "type": "atualizacao_painel",
+                    "mensagem": {
+                        "instituicao_id": str(instituicao_id),
+                        "fila_id": str(fila_id),
+                        "tipo_evento": "novas_chamadas",
+                        "dados": {"chamadas": chamadas}
+                    }
+                }
+            )
+        except Exception as e:
+            logger.error(f"Erro ao enviar chamadas para o painel {instituicao_id}: {e}")
+
+    @staticmethod
+    def difundir_atualizacao_fila(fila_id, tickets_ativos, ticket_atual, mensagem):
+        try:
+            camada_canal = get_channel_layer()
+            async_to_sync(camada_canal.group_send)(
+                f"fila_{fila_id}",
+                {
+                    "type": "atualizacao_fila",
+                    "mensagem": {
+                        "fila_id": str(fila_id),
+                        "tickets_ativos": tickets_ativos,
+                        "ticket_atual": ticket_atual,
+                        "mensagem": mensagem
+                    }
+                }
+            )
+        except Exception as e:
+            logger.error(f"Erro ao enviar atualização de fila via WebSocket: {e}")
+
+    @staticmethod
+    def _executar_efeito(funcao, args, kwargs):
+        try:
+            funcao(*args, **kwargs)
+        except Exception as e:
+            logger.error(f"Erro ao executar efeito colateral {funcao.__name__}: {e}")
+        finally:
+            close_old_connections()
+
+    @staticmethod
+    def agendar_apos_commit(funcao, *args, **kwargs):
+        """Executa `funcao` no executor de efeitos depois do commit da transação corrente.
+
+        Em caso de rollback o efeito é descartado; fora de uma transação é submetido de imediato.
+        """
+        transaction.on_commit(
+            lambda: executor_efeitos.submit(ServicoFila._executar_efeito, funcao, args, kwargs)
+        )
+
+    @staticmethod
     def adicionar_a_fila(servico, usuario_id, prioridade=0, e_fisico=False, token_fcm=None, filial_id=None):
-        consulta = Fila.objects.filter(servico=servico)
+        consulta = Fila.objects.select_related('departamento__filial').filter(servico=servico)
         if filial_id:
             consulta = consulta.filter(departamento__filial__id=filial_id)
         fila = consulta.first()
@@ -217,64 +889,49 @@ class ServicoFila:
             logger.warning(f"Usuário {usuario_id} já possui uma senha ativa na fila {fila.id}")
             raise ValueError("Você já possui uma senha ativa")
 
-        numero_senha = fila.tickets_ativos + 1
-        codigo_qr = ServicoFila.gerar_codigo_qr()
-        senha = Ticket(
-            id=uuid.uuid4(),
-            fila=fila,
-            usuario_id=usuario_id,
-            numero_ticket=numero_senha,
-            codigo_qr=codigo_qr,
-            prioridade=prioridade,
-            e_fisico=e_fisico,
-            emitido_em=timezone.now()
-        )
-
-        fila.tickets_ativos += 1
-        fila.save()
-        senha.save()
-
-        senha_completa = Ticket.objects.get(id=senha.id)  # Recarregar para garantir relações
-        if not senha_completa.fila:
-            logger.error(f"Relação senha.fila não carregada para senha {senha.id}")
-            raise ValueError("Erro ao carregar a fila associada à senha")
+        with transaction.atomic():
+            AlocadorSenhas.reservar_vaga(fila)
+            numero_senha = AlocadorSenhas.alocar(fila)
+            codigo_qr = ServicoFila.gerar_codigo_qr()
+            senha = Ticket(
+                id=uuid.uuid4(),
+                fila=fila,
+                usuario_id=usuario_id,
+                numero_ticket=numero_senha,
+                codigo_qr=codigo_qr,
+                prioridade=prioridade,
+                e_fisico=e_fisico,
+                emitido_em=timezone.now()
+            )
+            senha.save()
+            IndiceFilaViva.adicionar_apos_commit([senha])
+            CacheTempoEspera.invalidar_apos_commit([fila.id])
 
+        # Comprovante, PDF e notificações ficam fora da transação: não seguram o lock da Fila
         senha.dados_recibo = ServicoFila.gerar_comprovante(senha) if e_fisico else None
         tempo_espera = ServicoFila.calcular_tempo_espera(fila.id, numero_senha, prioridade)
-        posicao = max(0, senha.numero_ticket - fila.ticket_atual)
+        posicao = ServicoFila.calcular_posicao(senha)
         pdf_buffer = None
 
         if e_fisico:
             pdf_buffer = ServicoFila.gerar_pdf_senha(senha, posicao, tempo_espera)
 
         mensagem = f"Senha {fila.prefixo}{numero_senha} emitida. QR: {codigo_qr}. Espera: {tempo_espera if tempo_espera != 'N/A' else 'Aguardando início'}"
-        ServicoFila.enviar_notificacao(token_fcm, mensagem, senha.id, via_websocket=True, usuario_id=usuario_id)
-
-        try:
-            camada_canal = get_channel_layer()
-            async_to_sync(camada_canal.group_send)(
-                f"fila_{fila.id}",
-                {
-                    "type": "atualizacao_fila",
-                    "mensagem": {
-                        "fila_id": str(fila.id),
-                        "tickets_ativos": fila.tickets_ativos,
-                        "ticket_atual": fila.ticket_atual,
-                        "mensagem": f"Nova senha emitida: {fila.prefixo}{numero_senha}"
-                    }
-                }
-            )
-        except Exception as e:
-            logger.error(f"Erro ao enviar atualização de fila via WebSocket: {e}")
+        ServicoFila.agendar_apos_commit(
+            ServicoFila.enviar_notificacao, token_fcm, mensagem, senha.id, via_websocket=True, usuario_id=usuario_id
+        )
+        ServicoFila.agendar_apos_commit(
+            ServicoFila.difundir_atualizacao_fila,
+            fila.id, fila.tickets_ativos, fila.ticket_atual, f"Nova senha emitida: {fila.prefixo}{numero_senha}"
+        )
 
         logger.info(f"Senha {senha.id} adicionada à fila {servico}")
         return senha, pdf_buffer
 
     @staticmethod
-    @transaction.atomic
     def gerar_senha_fisica_para_totem(fila_id, ip_cliente):
         try:
-            fila = Fila.objects.get(id=fila_id)
+            fila = Fila.objects.select_related('departamento__filial').get(id=fila_id)
         except ObjectDoesNotExist:
             logger.error(f"Fila não encontrada para fila_id={fila_id}")
             raise ValueError("Fila não encontrada")
@@ -298,67 +955,58 @@ class ServicoFila:
         except Exception as e:
             logger.warning(f"Erro ao acessar Redis para limite de emissão ({ip_cliente}): {e}. Prosseguindo sem limite.")
 
-        numero_senha = fila.tickets_ativos + 1
-        codigo_qr = ServicoFila.gerar_codigo_qr()
-        senha = Ticket(
-            id=uuid.uuid4(),
-            fila=fila,
-            usuario_id='PRESENCIAL',
-            numero_ticket=numero_senha,
-            codigo_qr=codigo_qr,
-            prioridade=0,
-            e_fisico=True,
-            status='Pendente',
-            emitido_em=timezone.now(),
-            expira_em=timezone.now() + timedelta(hours=4)
-        )
-
-        fila.tickets_ativos += 1
-        fila.save()
-        senha.save()
+        with transaction.atomic():
+            AlocadorSenhas.reservar_vaga(fila)
+            numero_senha = AlocadorSenhas.alocar(fila)
+            codigo_qr = ServicoFila.gerar_codigo_qr()
+            senha = Ticket(
+                id=uuid.uuid4(),
+                fila=fila,
+                usuario_id=None,
+                numero_ticket=numero_senha,
+                codigo_qr=codigo_qr,
+                prioridade=0,
+                e_fisico=True,
+                status='Pendente',
+                emitido_em=timezone.now(),
+                expira_em=timezone.now() + timedelta(hours=4)
+            )
+            senha.save()
+
+            log_auditoria = LogAuditoria(
+                id=uuid.uuid4(),
+                id_usuario=None,
+                acao='GERAR_SENHA_FISICA_USUARIO',
+                tipo_recurso='Senha',
+                id_recurso=str(senha.id),
+                detalhes=f"Senha {codigo_qr} gerada via mesa digital para fila {fila.servico} (IP: {ip_cliente})",
+                data_hora=timezone.now()
+            )
+            log_auditoria.save()
+            IndiceFilaViva.adicionar_apos_commit([senha])
+            CacheTempoEspera.invalidar_apos_commit([fila.id])
 
         tempo_espera = ServicoFila.calcular_tempo_espera(fila.id, numero_senha, 0)
-        posicao = max(0, senha.numero_ticket - fila.ticket_atual)
+        posicao = ServicoFila.calcular_posicao(senha)
         pdf_buffer = ServicoFila.gerar_pdf_senha(senha, posicao, tempo_espera)
         pdf_base64 = pdf_buffer.getvalue().hex()
-
         senha.dados_recibo = ServicoFila.gerar_comprovante(senha)
-        log_auditoria = LogAuditoria(
-            id=uuid.uuid4(),
-            id_usuario=None,
-            acao='GERAR_SENHA_FISICA_USUARIO',
-            tipo_recurso='Senha',
-            id_recurso=str(senha.id),
-            detalhes=f"Senha {codigo_qr} gerada via mesa digital para fila {fila.servico} (IP: {ip_cliente})",
-            data_hora=timezone.now()
-        )
-        log_auditoria.save()
 
-        try:
-            camada_canal = get_channel_layer()
-            async_to_sync(camada_canal.group_send)(
-                f"fila_{fila.id}",
-                {
-                    "type": "atualizacao_fila",
-                    "mensagem": {
-                        "fila_id": str(fila.id),
-                        "tickets_ativos": fila.tickets_ativos,
-                        "ticket_atual": fila.ticket_atual,
-                        "mensagem": f"Nova senha emitida: {fila.prefixo}{numero_senha}"
-                    }
-                }
-            )
-        except Exception as e:
-            logger.error(f"Erro ao enviar atualização de fila via WebSocket: {e}")
+        ServicoFila.agendar_apos_commit(
+            ServicoFila.difundir_atualizacao_fila,
+            fila.id, fila.tickets_ativos, fila.ticket_atual, f"Nova senha emitida: {fila.prefixo}{numero_senha}"
+        )
 
         logger.info(f"Senha física {senha.id} gerada via totem para fila {fila_id}")
         return {
             'senha': {
                 'id': str(senha.id),
                 'fila_id': str(senha.fila_id),
+                'usuario_id': senha.usuario_exibido,
                 'numero_senha': senha.numero_ticket,
                 'codigo_qr': senha.codigo_qr,
                 'status': senha.status,
+                'posicao': posicao,
                 'emitido_em': senha.emitido_em.isoformat(),
                 'expira_em': senha.expira_em.isoformat()
             },
@@ -367,7 +1015,302 @@ class ServicoFila:
 
     @staticmethod
     @transaction.atomic
-    def chamar_proximo(servico, filial_id=None):
+    def gerar_senhas_fisicas_em_lote(fila_id, quantidade, id_usuario=None):
+        try:
+            fila = Fila.objects.select_related('departamento__filial__instituicao').get(id=fila_id)
+        except ObjectDoesNotExist:
+            logger.error(f"Fila não encontrada para fila_id={fila_id}")
+            raise ValueError("Fila não encontrada")
+
+        if quantidade < 1 or quantidade > ServicoFila.MAXIMO_SENHAS_LOTE:
+            logger.warning(f"Quantidade inválida para emissão em lote na fila {fila_id}: {quantidade}")
+            raise ValueError(f"A quantidade deve estar entre 1 e {ServicoFila.MAXIMO_SENHAS_LOTE}")
+
+        if not ServicoFila.esta_fila_aberta(fila):
+            logger.warning(f"Fila {fila_id} está fechada")
+            raise ValueError("Fila está fechada no momento")
+
+        AlocadorSenhas.reservar_vaga(fila, quantidade)
+        ultimo_numero = AlocadorSenhas.alocar(fila, quantidade)
+        primeiro_numero = ultimo_numero - quantidade + 1
+
+        agora = timezone.now()
+        senhas = []
+        for numero_senha in range(primeiro_numero, ultimo_numero + 1):
+            senha = Ticket(
+                id=uuid.uuid4(),
+                fila=fila,
+                usuario_id=None,
+                numero_ticket=numero_senha,
+                codigo_qr=ServicoFila.gerar_codigo_qr(),
+                prioridade=0,
+                e_fisico=True,
+                status='Pendente',
+                emitido_em=agora,
+                expira_em=agora + timedelta(hours=4)
+            )
+            senha.dados_recibo = ServicoFila.gerar_comprovante(senha)
+            senhas.append(senha)
+        Ticket.objects.bulk_create(senhas)
+        IndiceFilaViva.adicionar_apos_commit(senhas)
+        CacheTempoEspera.invalidar_apos_commit([fila.id])
+
+        LogAuditoria.objects.bulk_create([
+            LogAuditoria(
+                id=uuid.uuid4(),
+                id_usuario=str(id_usuario) if id_usuario else None,
+                acao='GERAR_SENHA_FISICA_LOTE',
+                tipo_recurso='Senha',
+                id_recurso=str(senha.id),
+                detalhes=f"Senha {senha.codigo_qr} gerada em lote para fila {fila.servico}",
+                data_hora=agora
+            ) for senha in senhas
+        ])
+
+        ServicoFila.agendar_apos_commit(
+            ServicoFila.difundir_atualizacao_fila,
+            fila.id, fila.tickets_ativos, fila.ticket_atual,
+            f"{quantidade} senhas emitidas: {fila.prefixo}{primeiro_numero} a {fila.prefixo}{ultimo_numero}"
+        )
+
+        logger.info(f"{quantidade} senhas físicas geradas em lote para fila {fila_id} ({primeiro_numero}-{ultimo_numero})")
+        return {
+            'senhas': [
+                {
+                    'id': str(senha.id),
+                    'fila_id': str(fila.id),
+                    'usuario_id': senha.usuario_exibido,
+                    'numero_senha': senha.numero_ticket,
+                    'senha': f"{fila.prefixo}{senha.numero_ticket}",
+                    'codigo_qr': senha.codigo_qr,
+                    'status': senha.status,
+                    'emitido_em': senha.emitido_em.isoformat(),
+                    'expira_em': senha.expira_em.isoformat(),
+                    'comprovante': senha.dados_recibo
+                } for senha in senhas
+            ],
+            # Um comprovante por página: o form feed faz a impressora térmica cortar entre senhas
+            'documento': '\f'.join(senha.dados_recibo for senha in senhas)
+        }
+
+    @staticmethod
+    @transaction.atomic
+    def reservar_bloco_totem(fila_id, totem_id, quantidade=None):
+        """Reserva um bloco de números consecutivos para um totem imprimir sem rede.
+
+        A capacidade só é consumida quando o totem sincroniza as senhas emitidas;
+        aqui apenas se garante que os blocos em aberto não excedem o limite diário.
+        """
+        quantidade = quantidade or settings.TOTEM_TAMANHO_BLOCO
+        if quantidade < 1 or quantidade > ServicoFila.MAXIMO_SENHAS_LOTE:
+            logger.warning(f"Tamanho de bloco inválido para totem {totem_id} na fila {fila_id}: {quantidade}")
+            raise ValueError(f"A quantidade deve estar entre 1 e {ServicoFila.MAXIMO_SENHAS_LOTE}")
+
+        fila = Fila.objects.select_for_update(of=('self',)).select_related('departamento__filial').filter(id=fila_id).first()
+        if not fila:
+            logger.error(f"Fila não encontrada para fila_id={fila_id}")
+            raise ValueError("Fila não encontrada")
+
+        if not Totem.objects.filter(codigo=totem_id, filial_id=fila.departamento.filial_id, ativo=True).exists():
+            logger.warning(f"Totem {totem_id} não registrado ou inativo na filial da fila {fila_id}")
+            raise ValueError("Totem não registrado nesta filial")
+
+        if not ServicoFila.esta_fila_aberta(fila):
+            logger.warning(f"Fila {fila_id} está fechada")
+            raise ValueError("Fila está fechada no momento")
+
+        agora = timezone.now()
+        em_aberto = ReservaBlocoTotem.objects.filter(
+            fila=fila, encerrada=False, expira_em__gt=agora
+        ).aggregate(
+            restantes=Coalesce(Sum(F('numero_final') - F('numero_inicial') + 1 - F('emitidas')), 0)
+        )['restantes']
+        if fila.tickets_ativos + em_aberto + quantidade > fila.limite_diario:
+            logger.warning(f"Fila {fila_id} sem capacidade para bloco de {quantidade}: {fila.tickets_ativos} ativas, {em_aberto} em blocos")
+            raise ValueError("Limite diário atingido")
+
+        ultimo_numero = AlocadorSenhas.alocar(fila, quantidade)
+        reserva = ReservaBlocoTotem.objects.create(
+            fila=fila,
+            totem_id=totem_id,
+            numero_inicial=ultimo_numero - quantidade + 1,
+            numero_final=ultimo_numero,
+            reservado_em=agora,
+            expira_em=agora + timedelta(hours=settings.TOTEM_VALIDADE_BLOCO_HORAS)
+        )
+
+        logger.info(f"Bloco {reserva.numero_inicial}-{reserva.numero_final} reservado para totem {totem_id} na fila {fila_id}")
+        return {
+            'reserva_id': str(reserva.id),
+            'fila_id': str(fila.id),
+            'prefixo': fila.prefixo,
+            'numero_inicial': reserva.numero_inicial,
+            'numero_final': reserva.numero_final,
+            'expira_em': reserva.expira_em.isoformat()
+        }
+
+    @staticmethod
+    @transaction.atomic
+    def sincronizar_bloco_totem(reserva_id, totem_id, senhas_emitidas, encerrar=False):
+        """Grava numa só transação as senhas que o totem imprimiu a partir de um bloco.
+
+        Números já sincronizados são ignorados, para que o totem possa repetir o
+        envio depois de uma falha de rede.
+        """
+        reserva = ReservaBlocoTotem.objects.select_for_update(of=('self',)).select_related('fila__departamento__filial').filter(id=reserva_id).first()
+        if not reserva or reserva.totem_id != totem_id:
+            logger.warning(f"Reserva {reserva_id} não encontrada para totem {totem_id}")
+            raise ValueError("Reserva de bloco não encontrada")
+        # Os números do bloco são do dia local da filial (ver AlocadorSenhas)
+        if AlocadorSenhas._dia_local(reserva.fila, reserva.reservado_em)[0] != AlocadorSenhas._dia_local(reserva.fila)[0]:
+            logger.warning(f"Reserva {reserva_id} do totem {totem_id} pertence a outro dia")
+            raise ValueError("Reserva de bloco expirada")
+
+        fila = reserva.fila
+        por_numero = {}
+        for dados in senhas_emitidas:
+            try:
+                numero_senha = int(dados['numero_senha'])
+            except (KeyError, TypeError, ValueError):
+                raise ValueError("Cada senha deve ter numero_senha inteiro")
+            if not reserva.numero_inicial <= numero_senha <= reserva.numero_final:
+                logger.warning(f"Senha {numero_senha} fora do bloco {reserva.numero_inicial}-{reserva.numero_final} (totem {totem_id})")
+                raise ValueError(f"Senha {numero_senha} fora do bloco reservado")
+            por_numero[numero_senha] = dados
+
+        ja_gravados = set(Ticket.objects.filter(
+            fila=fila,
+            numero_ticket__range=(reserva.numero_inicial, reserva.numero_final),
+            emitido_em__gte=reserva.reservado_em
+        ).values_list('numero_ticket', flat=True))
+
+        novos = sorted(por_numero.keys() - ja_gravados)
+        codigos = [por_numero[n]['codigo_qr'] for n in novos if por_numero[n].get('codigo_qr')]
+        if len(codigos) != len(set(codigos)) or Ticket.objects.filter(codigo_qr__in=codigos).exists():
+            logger.warning(f"Códigos QR repetidos no envio do totem {totem_id} para o bloco {reserva_id}")
+            raise ValueError("Código QR já utilizado")
+
+        agora = timezone.now()
+        senhas = []
+        for numero_senha in novos:
+            dados = por_numero[numero_senha]
+            emitido_em = agora
+            if dados.get('emitido_em'):
+                try:
+                    emitido_em = datetime.fromisoformat(dados['emitido_em'])
+                except (TypeError, ValueError):
+                    raise ValueError(f"emitido_em inválido para a senha {numero_senha}")
+                if timezone.is_naive(emitido_em):
+                    emitido_em = timezone.make_aware(emitido_em)
+                # Relógio do totem não é confiável: manter dentro da validade do bloco
+                emitido_em = min(max(emitido_em, reserva.reservado_em), agora)
+            senha = Ticket(
+                id=uuid.uuid4(),
+                fila=fila,
+                usuario_id=None,
+                numero_ticket=numero_senha,
+                codigo_qr=(dados.get('codigo_qr') or ServicoFila.gerar_codigo_qr())[:50],
+                prioridade=0,
+                e_fisico=True,
+                status='Pendente',
+                emitido_em=emitido_em,
+                expira_em=emitido_em + timedelta(hours=4)
+            )
+            senha.dados_recibo = ServicoFila.gerar_comprovante(senha)
+            senhas.append(senha)
+
+        if senhas:
+            Ticket.objects.bulk_create(senhas)
+            IndiceFilaViva.adicionar_apos_commit(senhas)
+            CacheTempoEspera.invalidar_apos_commit([fila.id])
+            Fila.objects.filter(id=fila.id).update(tickets_ativos=F('tickets_ativos') + len(senhas))
+            LogAuditoria.objects.bulk_create([
+                LogAuditoria(
+                    id=uuid.uuid4(),
+                    id_usuario=None,
+                    acao='SINCRONIZAR_SENHA_TOTEM',
+                    tipo_recurso='Senha',
+                    id_recurso=str(senha.id),
+                    detalhes=f"Senha {senha.codigo_qr} emitida offline pelo totem {totem_id} para fila {fila.servico}",
+                    data_hora=agora
+                ) for senha in senhas
+            ])
+
+        reserva.emitidas += len(senhas)
+        reserva.encerrada = reserva.encerrada or encerrar
+        reserva.save(update_fields=['emitidas', 'encerrada'])
+
+        if senhas:
+            fila.refresh_from_db(fields=['tickets_ativos', 'ticket_atual'])
+            ServicoFila.agendar_apos_commit(
+                ServicoFila.difundir_atualizacao_fila,
+                fila.id, fila.tickets_ativos, fila.ticket_atual,
+                f"{len(senhas)} senhas sincronizadas pelo totem {totem_id}"
+            )
+
+        logger.info(f"Totem {totem_id} sincronizou {len(senhas)} senhas do bloco {reserva.id} ({len(ja_gravados & por_numero.keys())} repetidas)")
+        return {
+            'reserva_id': str(reserva.id),
+            'sincronizadas': len(senhas),
+            'repetidas': len(ja_gravados & por_numero.keys()),
+            'emitidas_no_bloco': reserva.emitidas,
+            'restantes_no_bloco': reserva.quantidade - reserva.emitidas,
+            'encerrada': reserva.encerrada
+        }
+
+    @staticmethod
+    def _proximo_balcao(fila):
+        """Rodízio de balcões partilhado entre processos, sem travar a linha da Fila."""
+        if fila.num_balcoes <= 1:
+            return 1
+        try:
+            contador = redis_client.incr(f"rodizio_balcao:{fila.id}")
+            return (contador - 1) % fila.num_balcoes + 1
+        except redis.RedisError as e:
+            logger.warning(f"Erro ao acessar Redis para rodízio de balcões da fila {fila.id}: {e}. Prosseguindo sem rodízio partilhado.")
+            return (fila.ultimo_balcao % fila.num_balcoes) + 1
+
+    @staticmethod
+    def _travar_proximas_senhas(fila, quantidade=1):
+        """Trava até `quantidade` senhas pendentes na ordem de atendimento.
+
+        Usa SKIP LOCKED: senhas já travadas por outro balcão são saltadas em vez
+        de esperar por elas, por isso balcões simultâneos recebem senhas distintas.
+        O índice só é lido aqui; as senhas travadas saem dele depois do commit.
+        """
+        senhas = []
+        resolvidas = set()
+        inicio = 0
+        while len(senhas) < quantidade:
+            senhas_ids = IndiceFilaViva.consultar_proximos(fila.id, inicio, quantidade - len(senhas))
+            if not senhas_ids:
+                break
+            inicio += len(senhas_ids)
+            travadas = list(Ticket.objects.select_for_update(skip_locked=True).filter(id__in=senhas_ids, status='Pendente'))
+            senhas.extend(travadas)
+            saltadas = set(senhas_ids) - {str(senha.id) for senha in travadas}
+            if saltadas:
+                # Travadas por outro balcão continuam pendentes; as restantes já não o são e saem com as chamadas
+                ainda_pendentes = {str(i) for i in Ticket.objects.filter(id__in=saltadas, status='Pendente').values_list('id', flat=True)}
+                resolvidas |= saltadas - ainda_pendentes
+                logger.debug(f"{len(saltadas)} entradas do índice da fila {fila.id} não puderam ser travadas")
+
+        if len(senhas) < quantidade:
+            senhas.extend(
+                Ticket.objects.select_for_update(skip_locked=True)
+                .filter(fila_id=fila.id, status='Pendente')
+                .exclude(id__in=[senha.id for senha in senhas])
+                .order_by('-prioridade', 'numero_ticket')[:quantidade - len(senhas)]
+            )
+
+        if senhas or resolvidas:
+            IndiceFilaViva.remover_apos_commit(fila.id, [*(senha.id for senha in senhas), *resolvidas])
+        senhas.sort(key=lambda senha: (-senha.prioridade, senha.numero_ticket))
+        return senhas
+
+    @staticmethod
+    @transaction.atomic
+    def chamar_proximo(servico, filial_id=None, balcao=None):
         consulta = Fila.objects.filter(servico=servico)
         if filial_id:
             consulta = consulta.filter(departamento__filial__id=filial_id)
@@ -381,49 +1324,116 @@ class ServicoFila:
             logger.warning(f"Fila {fila.id} está fechada para chamar próximo")
             raise ValueError("Fila está fechada no momento")
 
+        if balcao is not None and not 1 <= balcao <= fila.num_balcoes:
+            logger.warning(f"Balcão {balcao} inválido para fila {fila.id} com {fila.num_balcoes} balcões")
+            raise ValueError("Balcão inválido")
+
         if fila.tickets_ativos == 0:
             logger.warning(f"Fila {servico} está vazia")
             raise ValueError("Fila vazia")
 
-        proxima_senha = Ticket.objects.filter(fila_id=fila.id, status='Pendente')\
-            .order_by('-prioridade', 'numero_ticket').first()
-        if not proxima_senha:
+        senhas = ServicoFila._travar_proximas_senhas(fila)
+        if not senhas:
             logger.warning(f"Não há senhas pendentes na fila {fila.id}")
             raise ValueError("Nenhuma senha pendente")
+        proxima_senha = senhas[0]
 
         agora = timezone.now()
-        proxima_senha.expira_em = agora + timedelta(minutes=ServicoFila.MINUTOS_TIMEOUT_CHAMADA)
-        fila.ticket_atual = proxima_senha.numero_ticket
-        fila.tickets_ativos -= 1
-        fila.ultimo_balcao = (fila.ultimo_balcao % fila.num_balcoes) + 1
         proxima_senha.status = 'Chamado'
-        proxima_senha.balcao = fila.ultimo_balcao
+        proxima_senha.balcao = balcao or ServicoFila._proximo_balcao(fila)
         proxima_senha.atendido_em = agora
-        proxima_senha.save()
-        fila.save()
+        proxima_senha.expira_em = agora + timedelta(minutes=ServicoFila.MINUTOS_TIMEOUT_CHAMADA)
+        proxima_senha.save(update_fields=['status', 'balcao', 'atendido_em', 'expira_em'])
+        AgendaExpiracao.agendar_apos_commit([proxima_senha])
+        CacheTempoEspera.invalidar_apos_commit([fila.id])
+
+        # Último comando da transação: a linha da Fila fica travada só até ao commit
+        Fila.objects.filter(id=fila.id).update(
+            ticket_atual=proxima_senha.numero_ticket,
+            tickets_ativos=Greatest(F('tickets_ativos') - 1, 0),
+            ultimo_balcao=proxima_senha.balcao
+        )
+        fila.refresh_from_db(fields=['ticket_atual', 'tickets_ativos', 'ultimo_balcao'])
 
         mensagem = f"Dirija-se ao guichê {proxima_senha.balcao:02d}! Senha {fila.prefixo}{proxima_senha.numero_ticket} chamada."
-        ServicoFila.enviar_notificacao(None, mensagem, proxima_senha.id, via_websocket=True, usuario_id=proxima_senha.usuario_id)
+        ServicoFila.agendar_apos_commit(
+            ServicoFila.enviar_notificacao, None, mensagem, proxima_senha.id, via_websocket=True, usuario_id=proxima_senha.usuario_id
+        )
+        ServicoFila.agendar_apos_commit(
+            ServicoFila.difundir_atualizacao_fila,
+            fila.id, fila.tickets_ativos, fila.ticket_atual, f"Senha {fila.prefixo}{proxima_senha.numero_ticket} chamada"
+        )
 
-        try:
-            camada_canal = get_channel_layer()
-            async_to_sync(camada_canal.group_send)(
-                f"fila_{fila.id}",
+        logger.info(f"Senha {proxima_senha.id} chamada na fila {servico} para o balcão {proxima_senha.balcao}")
+        return proxima_senha
+
+    @staticmethod
+    @transaction.atomic
+    def chamar_proximos(fila_id, balcoes=None):
+        """Atribui as próximas senhas pendentes a vários balcões numa só transação."""
+        fila = Fila.objects.select_related('departamento__filial').filter(id=fila_id).first()
+        if not fila:
+            logger.warning(f"Fila {fila_id} não encontrada")
+            raise ValueError("Fila não encontrada")
+
+        if not ServicoFila.esta_fila_aberta(fila):
+            logger.warning(f"Fila {fila.id} está fechada para chamar próximos")
+            raise ValueError("Fila está fechada no momento")
+
+        balcoes = list(balcoes) if balcoes else list(range(1, fila.num_balcoes + 1))
+        if len(set(balcoes)) != len(balcoes) or any(not 1 <= balcao <= fila.num_balcoes for balcao in balcoes):
+            logger.warning(f"Balcões inválidos para fila {fila.id} com {fila.num_balcoes} balcões: {balcoes}")
+            raise ValueError("Balcões inválidos")
+
+        senhas = ServicoFila._travar_proximas_senhas(fila, len(balcoes))
+        if not senhas:
+            logger.warning(f"Não há senhas pendentes na fila {fila.id}")
+            raise ValueError("Nenhuma senha pendente")
+
+        # As senhas só saem do índice depois do commit (_travar_proximas_senhas): um rollback não as perde
+        agora = timezone.now()
+        for senha, balcao in zip(senhas, balcoes):
+            senha.status = 'Chamado'
+            senha.balcao = balcao
+            senha.atendido_em = agora
+            senha.expira_em = agora + timedelta(minutes=ServicoFila.MINUTOS_TIMEOUT_CHAMADA)
+        Ticket.objects.bulk_update(senhas, ['status', 'balcao', 'atendido_em', 'expira_em'])
+        AgendaExpiracao.agendar_apos_commit(senhas)
+        CacheTempoEspera.invalidar_apos_commit([fila.id])
+
+        Fila.objects.filter(id=fila.id).update(
+            ticket_atual=senhas[-1].numero_ticket,
+            tickets_ativos=Greatest(F('tickets_ativos') - len(senhas), 0),
+            ultimo_balcao=senhas[-1].balcao
+        )
+        fila.refresh_from_db(fields=['ticket_atual', 'tickets_ativos', 'ultimo_balcao'])
+
+        ServicoFila.agendar_apos_commit(
+            ServicoFila.enviar_notificacoes_lote,
+            [
+                (senha.usuario_id, senha.id, f"Dirija-se ao guichê {senha.balcao:02d}! Senha {fila.prefixo}{senha.numero_ticket} chamada.")
+                for senha in senhas
+            ]
+        )
+        ServicoFila.agendar_apos_commit(
+            ServicoFila.difundir_atualizacao_fila,
+            fila.id, fila.tickets_ativos, fila.ticket_atual, f"{len(senhas)} senhas chamadas"
+        )
+        ServicoFila.agendar_apos_commit(
+            ServicoFila.difundir_chamadas_painel,
+            fila.departamento.filial.instituicao_id,
+            fila.id,
+            [
                 {
-                    "type": "atualizacao_fila",
-                    "mensagem": {
-                        "fila_id": str(fila.id),
-                        "tickets_ativos": fila.tickets_ativos,
-                        "ticket_atual": fila.ticket_atual,
-                        "mensagem": f"Senha {fila.prefixo}{proxima_senha.numero_ticket} chamada"
-                    }
-                }
-            )
-        except Exception as e:
-            logger.error(f"Erro ao enviar atualização de fila via WebSocket: {e}")
+                    "numero_senha": f"{fila.prefixo}{senha.numero_ticket}",
+                    "balcao": senha.balcao,
+                    "timestamp": senha.atendido_em.isoformat()
+                } for senha in senhas
+            ]
+        )
 
-        logger.info(f"Senha {proxima_senha.id} chamada na fila {servico}")
-        return proxima_senha
+        logger.info(f"{len(senhas)} senhas chamadas na fila {fila.id} para os balcões {[senha.balcao for senha in senhas]}")
+        return senhas
 
     @staticmethod
     def verificar_notificacoes_proximidade(usuario_id, lat_usuario, lon_usuario, servico_desejado=None, instituicao_id=None, filial_id=None):
@@ -504,7 +1514,8 @@ class ServicoFila:
                 f"a {distancia:.2f} km de você. Tempo de espera: {tempo_espera if tempo_espera != 'N/A' else 'Aguardando início'} min."
             )
 
-            ServicoFila.enviar_notificacao(
+            ServicoFila.agendar_apos_commit(
+                ServicoFila.enviar_notificacao,
                 perfil.token_fcm,
                 mensagem,
                 via_websocket=True,
@@ -517,16 +1528,25 @@ class ServicoFila:
 
     @staticmethod
     def verificar_notificacoes_proativas():
-        agora = timezone.now()
-        senhas = Ticket.objects.filter(status='Pendente')
+        senhas = list(Ticket.objects.filter(status='Pendente').select_related('fila__departamento__filial'))
+        abertas = {}
+        for senha in senhas:
+            if senha.fila_id not in abertas:
+                abertas[senha.fila_id] = ServicoFila.esta_fila_aberta(senha.fila)
+        tempos = ServicoFila.tempos_espera_senhas([senha for senha in senhas if abertas[senha.fila_id]])
+
         for senha in senhas:
             fila = senha.fila
-            if not ServicoFila.esta_fila_aberta(fila):
-                senha.status = 'Cancelado'
-                fila.tickets_ativos -= 1
-                fila.save()
-                senha.save()
-                ServicoFila.enviar_notificacao(
+            if not abertas[senha.fila_id]:
+                # Só desconta se a senha ainda estava pendente: pode ter sido chamada ou cancelada entretanto
+                with transaction.atomic():
+                    if not Ticket.objects.filter(id=senha.id, status='Pendente').update(status='Cancelado', cancelado_em=timezone.now()):
+                        continue
+                    Fila.objects.filter(id=fila.id).update(tickets_ativos=Greatest(F('tickets_ativos') - 1, 0))
+                IndiceFilaViva.remover_apos_commit(fila.id, [senha.id])
+                CacheTempoEspera.invalidar_apos_commit([fila.id])
+                ServicoFila.agendar_apos_commit(
+                    ServicoFila.enviar_notificacao,
                     None,
                     f"Sua senha {fila.prefixo}{senha.numero_ticket} foi cancelada porque o horário de atendimento terminou.",
                     usuario_id=senha.usuario_id
@@ -534,17 +1554,17 @@ class ServicoFila:
                 logger.info(f"Senha {senha.id} cancelada devido ao fim do horário de atendimento")
                 continue
 
-            tempo_espera = ServicoFila.calcular_tempo_espera(senha.fila_id, senha.numero_ticket, senha.prioridade)
+            tempo_espera = tempos[senha.id]
             if tempo_espera == "N/A":
                 continue
 
-            if tempo_espera <= 5 and senha.usuario_id != 'PRESENCIAL':
+            if tempo_espera <= 5 and not senha.e_presencial:
                 distancia = ServicoFila.calcular_distancia(-8.8147, 13.2302, senha.fila.departamento.filial)
                 msg_distancia = f" Você está a {distancia} km." if distancia else ""
                 mensagem = f"Sua vez está próxima! {senha.fila.servico}, Senha {senha.fila.prefixo}{senha.numero_ticket}. Prepare-se em {tempo_espera} min.{msg_distancia}"
-                ServicoFila.enviar_notificacao(None, mensagem, senha.id, via_websocket=True, usuario_id=senha.usuario_id)
+                ServicoFila.agendar_apos_commit(ServicoFila.enviar_notificacao, None, mensagem, senha.id, via_websocket=True, usuario_id=senha.usuario_id)
 
-            if senha.usuario_id != 'PRESENCIAL':
+            if not senha.e_presencial:
                 try:
                     perfil = PerfilUsuario.objects.get(usuario_id=senha.usuario_id)
                     if perfil.ultima_latitude and perfil.ultima_longitude and perfil.ultima_atualizacao_local:
@@ -554,25 +1574,67 @@ class ServicoFila:
                                 tempo_viagem = distancia * 2
                                 if tempo_espera <= tempo_viagem:
                                     mensagem = f"Você está a {distancia} km! Senha {senha.fila.prefixo}{senha.numero_ticket} será chamada em {tempo_espera} min. Comece a se deslocar!"
-                                    ServicoFila.enviar_notificacao(None, mensagem, senha.id, via_websocket=True, usuario_id=senha.usuario_id)
+                                    ServicoFila.agendar_apos_commit(ServicoFila.enviar_notificacao, None, mensagem, senha.id, via_websocket=True, usuario_id=senha.usuario_id)
                         else:
                             logger.debug(f"Localização do usuário {senha.usuario_id} desatualizada: {perfil.ultima_atualizacao_local}")
                 except ObjectDoesNotExist:
                     logger.debug(f"Perfil não encontrado para usuario_id={senha.usuario_id}")
 
-        senhas_chamadas = Ticket.objects.filter(status='Chamado')
-        for senha in senhas_chamadas:
-            if senha.expira_em and senha.expira_em < agora:
-                senha.status = 'Cancelado'
-                senha.fila.tickets_ativos -= 1
-                senha.fila.save()
-                senha.save()
-                ServicoFila.enviar_notificacao(
-                    None,
-                    f"Sua senha {senha.fila.prefixo}{senha.numero_ticket} foi cancelada porque você não validou a presença a tempo.",
-                    usuario_id=senha.usuario_id
+    @staticmethod
+    def expirar_chamadas_vencidas(agora=None, limite=None):
+        """Cancela as senhas chamadas cujo prazo de validação terminou.
+
+        Processa no máximo `limite` senhas por transação; devolve quantas expirou.
+        """
+        agora = agora or timezone.now()
+        limite = limite or ServicoFila.LIMITE_EXPIRACAO_LOTE
+        candidatas = AgendaExpiracao.vencidas(agora, limite)
+        if candidatas is None:
+            candidatas = [str(senha_id) for senha_id in Ticket.objects.filter(
+                status='Chamado', expira_em__lte=agora
+            ).values_list('id', flat=True)[:limite]]
+        if not candidatas:
+            return 0
+
+        with transaction.atomic():
+            vencidas = list(
+                Ticket.objects.select_for_update(skip_locked=True, of=('self',))
+                .filter(id__in=candidatas, status='Chamado', expira_em__lte=agora)
+                .values_list('id', 'fila_id', 'usuario_id', 'numero_ticket', 'fila__prefixo')
+            )
+            vencidas_ids = [senha_id for senha_id, _, _, _, _ in vencidas]
+            if vencidas_ids:
+                Ticket.objects.filter(id__in=vencidas_ids).update(status='Cancelado', cancelado_em=agora)
+
+                # tickets_ativos não muda: chamar_proximo(s) já tirou estas senhas da contagem
+                por_fila = {}
+                for _, fila_id, _, _, _ in vencidas:
+                    por_fila[fila_id] = por_fila.get(fila_id, 0) + 1
+                CacheTempoEspera.invalidar_apos_commit(por_fila)
+
+                ServicoFila.agendar_apos_commit(
+                    ServicoFila.enviar_notificacoes_lote,
+                    [
+                        (usuario_id, senha_id, f"Sua senha {prefixo}{numero} foi cancelada porque você não validou a presença a tempo.")
+                        for senha_id, _, usuario_id, numero, prefixo in vencidas
+                    ]
                 )
-                logger.info(f"Senha {senha.id} cancelada por falta de validação de presença")
+                for fila_id, ativos, atual in Fila.objects.filter(id__in=por_fila).values_list('id', 'tickets_ativos', 'ticket_atual'):
+                    ServicoFila.agendar_apos_commit(
+                        ServicoFila.difundir_atualizacao_fila,
+                        fila_id, ativos, atual, f"{por_fila[fila_id]} senha(s) chamada(s) expirada(s)"
+                    )
+
+            # Saem da agenda as expiradas e as que já não estão chamadas; as travadas ficam para a próxima passagem
+            ainda_chamadas = {str(senha_id) for senha_id in Ticket.objects.filter(
+                id__in=set(candidatas) - {str(senha_id) for senha_id in vencidas_ids}, status='Chamado'
+            ).values_list('id', flat=True)}
+            resolvidas = [senha_id for senha_id in candidatas if senha_id not in ainda_chamadas]
+            transaction.on_commit(lambda: AgendaExpiracao.remover(resolvidas))
+
+        if vencidas_ids:
+            logger.info(f"{len(vencidas_ids)} senhas chamadas expiradas por falta de validação de presença")
+        return len(vencidas_ids)
 
     @staticmethod
     @transaction.atomic
@@ -597,17 +1659,21 @@ class ServicoFila:
         senha_de.troca_disponivel, senha_para.troca_disponivel = False, False
         senha_de.save()
         senha_para.save()
+        IndiceFilaViva.adicionar_apos_commit([senha_de, senha_para])
+        CacheTempoEspera.invalidar_apos_commit({senha_de.fila_id, senha_para.fila_id})
 
         logger.info(f"Troca realizada entre {senha_de_id} e {senha_para_id}")
 
-        ServicoFila.enviar_notificacao(
+        ServicoFila.agendar_apos_commit(
+            ServicoFila.enviar_notificacao,
             None,
             f"Sua senha foi trocada! Nova senha: {senha_de.fila.prefixo}{senha_de.numero_ticket}",
             senha_de.id,
             via_websocket=True,
             usuario_id=senha_de.usuario_id
         )
-        ServicoFila.enviar_notificacao(
+        ServicoFila.agendar_apos_commit(
+            ServicoFila.enviar_notificacao,
             None,
             f"Sua senha foi trocada! Nova senha: {senha_para.fila.prefixo}{senha_para.numero_ticket}",
             senha_para.id,
@@ -644,15 +1710,18 @@ class ServicoFila:
         senha.status = 'Atendido'
         senha.atendido_em = timezone.now()
 
-        fila = senha.fila
+        fila = Fila.objects.select_for_update().get(id=senha.fila_id)
         ultima_senha = Ticket.objects.filter(fila_id=fila.id, status='Atendido', atendido_em__lt=senha.atendido_em)\
             .order_by('-atendido_em').first()
         if ultima_senha and ultima_senha.atendido_em:
             senha.tempo_servico = (senha.atendido_em - ultima_senha.atendido_em).total_seconds() / 60.0
             fila.ultimo_tempo_servico = senha.tempo_servico
+            fila.registrar_tempo_servico(senha.tempo_servico, senha.atendido_em.hour)
 
-        fila.save()
+        fila.save(update_fields=['ultimo_tempo_servico', *Fila.CAMPOS_ESTATISTICAS_SERVICO])
         senha.save()
+        transaction.on_commit(lambda: AgendaExpiracao.remover([senha.id]))
+        CacheTempoEspera.invalidar_apos_commit([fila.id])
         logger.info(f"Presença validada para senha {senha.id}")
         return senha
 
@@ -680,7 +1749,8 @@ class ServicoFila:
         senha.save()
         logger.info(f"Senha {senha_id} oferecida para troca com sucesso")
 
-        ServicoFila.enviar_notificacao(
+        ServicoFila.agendar_apos_commit(
+            ServicoFila.enviar_notificacao,
             None,
             f"Sua senha {senha.fila.prefixo}{senha.numero_ticket} foi oferecida para troca!",
             senha.id,
@@ -688,40 +1758,47 @@ class ServicoFila:
             usuario_id=usuario_id
         )
 
-        senhas_elegiveis = Ticket.objects.filter(
+        usuarios_elegiveis = list(Ticket.objects.filter(
             fila_id=senha.fila_id,
             usuario_id__ne=usuario_id,
             status='Pendente',
             troca_disponivel=False
-        ).order_by('emitido_em')[:5]
+        ).order_by('emitido_em').values_list('usuario_id', flat=True)[:5])
+        ServicoFila.agendar_apos_commit(
+            ServicoFila.difundir_troca_disponivel,
+            usuarios_elegiveis,
+            {
+                "senha_id": str(senha.id),
+                "fila_id": str(senha.fila_id),
+                "servico": senha.fila.servico,
+                "numero": f"{senha.fila.prefixo}{senha.numero_ticket}",
+                "posicao": ServicoFila.calcular_posicao(senha)
+            }
+        )
 
+        return senha
+
+    @staticmethod
+    def difundir_troca_disponivel(usuarios_ids, dados_senha):
         try:
             camada_canal = get_channel_layer()
-            for senha_elegivel in senhas_elegiveis:
+            for usuario_elegivel_id in usuarios_ids:
                 async_to_sync(camada_canal.group_send)(
-                    f"usuario_{senha_elegivel.usuario_id}",
+                    f"usuario_{usuario_elegivel_id}",
                     {
                         "type": "troca_disponivel",
-                        "mensagem": {
-                            "senha_id": str(senha.id),
-                            "fila_id": str(senha.fila_id),
-                            "servico": senha.fila.servico,
-                            "numero": f"{senha.fila.prefixo}{senha.numero_ticket}",
-                            "posicao": max(0, senha.numero_ticket - senha.fila.ticket_atual)
-                        }
+                        "mensagem": dados_senha
                     }
                 )
-                logger.debug(f"Evento troca_disponivel emitido para usuario_id {senha_elegivel.usuario_id}")
+                logger.debug(f"Evento troca_disponivel emitido para usuario_id {usuario_elegivel_id}")
         except Exception as e:
             logger.error(f"Erro ao emitir troca_disponivel: {e}")
 
-        return senha
-
     @staticmethod
     @transaction.atomic
     def cancelar_senha(senha_id, usuario_id):
         try:
-            senha = Ticket.objects.get(id=senha_id)
+            senha = Ticket.objects.select_for_update(of=('self',)).select_related('fila').get(id=senha_id)
         except ObjectDoesNotExist:
             logger.warning(f"Senha {senha_id} não encontrada")
             raise ValueError("Senha não encontrada")
@@ -734,38 +1811,108 @@ class ServicoFila:
             raise ValueError("Esta senha não pode ser cancelada no momento")
 
         senha.status = 'Cancelado'
-        senha.fila.tickets_ativos -= 1
-        senha.fila.save()
-        senha.save()
-
-        ServicoFila.enviar_notificacao(
+        senha.cancelado_em = timezone.now()
+        senha.save(update_fields=['status', 'cancelado_em'])
+        Fila.objects.filter(id=senha.fila_id).update(tickets_ativos=Greatest(F('tickets_ativos') - 1, 0))
+        senha.fila.refresh_from_db(fields=['tickets_ativos', 'ticket_atual'])
+        IndiceFilaViva.remover_apos_commit(senha.fila_id, [senha.id])
+        CacheTempoEspera.invalidar_apos_commit([senha.fila_id])
+
+        ServicoFila.agendar_apos_commit(
+            ServicoFila.enviar_notificacao,
             None,
             f"Sua senha {senha.fila.prefixo}{senha.numero_ticket} foi cancelada.",
             senha.id,
             via_websocket=True,
             usuario_id=usuario_id
         )
-
-        try:
-            camada_canal = get_channel_layer()
-            async_to_sync(camada_canal.group_send)(
-                f"fila_{senha.fila_id}",
-                {
-                    "type": "atualizacao_fila",
-                    "mensagem": {
-                        "fila_id": str(senha.fila_id),
-                        "tickets_ativos": senha.fila.tickets_ativos,
-                        "ticket_atual": senha.fila.ticket_atual,
-                        "mensagem": f"Senha {senha.fila.prefixo}{senha.numero_ticket} cancelada"
-                    }
-                }
-            )
-        except Exception as e:
-            logger.error(f"Erro ao enviar atualização de fila via WebSocket: {e}")
+        ServicoFila.agendar_apos_commit(
+            ServicoFila.difundir_atualizacao_fila,
+            senha.fila_id, senha.fila.tickets_ativos, senha.fila.ticket_atual,
+            f"Senha {senha.fila.prefixo}{senha.numero_ticket} cancelada"
+        )
 
         logger.info(f"Senha {senha.id} cancelada por usuario_id={usuario_id}")
         return senha
 
+    @staticmethod
+    def virar_dia_filas(agora=None):
+        """Fecha o dia das filas cuja meia-noite local já passou, uma instituição de cada vez.
+
+        Por instituição são três comandos em lote: resumo do dia anterior,
+        cancelamento das senhas que ficaram por atender e reposição dos contadores.
+        Filas já viradas hoje (ultima_virada) são ignoradas, por isso pode correr várias vezes.
+        """
+        agora = agora or timezone.now()
+        resultado = {'filas': 0, 'senhas_encerradas': 0, 'resumos': 0}
+
+        fusos = Filial.objects.values_list('fuso_horario', flat=True).distinct()
+        for fuso in fusos:
+            try:
+                tz = ZoneInfo(fuso)
+            except Exception:
+                logger.error(f"Fuso horário inválido '{fuso}' em filiais; virada ignorada para este fuso")
+                continue
+
+            hoje = agora.astimezone(tz).date()
+            inicio_hoje = datetime.combine(hoje, time.min, tzinfo=tz)
+            inicio_ontem = inicio_hoje - timedelta(days=1)
+
+            filas_por_virar = Fila.objects.filter(
+                departamento__filial__fuso_horario=fuso
+            ).filter(Q(ultima_virada__isnull=True) | Q(ultima_virada__lt=hoje))
+            instituicoes = filas_por_virar.values_list('departamento__filial__instituicao_id', flat=True).distinct()
+
+            for instituicao_id in instituicoes:
+                with transaction.atomic():
+                    filas_ids = list(
+                        filas_por_virar.filter(departamento__filial__instituicao_id=instituicao_id)
+                        .select_for_update(skip_locked=True, of=('self',)).values_list('id', flat=True)
+                    )
+                    if not filas_ids:
+                        continue
+
+                    totais = Ticket.objects.filter(
+                        fila_id__in=filas_ids, emitido_em__gte=inicio_ontem, emitido_em__lt=inicio_hoje
+                    ).values('fila_id').annotate(
+                        emitidas=Count('id'),
+                        atendidas=Count('id', filter=Q(status='Atendido')),
+                        canceladas=Count('id', filter=Q(status='Cancelado')),
+                        nao_atendidas=Count('id', filter=Q(status__in=['Pendente', 'Chamado'])),
+                        tempo_medio_servico=Avg('tempo_servico', filter=Q(status='Atendido', tempo_servico__gt=0))
+                    )
+                    resumos = ResumoDiarioFila.objects.bulk_create(
+                        [ResumoDiarioFila(data=inicio_ontem.date(), **total) for total in totais],
+                        ignore_conflicts=True
+                    )
+
+                    encerradas = Ticket.objects.filter(
+                        fila_id__in=filas_ids, status__in=['Pendente', 'Chamado'], emitido_em__lt=inicio_hoje
+                    ).update(status='Cancelado', cancelado_em=agora)
+
+                    # Senhas já emitidas depois da meia-noite local continuam a contar
+                    pendentes_hoje = Ticket.objects.filter(
+                        fila_id=OuterRef('id'), status='Pendente'
+                    ).values('fila_id').annotate(total=Count('id')).values('total')
+                    Fila.objects.filter(id__in=filas_ids).update(
+                        tickets_ativos=Coalesce(Subquery(pendentes_hoje), 0),
+                        ticket_atual=0,
+                        ultimo_balcao=0,
+                        ultima_virada=hoje
+                    )
+                    transaction.on_commit(lambda ids=filas_ids: IndiceFilaViva.invalidar(ids))
+                    CacheTempoEspera.invalidar_apos_commit(filas_ids)
+
+                resultado['filas'] += len(filas_ids)
+                resultado['senhas_encerradas'] += encerradas
+                resultado['resumos'] += len(resumos)
+                logger.info(
+                    f"Virada do dia {hoje} para instituicao_id={instituicao_id} ({fuso}): "
+                    f"{len(filas_ids)} filas, {encerradas} senhas encerradas"
+                )
+
+        return resultado
+
     @staticmethod
     def esta_fila_aberta(fila, agora=None):
         if not agora:
@@ -854,23 +2001,28 @@ class ServicoFila:
         total = consulta_base.count()
         filas = consulta_base.order_by('servico')[(pagina - 1) * por_pagina:pagina * por_pagina]
 
+        candidatas = []
         for fila in filas:
             filial = fila.departamento.filial
-            instituicao = filial.instituicao
-
             distancia = None
             if lat_usuario and lon_usuario and filial.latitude and filial.longitude:
                 distancia = ServicoFila.calcular_distancia(lat_usuario, lon_usuario, filial)
                 if distancia and distancia > max_distancia_km:
                     continue
+            candidatas.append((fila, distancia))
+
+        # Uma só chamada ao modelo de recomendação para todas as filas da página
+        pontuacoes_qualidade = preditor_recomendacao_servico.prever_lote([fila for fila, _ in candidatas])
+
+        for (fila, distancia), pontuacao_qualidade in zip(candidatas, pontuacoes_qualidade):
+            filial = fila.departamento.filial
+            instituicao = filial.instituicao
 
             tempo_espera = ServicoFila.calcular_tempo_espera(fila.id, fila.tickets_ativos + 1, 0)
 
             rotulo_velocidade = "Desconhecida"
-            senhas = Ticket.objects.filter(fila_id=fila.id, status='Atendido')
-            tempos_servico = [s.tempo_servico for s in senhas if s.tempo_servico is not None and s.tempo_servico > 0]
-            if tempos_servico:
-                tempo_medio_servico = np.mean(tempos_servico)
+            if fila.atendimentos_contagem:
+                tempo_medio_servico = fila.tempo_servico_media
                 if tempo_medio_servico <= 5:
                     rotulo_velocidade = "Rápida"
                 elif tempo_medio_servico <= 15:
@@ -879,7 +2031,6 @@ class ServicoFila:
                     rotulo_velocidade = "Lenta"
 
             pontuacao = 0.0
-            pontuacao_qualidade = preditor_recomendacao_servico.prever(fila)
             if termo_busca and termos_busca:
                 pontuacao += 0.4  # Simplificação, substituir por ranking real se necessário
             if distancia:
@@ -1,6 +1,5 @@
-from celery import shared_task
-from fila_online.models import Fila
-from fila_online.preditores_ml import preditor_tempo_espera, preditor_recomendacao_servico
+from celery import shared_task, chord
+from fila_online.ml_models import preditor_tempo_espera, preditor_recomendacao_servico
 import logging
 
 logger = logging.getLogger(__name__)
@@ -9,12 +8,89 @@ logger = logging.getLogger(__name__)
 def treinar_modelos_periodicamente():
     logger.info("Iniciando treinamento periódico dos modelos de ML.")
     try:
-        filas = Fila.objects.all()
-        for fila in filas:
-            logger.info(f"Treinando PreditorTempoEspera para fila_id={fila.id}")
-            preditor_tempo_espera.treinar(str(fila.id))
+        # Uma tarefa por fila/setor sobre o histórico lido aqui uma só vez; os artefactos
+        # voltam pelo Redis e a publicação das novas versões acontece no fim, de uma vez
+        execucao, alvos = preditor_tempo_espera.planear_treino('celery')
+        if alvos:
+            tarefas = preditor_tempo_espera.preparar_treino_distribuido(execucao, alvos)
+            chord(
+                treinar_alvo_modelo.s(str(execucao.id), tipo, nome, filas_ids) for tipo, nome, filas_ids in tarefas
+            )(publicar_modelos_treinados.s(str(execucao.id)))
+            logger.info(f"{len(alvos)} treinos de PreditorTempoEspera distribuídos pelos workers ({execucao.filas_ignoradas} filas sem dados novos)")
+        else:
+            preditor_tempo_espera.publicar_versoes([], execucao.id)
+            logger.info("Nenhuma fila com dados novos: PreditorTempoEspera não foi treinado")
         logger.info("Treinando PreditorRecomendacaoServico")
         preditor_recomendacao_servico.treinar()
         logger.info("Treinamento periódico concluído com sucesso.")
     except Exception as e:
-        logger.error(f"Erro ao treinar modelos de ML: {str(e)}")
\ No newline at end of file
+        logger.error(f"Erro ao treinar modelos de ML: {str(e)}")
+
+@shared_task
+def treinar_alvo_modelo(execucao_id, tipo, nome, filas_ids):
+    try:
+        resultado = preditor_tempo_espera.treinar_alvo_distribuido(execucao_id, (tipo, nome), filas_ids)
+    except Exception as e:
+        logger.error(f"Erro ao treinar modelo {tipo} {nome}: {str(e)}")
+        return None
+    return list(resultado) if resultado else None
+
+@shared_task
+def publicar_modelos_treinados(resultados, execucao_id):
+    versoes = [tuple(resultado) for resultado in resultados if resultado]
+    publicadas = preditor_tempo_espera.publicar_treino_distribuido(execucao_id, versoes)
+    logger.info(f"Treinamento distribuído concluído: {len(publicadas)} de {len(resultados)} modelos publicados.")
+    return len(publicadas)
+
+@shared_task
+def virar_dia_filas():
+    from fila_online.services import ServicoFila
+    logger.info("Iniciando virada diária das filas.")
+    try:
+        resultado = ServicoFila.virar_dia_filas()
+        logger.info(f"Virada diária concluída: {resultado}")
+        return resultado
+    except Exception as e:
+        logger.error(f"Erro na virada diária das filas: {str(e)}")
+        raise
+
+@shared_task
+def expirar_chamadas_vencidas():
+    from fila_online.services import ServicoFila
+    total = 0
+    try:
+        while True:
+            expiradas = ServicoFila.expirar_chamadas_vencidas()
+            total += expiradas
+            if expiradas < ServicoFila.LIMITE_EXPIRACAO_LOTE:
+                break
+        if total:
+            logger.info(f"{total} senhas chamadas expiradas.")
+        return total
+    except Exception as e:
+        logger.error(f"Erro ao expirar senhas chamadas: {str(e)}")
+        raise
+
+@shared_task
+def atualizar_tempos_espera_medios():
+    from fila_online.services import ServicoFila
+    try:
+        atualizadas = ServicoFila.atualizar_tempos_espera_medios()
+        if atualizadas:
+            logger.info(f"Tempo de espera médio atualizado em {atualizadas} filas.")
+        return atualizadas
+    except Exception as e:
+        logger.error(f"Erro ao atualizar tempos de espera médios: {str(e)}")
+        raise
+
+@shared_task
+def reconciliar_contadores_senhas():
+    from fila_online.services import AlocadorSenhas
+    try:
+        reconciliadas = AlocadorSenhas.reconciliar_atrasados()
+        if reconciliadas:
+            logger.info(f"Contadores de senhas reconciliados em {reconciliadas} filas.")
+        return reconciliadas
+    except Exception as e:
+        logger.error(f"Erro ao reconciliar contadores de senhas: {str(e)}")
+        raise
@@ -1,3 +1,623 @@
-from django.test import TestCase
+import datetime
+import importlib
+import json
+import os
+import tempfile
+import threading
+import unittest
+from datetime import timedelta
+from unittest import mock
+from zoneinfo import ZoneInfo
+import redis
+from django.contrib.auth.models import User
+from django.apps import apps
+from django.test import TestCase, TransactionTestCase, RequestFactory, override_settings
+from django.db import connection, connections, transaction
+from django.test.utils import CaptureQueriesContext
+from rest_framework.permissions import AllowAny
+from rest_framework.response import Response
+from rest_framework.views import APIView
+from django.utils import timezone
+from sistema.models import Instituicao, Filial
+from fila_online.models import Departamento, Fila, Ticket, ResumoDiarioFila, MotorTempoEspera, ReservaBlocoTotem, Totem, MarcaTreinoFila
+from fila_online.ml_models import EstimadorErlangC, preditor_tempo_espera, RegistroModelos, DistribuidorModelos
+from fila_online.services import ServicoFila, AlocadorSenhas, IndiceFilaViva, redis_client
+from fila_online.idempotencia import IdempotenciaMixin
 
-# Create your tests here.
+
+class VirarDiaFilasTests(TestCase):
+    def setUp(self):
+        instituicao = Instituicao.objects.create(nome='Banco X')
+        filial = Filial.objects.create(instituicao=instituicao, nome='Centro', fuso_horario='Africa/Luanda')
+        departamento = Departamento.objects.create(filial=filial, nome='Caixa', setor='Bancário')
+        self.fila = Fila.objects.create(
+            departamento=departamento, servico='Depósito', prefixo='A',
+            hora_abertura=datetime.time(8, 0), limite_diario=100,
+            tickets_ativos=1, ticket_atual=7
+        )
+        self.agora = timezone.now()
+        self.senha_ontem = Ticket.objects.create(
+            fila=self.fila, numero_ticket=8, codigo_qr='QR-ONTEM', status='Pendente',
+            emitido_em=self.agora - timedelta(days=1, hours=1), expira_em=self.agora
+        )
+
+    def test_encerra_senhas_do_dia_anterior_e_repoe_contadores(self):
+        resultado = ServicoFila.virar_dia_filas(agora=self.agora)
+
+        self.assertEqual(resultado['filas'], 1)
+        self.assertEqual(resultado['senhas_encerradas'], 1)
+        self.senha_ontem.refresh_from_db()
+        self.assertEqual(self.senha_ontem.status, 'Cancelado')
+        self.fila.refresh_from_db()
+        self.assertEqual(self.fila.tickets_ativos, 0)
+        self.assertEqual(self.fila.ticket_atual, 0)
+        self.assertEqual(self.fila.ultima_virada, self.agora.astimezone(ZoneInfo('Africa/Luanda')).date())
+        self.assertTrue(ResumoDiarioFila.objects.filter(fila=self.fila).exists())
+
+    def test_pode_correr_varias_vezes_no_mesmo_dia(self):
+        ServicoFila.virar_dia_filas(agora=self.agora)
+        resultado = ServicoFila.virar_dia_filas(agora=self.agora)
+        self.assertEqual(resultado['filas'], 0)
+
+
+class ExpirarChamadasVencidasTests(TestCase):
+    def setUp(self):
+        instituicao = Instituicao.objects.create(nome='Banco X')
+        filial = Filial.objects.create(instituicao=instituicao, nome='Centro')
+        departamento = Departamento.objects.create(filial=filial, nome='Caixa', setor='Bancário')
+        # Duas senhas pendentes; as duas chamadas já saíram de tickets_ativos ao serem chamadas
+        self.fila = Fila.objects.create(
+            departamento=departamento, servico='Depósito', prefixo='A',
+            hora_abertura=datetime.time(8, 0), limite_diario=100, tickets_ativos=2, ticket_atual=2
+        )
+        agora = timezone.now()
+        for numero, status, expira_em in [
+            (1, 'Chamado', agora - timedelta(minutes=1)),
+            (2, 'Chamado', agora - timedelta(minutes=1)),
+            (3, 'Pendente', agora + timedelta(hours=4)),
+            (4, 'Pendente', agora + timedelta(hours=4)),
+        ]:
+            Ticket.objects.create(
+                fila=self.fila, numero_ticket=numero, codigo_qr=f'QR-{numero}',
+                status=status, expira_em=expira_em
+            )
+
+    def test_expirar_nao_desconta_de_novo_as_senhas_chamadas(self):
+        self.assertEqual(ServicoFila.expirar_chamadas_vencidas(), 2)
+        self.fila.refresh_from_db()
+        self.assertEqual(self.fila.tickets_ativos, 2)
+        self.assertEqual(Ticket.objects.filter(fila=self.fila, status='Cancelado').count(), 2)
+
+
+class CancelarSenhaTests(TestCase):
+    def setUp(self):
+        instituicao = Instituicao.objects.create(nome='Banco X')
+        filial = Filial.objects.create(instituicao=instituicao, nome='Centro')
+        departamento = Departamento.objects.create(filial=filial, nome='Caixa', setor='Bancário')
+        self.fila = Fila.objects.create(
+            departamento=departamento, servico='Depósito', prefixo='A',
+            hora_abertura=datetime.time(8, 0), limite_diario=100, tickets_ativos=1, ticket_atual=0
+        )
+        self.usuario = User.objects.create(username='cliente')
+        self.senha = Ticket.objects.create(
+            fila=self.fila, numero_ticket=1, codigo_qr='QR-1', usuario=self.usuario,
+            status='Pendente', expira_em=timezone.now() + timedelta(hours=4)
+        )
+
+    def test_cancelar_nao_sobrescreve_estatisticas_da_fila(self):
+        # Atendimento registrado por outro pedido depois de a senha ter sido lida
+        Fila.objects.filter(id=self.fila.id).update(atendimentos_contagem=5, tempo_servico_media=4.0)
+
+        ServicoFila.cancelar_senha(self.senha.id, self.usuario.id)
+
+        self.fila.refresh_from_db()
+        self.assertEqual(self.fila.tickets_ativos, 0)
+        self.assertEqual(self.fila.atendimentos_contagem, 5)
+        self.assertEqual(self.fila.tempo_servico_media, 4.0)
+        self.senha.refresh_from_db()
+        self.assertEqual(self.senha.status, 'Cancelado')
+
+
+class PreencherEstatisticasServicoTests(TestCase):
+    def test_recalcula_as_estatisticas_como_registrar_tempo_servico(self):
+        instituicao = Instituicao.objects.create(nome='Banco X')
+        filial = Filial.objects.create(instituicao=instituicao, nome='Centro')
+        departamento = Departamento.objects.create(filial=filial, nome='Caixa', setor='Bancário')
+        fila = Fila.objects.create(
+            departamento=departamento, servico='Depósito', prefixo='A',
+            hora_abertura=datetime.time(8, 0), limite_diario=100
+        )
+        inicio = timezone.now().replace(hour=9, minute=0, second=0, microsecond=0)
+        tempos = [4.0, 6.0, 5.0, 11.0]
+        for numero, minutos in enumerate(tempos, start=1):
+            Ticket.objects.create(
+                fila=fila, numero_ticket=numero, codigo_qr=f"A{numero}", status='Atendido',
+                emitido_em=inicio, atendido_em=inicio + timedelta(minutes=30 * numero), tempo_servico=minutos
+            )
+        Ticket.objects.create(fila=fila, numero_ticket=5, codigo_qr='A5', status='Cancelado', emitido_em=inicio, tempo_servico=50)
+
+        migracao = importlib.import_module('fila_online.migrations.0012_preencher_estatisticas_servico')
+        migracao.preencher_estatisticas_servico(apps, None)
+
+        esperado = Fila(departamento=departamento)
+        for numero, minutos in enumerate(tempos, start=1):
+            esperado.registrar_tempo_servico(minutos, (inicio + timedelta(minutes=30 * numero)).hour)
+        fila.refresh_from_db()
+        self.assertEqual(fila.atendimentos_contagem, 4)
+        self.assertAlmostEqual(fila.tempo_servico_media, esperado.tempo_servico_media)
+        self.assertAlmostEqual(fila.tempo_servico_m2, esperado.tempo_servico_m2)
+        self.assertAlmostEqual(fila.tempo_servico_ewma, esperado.tempo_servico_ewma)
+        self.assertEqual(fila.tempo_servico_horas, esperado.tempo_servico_horas)
+
+
+class SenhasFisicasTests(TestCase):
+    def setUp(self):
+        instituicao = Instituicao.objects.create(nome='Banco X')
+        filial = Filial.objects.create(instituicao=instituicao, nome='Centro')
+        departamento = Departamento.objects.create(filial=filial, nome='Caixa', setor='Bancário')
+        self.fila = Fila.objects.create(
+            departamento=departamento, servico='Depósito', prefixo='A',
+            hora_abertura=datetime.time(8, 0), limite_diario=100
+        )
+        patcher = mock.patch.object(ServicoFila, 'esta_fila_aberta', return_value=True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_lote_devolve_ids_e_codigos_qr_das_senhas_presenciais(self):
+        resultado = ServicoFila.gerar_senhas_fisicas_em_lote(self.fila.id, 3)
+        senhas = resultado['senhas']
+        self.assertEqual([senha['senha'] for senha in senhas], ['A1', 'A2', 'A3'])
+        for senha in senhas:
+            ticket = Ticket.objects.get(id=senha['id'])
+            self.assertEqual(senha['codigo_qr'], ticket.codigo_qr)
+            self.assertIn(ticket.codigo_qr, senha['comprovante'])
+            self.assertEqual(senha['usuario_id'], Ticket.USUARIO_PRESENCIAL)
+            self.assertTrue(ticket.e_presencial)
+            self.assertTrue(ticket.e_fisico)
+
+    def test_senha_do_totem_fica_sem_usuario(self):
+        with mock.patch.object(ServicoFila, 'gerar_pdf_senha') as gerar_pdf:
+            gerar_pdf.return_value.getvalue.return_value = b'%PDF'
+            resultado = ServicoFila.gerar_senha_fisica_para_totem(self.fila.id, '10.0.0.1')
+        self.assertEqual(resultado['senha']['usuario_id'], Ticket.USUARIO_PRESENCIAL)
+        self.assertIsNone(Ticket.objects.get(id=resultado['senha']['id']).usuario_id)
+
+
+class PosicoesSenhasTests(TestCase):
+    def setUp(self):
+        instituicao = Instituicao.objects.create(nome='Banco X')
+        filial = Filial.objects.create(instituicao=instituicao, nome='Centro')
+        departamento = Departamento.objects.create(filial=filial, nome='Caixa', setor='Bancário')
+        self.fila = Fila.objects.create(
+            departamento=departamento, servico='Depósito', prefixo='A',
+            hora_abertura=datetime.time(8, 0), limite_diario=100, ticket_atual=2
+        )
+        self.senhas = [
+            Ticket.objects.create(fila=self.fila, numero_ticket=numero, codigo_qr=f"A{numero}", prioridade=prioridade, status=estado)
+            for numero, prioridade, estado in [(3, 0, 'Pendente'), (4, 0, 'Pendente'), (5, 1, 'Pendente'), (6, 0, 'Atendido')]
+        ]
+        self.addCleanup(redis_client.delete, IndiceFilaViva._chave(self.fila.id), IndiceFilaViva._chave_pronto(self.fila.id))
+
+    def test_posicoes_em_lote_iguais_as_de_calcular_posicao_sem_zrank_por_senha(self):
+        esperadas = {senha.id: ServicoFila.calcular_posicao(senha) for senha in self.senhas}
+        with mock.patch.object(IndiceFilaViva, 'posicao') as posicao, \
+                mock.patch.object(IndiceFilaViva, 'contar_a_frente_lote', wraps=IndiceFilaViva.contar_a_frente_lote) as lote:
+            posicoes = ServicoFila.posicoes_senhas(self.senhas)
+        self.assertEqual(posicoes, esperadas)
+        self.assertEqual([posicoes[senha.id] for senha in self.senhas], [2, 3, 1, 0])
+        posicao.assert_not_called()
+        lote.assert_called_once()
+
+    def test_sem_indice_usa_o_numero_da_senha(self):
+        with mock.patch.object(IndiceFilaViva, 'contar_a_frente_lote', return_value=None):
+            posicoes = ServicoFila.posicoes_senhas(self.senhas)
+        self.assertEqual([posicoes[senha.id] for senha in self.senhas], [1, 2, 3, 0])
+
+
+def _criar_fila_chamadas(num_balcoes=2):
+    instituicao = Instituicao.objects.create(nome='Banco X')
+    filial = Filial.objects.create(instituicao=instituicao, nome='Centro')
+    departamento = Departamento.objects.create(filial=filial, nome='Caixa', setor='Bancário')
+    fila = Fila.objects.create(
+        departamento=departamento, servico='Depósito', prefixo='A',
+        hora_abertura=datetime.time(8, 0), limite_diario=100, num_balcoes=num_balcoes, tickets_ativos=4
+    )
+    senhas = [
+        Ticket.objects.create(fila=fila, numero_ticket=numero, codigo_qr=f"A{numero}", prioridade=prioridade)
+        for numero, prioridade in [(1, 0), (2, 0), (3, 1), (4, 0)]
+    ]
+    return fila, senhas
+
+
+class ChamarProximoTests(TestCase):
+    def setUp(self):
+        self.fila, self.senhas = _criar_fila_chamadas()
+        self.chave_indice = IndiceFilaViva._chave(self.fila.id)
+        self.addCleanup(redis_client.delete, self.chave_indice, IndiceFilaViva._chave_pronto(self.fila.id))
+        patcher = mock.patch.object(ServicoFila, 'esta_fila_aberta', return_value=True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_trava_por_prioridade_e_depois_por_numero(self):
+        travadas = ServicoFila._travar_proximas_senhas(self.fila, 3)
+        self.assertEqual([senha.numero_ticket for senha in travadas], [3, 1, 2])
+
+    def test_sem_indice_trava_na_mesma_ordem(self):
+        with mock.patch.object(IndiceFilaViva, 'consultar_proximos', return_value=None):
+            travadas = ServicoFila._travar_proximas_senhas(self.fila, 3)
+        self.assertEqual([senha.numero_ticket for senha in travadas], [3, 1, 2])
+
+    def test_senha_chamada_sai_do_indice_so_depois_do_commit(self):
+        with self.captureOnCommitCallbacks() as callbacks:
+            senha = ServicoFila.chamar_proximo(self.fila.servico)
+            self.assertEqual(senha.numero_ticket, 3)
+            self.assertIsNotNone(redis_client.zscore(self.chave_indice, str(senha.id)))
+        for callback in callbacks:
+            callback()
+        self.assertIsNone(redis_client.zscore(self.chave_indice, str(senha.id)))
+
+    def test_rollback_deixa_a_senha_no_indice(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            with self.assertRaises(RuntimeError), transaction.atomic():
+                senha = ServicoFila.chamar_proximo(self.fila.servico)
+                raise RuntimeError('falha depois da chamada')
+        self.assertIsNotNone(redis_client.zscore(self.chave_indice, str(senha.id)))
+        self.assertEqual(Ticket.objects.get(id=senha.id).status, 'Pendente')
+
+
+class ChamarProximosTests(TestCase):
+    def setUp(self):
+        self.fila, self.senhas = _criar_fila_chamadas(num_balcoes=3)
+        self.chave_indice = IndiceFilaViva._chave(self.fila.id)
+        self.addCleanup(redis_client.delete, self.chave_indice, IndiceFilaViva._chave_pronto(self.fila.id))
+        patcher = mock.patch.object(ServicoFila, 'esta_fila_aberta', return_value=True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_preenche_os_balcoes_na_ordem_de_atendimento(self):
+        with self.captureOnCommitCallbacks() as callbacks:
+            chamadas = ServicoFila.chamar_proximos(self.fila.id, [2, 3])
+        self.assertEqual([(senha.numero_ticket, senha.balcao) for senha in chamadas], [(3, 2), (1, 3)])
+        self.assertEqual(
+            sorted(Ticket.objects.filter(status='Chamado').values_list('numero_ticket', flat=True)), [1, 3]
+        )
+        self.fila.refresh_from_db()
+        self.assertEqual((self.fila.ticket_atual, self.fila.tickets_ativos, self.fila.ultimo_balcao), (1, 2, 3))
+        for callback in callbacks:
+            callback()
+        self.assertEqual(redis_client.zcard(self.chave_indice), 2)
+
+    def test_menos_senhas_do_que_balcoes(self):
+        Ticket.objects.filter(id__in=[self.senhas[0].id, self.senhas[3].id]).update(status='Cancelado')
+        chamadas = ServicoFila.chamar_proximos(self.fila.id)
+        self.assertEqual([(senha.numero_ticket, senha.balcao) for senha in chamadas], [(3, 1), (2, 2)])
+        with self.assertRaisesMessage(ValueError, 'Nenhuma senha pendente'):
+            ServicoFila.chamar_proximos(self.fila.id)
+
+    def test_balcoes_invalidos(self):
+        for balcoes in ([1, 1], [4]):
+            with self.assertRaisesMessage(ValueError, 'Balcões inválidos'):
+                ServicoFila.chamar_proximos(self.fila.id, balcoes)
+
+
+@unittest.skipUnless(connection.features.has_select_for_update_skip_locked, 'Requer SELECT ... FOR UPDATE SKIP LOCKED')
+class ChamarProximoConcorrenteTests(TransactionTestCase):
+    def setUp(self):
+        self.fila, self.senhas = _criar_fila_chamadas()
+        self.addCleanup(redis_client.delete, IndiceFilaViva._chave(self.fila.id), IndiceFilaViva._chave_pronto(self.fila.id))
+        for alvo in ['esta_fila_aberta', 'enviar_notificacao', 'difundir_atualizacao_fila']:
+            patcher = mock.patch.object(ServicoFila, alvo, return_value=True)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_chamadas_simultaneas_recebem_senhas_distintas(self):
+        travada, libertar = threading.Event(), threading.Event()
+        primeira = []
+
+        def outro_balcao():
+            try:
+                with transaction.atomic():
+                    primeira.extend(ServicoFila._travar_proximas_senhas(self.fila))
+                    travada.set()
+                    libertar.wait(10)
+            finally:
+                connections.close_all()
+
+        thread = threading.Thread(target=outro_balcao)
+        thread.start()
+        try:
+            self.assertTrue(travada.wait(10))
+            segunda = ServicoFila.chamar_proximo(self.fila.servico)
+        finally:
+            libertar.set()
+            thread.join()
+
+        self.assertEqual(primeira[0].numero_ticket, 3)
+        self.assertEqual(segunda.numero_ticket, 1)
+        self.assertEqual(Ticket.objects.get(id=segunda.id).status, 'Chamado')
+
+
+class AlocadorSenhasTests(TestCase):
+    def setUp(self):
+        instituicao = Instituicao.objects.create(nome='Banco X')
+        filial = Filial.objects.create(instituicao=instituicao, nome='Centro', fuso_horario='America/Sao_Paulo')
+        departamento = Departamento.objects.create(filial=filial, nome='Caixa', setor='Bancário')
+        self.fila = Fila.objects.create(
+            departamento=departamento, servico='Depósito', prefixo='A',
+            hora_abertura=datetime.time(8, 0), limite_diario=100
+        )
+        # 01:00 em São Paulo: já é dia 11 na filial, e também em Luanda (TIME_ZONE)
+        self.agora = datetime.datetime(2026, 3, 11, 4, 0, tzinfo=datetime.timezone.utc)
+        for numero, emitido_em in [
+            (40, datetime.datetime(2026, 3, 11, 1, 0, tzinfo=datetime.timezone.utc)),  # 22:00 do dia 10 na filial
+            (1, datetime.datetime(2026, 3, 11, 3, 30, tzinfo=datetime.timezone.utc)),
+        ]:
+            Ticket.objects.create(
+                fila=self.fila, numero_ticket=numero, codigo_qr=f'QR-{numero}',
+                status='Pendente', emitido_em=emitido_em, expira_em=emitido_em + timedelta(hours=4)
+            )
+
+    def test_sem_redis_numera_pelo_dia_local_da_filial(self):
+        with mock.patch('django.utils.timezone.now', return_value=self.agora), \
+                mock.patch.object(redis_client, 'exists', side_effect=redis.ConnectionError('indisponível')):
+            ultimo = AlocadorSenhas.alocar(self.fila)
+
+        self.assertEqual(ultimo, 2)
+        # Marca partilhada por todos os processos: o contador do Redis tem de ser reposto antes do próximo INCRBY
+        self.fila.refresh_from_db()
+        self.assertEqual(self.fila.alocacoes_pelo_banco, 1)
+
+    def test_sem_redis_salta_os_blocos_reservados_a_totens(self):
+        # Bloco ainda por sincronizar: o totem pode já ter impresso estes números
+        ReservaBlocoTotem.objects.create(
+            fila=self.fila, totem_id='T1', numero_inicial=2, numero_final=51,
+            reservado_em=self.agora - timedelta(minutes=20), expira_em=self.agora + timedelta(hours=8)
+        )
+        with mock.patch('django.utils.timezone.now', return_value=self.agora), \
+                mock.patch.object(redis_client, 'exists', side_effect=redis.ConnectionError('indisponível')):
+            ultimo = AlocadorSenhas.alocar(self.fila)
+
+        self.assertEqual(ultimo, 52)
+
+    def test_so_totens_registrados_na_filial_reservam_blocos(self):
+        with mock.patch.object(ServicoFila, 'esta_fila_aberta', return_value=True), \
+                mock.patch.object(redis_client, 'exists', side_effect=redis.ConnectionError('indisponível')):
+            with self.assertRaisesMessage(ValueError, 'Totem não registrado'):
+                ServicoFila.reservar_bloco_totem(self.fila.id, 'T-DESCONHECIDO', 10)
+
+            outra_filial = Filial.objects.create(instituicao=self.fila.departamento.filial.instituicao, nome='Norte')
+            Totem.objects.create(codigo='T-NORTE', filial=outra_filial)
+            with self.assertRaisesMessage(ValueError, 'Totem não registrado'):
+                ServicoFila.reservar_bloco_totem(self.fila.id, 'T-NORTE', 10)
+
+            Totem.objects.create(codigo='T-CENTRO', filial=self.fila.departamento.filial)
+            reserva = ServicoFila.reservar_bloco_totem(self.fila.id, 'T-CENTRO', 10)
+        self.assertEqual(reserva['numero_final'] - reserva['numero_inicial'], 9)
+
+
+class EstimadorErlangCTests(TestCase):
+    def test_primeiras_posicoes_partilham_os_balcoes(self):
+        # Sem chegadas nenhum balcão está ocupado: as três primeiras senhas são atendidas já
+        tempos = EstimadorErlangC.prever_lote([1, 2, 3, 4, 7], taxa_chegada=0, tempo_servico=2, balcoes_abertos=3)
+        self.assertEqual(list(tempos), [0, 0, 0, 6, 12])
+
+    def test_primeira_posicao_espera_o_wq_do_mmc(self):
+        # c = 2, S = 4 min por balcão (mu = 0,25), lambda = 0,25: a = 1, C(2, 1) = 1/3, Wq = C / (c*mu - lambda) = 4/3
+        tempos = EstimadorErlangC.prever_lote([1, 2, 3], taxa_chegada=0.25, tempo_servico=2, balcoes_abertos=2)
+        self.assertEqual(list(tempos), [1.3, 1.3, 5.3])
+
+    def test_sobrecarga_conta_um_atendimento_por_senha(self):
+        tempos = EstimadorErlangC.prever_lote([1, 5], taxa_chegada=1, tempo_servico=2, balcoes_abertos=3)
+        self.assertEqual(list(tempos), [2, 10])
+
+
+class TemposEsperaSemModeloTests(TestCase):
+    def setUp(self):
+        instituicao = Instituicao.objects.create(nome='Banco X')
+        filial = Filial.objects.create(instituicao=instituicao, nome='Centro')
+        departamento = Departamento.objects.create(filial=filial, nome='Caixa', setor='Bancário')
+        self.fila = Fila.objects.create(
+            departamento=departamento, servico='Depósito', prefixo='A',
+            hora_abertura=datetime.time(8, 0), limite_diario=100, num_balcoes=1,
+            tickets_ativos=3, motor_tempo_espera=MotorTempoEspera.MODELO, tempo_espera_medio=4.0
+        )
+        estado = {
+            'aberta': True, 'ticket_atual': 0, 'tickets_ativos': 3,
+            'tempo_espera_medio': 4.0, 'taxa_chegada': 0.0
+        }
+        for alvo, kwargs in [
+            ('fila_online.services.CacheTempoEspera.ler', {'return_value': (estado, None, {})}),
+            ('fila_online.services.CacheTempoEspera.guardar_estimativas', {}),
+            ('fila_online.services.IndiceFilaViva.contar_a_frente_lote', {'return_value': None}),
+        ]:
+            patcher = mock.patch(alvo, **kwargs)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_motor_automatico_sem_modelo_treinado_usa_erlang_c(self):
+        Fila.objects.filter(id=self.fila.id).update(motor_tempo_espera=MotorTempoEspera.AUTOMATICO)
+        with mock.patch.object(preditor_tempo_espera, 'modelo_para', return_value=None):
+            tempos = ServicoFila.calcular_tempos_espera_lote(self.fila.id, [1, 2, 3])
+        self.assertEqual(tempos, [0.0, 4.0, 8.0])
+
+    def test_motor_modelo_sem_modelo_treinado_nao_estima(self):
+        with mock.patch.object(preditor_tempo_espera, 'modelo_para', return_value=None), \
+                mock.patch('fila_online.services.EstimadorErlangC.prever_lote') as erlang:
+            tempos = ServicoFila.calcular_tempos_espera_lote(self.fila.id, [1, 2, 3])
+        self.assertEqual(tempos, ["N/A", "N/A", "N/A"])
+        erlang.assert_not_called()
+
+
+class _RedisEmMemoria:
+    """O suficiente de um cliente Redis (hashes e pipeline) para a área de treino do DistribuidorModelos."""
+    def __init__(self):
+        self.hashes = {}
+
+    def pipeline(self):
+        return self
+
+    def execute(self):
+        return []
+
+    def expire(self, chave, segundos):
+        pass
+
+    def hset(self, chave, campo=None, valor=None, mapping=None):
+        # Como o Redis sem decode_responses, os valores voltam sempre em bytes
+        for campo, valor in (mapping or {campo: valor}).items():
+            self.hashes.setdefault(chave, {})[campo] = valor.encode() if isinstance(valor, str) else valor
+
+    def hget(self, chave, campo):
+        return self.hashes.get(chave, {}).get(campo)
+
+    def hmget(self, chave, campos):
+        return [self.hget(chave, campo) for campo in campos]
+
+    def delete(self, chave):
+        self.hashes.pop(chave, None)
+
+    def sadd(self, chave, membro):
+        pass
+
+    def publish(self, canal, mensagem):
+        pass
+
+
+@override_settings(MODELOS_ML_DISTRIBUIR=False)
+class TreinoDistribuidoTests(TestCase):
+    def setUp(self):
+        instituicao = Instituicao.objects.create(nome='Banco X')
+        filial = Filial.objects.create(instituicao=instituicao, nome='Centro')
+        departamento = Departamento.objects.create(filial=filial, nome='Caixa', setor='Bancário')
+        self.fila = Fila.objects.create(
+            departamento=departamento, servico='Depósito', prefixo='A',
+            hora_abertura=datetime.time(8, 0), limite_diario=100, num_balcoes=1
+        )
+        agora = timezone.now()
+        Ticket.objects.bulk_create([
+            Ticket(
+                fila=self.fila, numero_ticket=numero, codigo_qr=f"A{numero}", status='Atendido',
+                emitido_em=agora - timedelta(hours=2), atendido_em=agora - timedelta(hours=1), tempo_servico=3 + numero % 5
+            )
+            for numero in range(1, 31)
+        ])
+        self.redis = _RedisEmMemoria()
+        patcher = mock.patch.object(preditor_tempo_espera.distribuidor, '_redis', return_value=self.redis)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _no_disco(self, diretorio):
+        return mock.patch.object(preditor_tempo_espera.registro, 'diretorio', diretorio)
+
+    def test_workers_treinam_sem_consultar_o_banco_e_quem_publica_le_do_redis(self):
+        with tempfile.TemporaryDirectory() as disco_worker, tempfile.TemporaryDirectory() as disco_publicacao:
+            with self._no_disco(disco_worker):
+                execucao, alvos = preditor_tempo_espera.planear_treino('celery')
+                tarefas = preditor_tempo_espera.preparar_treino_distribuido(execucao, alvos)
+                with CaptureQueriesContext(connection) as consultas:
+                    resultados = [
+                        preditor_tempo_espera.treinar_alvo_distribuido(str(execucao.id), (tipo, nome), filas_ids)
+                        for tipo, nome, filas_ids in tarefas
+                    ]
+                self.assertEqual(len(consultas), 0)
+                self.assertEqual(os.listdir(disco_worker), [])
+
+            with self._no_disco(disco_publicacao):
+                publicadas = preditor_tempo_espera.publicar_treino_distribuido(str(execucao.id), resultados)
+                self.assertEqual(sorted(publicadas), sorted(resultados))
+                self.assertEqual(preditor_tempo_espera.modelo_para(self.fila)['amostras'], 30)
+        self.assertEqual(sorted(chave for chave, _ in publicadas), ['fila_' + str(self.fila.id), 'setor_bancario'])
+        self.assertTrue(MarcaTreinoFila.objects.filter(fila=self.fila).exists())
+        self.assertEqual(self.redis.hashes, {})
+
+
+@override_settings(MODELOS_ML_DISTRIBUIR=True)
+class DistribuidorModelosTests(TestCase):
+    def setUp(self):
+        self.redis = _RedisEmMemoria()
+        self.origem = self._registro('origem')
+        self.destino = self._registro('destino')
+
+    def _registro(self, nome):
+        pasta = tempfile.TemporaryDirectory()
+        self.addCleanup(pasta.cleanup)
+        registro = RegistroModelos(pasta.name, 1024 * 1024)
+        distribuidor = DistribuidorModelos(registro, 'teste')
+        distribuidor._cliente = self.redis
+        return registro
+
+    def test_versao_assinada_e_instalada_noutro_processo(self):
+        versao = self.origem.salvar('fila_1', {'modelo': 'a'})
+        self.assertTrue(self.destino.distribuidor.receber('fila_1', versao))
+        self.assertEqual(self.destino.obter('fila_1'), {'modelo': 'a'})
+
+    def test_artefacto_alterado_no_redis_e_recusado(self):
+        versao = self.origem.salvar('fila_1', {'modelo': 'a'})
+        self.redis.hashes['modelos_ml:teste:fila_1']['dados'] = RegistroModelos.serializar({'modelo': 'b'})
+        self.assertFalse(self.destino.distribuidor.receber('fila_1', versao))
+        self.assertIsNone(self.destino.obter('fila_1'))
+        self.assertEqual(os.listdir(self.destino.diretorio), [])
+
+    def test_obter_nao_le_o_ficheiro_atual_a_cada_previsao(self):
+        self.origem.salvar('fila_1', {'modelo': 'a'})
+        with mock.patch.object(self.origem, 'versao_atual', wraps=self.origem.versao_atual) as versao_atual:
+            for _ in range(5):
+                self.origem.obter('fila_1')
+            self.assertEqual(versao_atual.call_count, 0)
+            nova = self.origem.salvar('fila_1', {'modelo': 'b'})
+            self.assertEqual(self.origem.versao_em_uso('fila_1'), nova)
+            self.assertEqual(versao_atual.call_count, 0)
+
+
+class _ViewContador(IdempotenciaMixin, APIView):
+    authentication_classes = []
+    permission_classes = [AllowAny]
+    chamadas = 0
+
+    def post(self, request):
+        _ViewContador.chamadas += 1
+        return Response({'chamada': _ViewContador.chamadas}, status=201)
+
+
+class IdempotenciaMixinTests(TestCase):
+    def setUp(self):
+        _ViewContador.chamadas = 0
+        self.guardado = {}
+        self.redis = mock.MagicMock()
+        self.redis.get.side_effect = self.guardado.get
+        self.redis.setex.side_effect = lambda chave, ttl, valor: self.guardado.__setitem__(chave, valor)
+        self.redis.set.return_value = True
+        patcher = mock.patch('fila_online.idempotencia.redis_client', self.redis)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.view = _ViewContador.as_view()
+
+    def _pedido(self, corpo='{"a": 1}', chave='chave-1'):
+        return RequestFactory().post('/teste/', data=corpo, content_type='application/json', HTTP_IDEMPOTENCY_KEY=chave)
+
+    def test_repeticao_reproduz_a_primeira_resposta_sem_executar_a_view(self):
+        primeira = self.view(self._pedido())
+        repetida = self.view(self._pedido())
+        self.assertEqual(primeira.status_code, 201)
+        self.assertEqual(repetida.status_code, 201)
+        self.assertEqual(repetida['Idempotent-Replayed'], 'true')
+        self.assertEqual(json.loads(repetida.content), {'chamada': 1})
+        self.assertEqual(_ViewContador.chamadas, 1)
+
+    def test_mesma_chave_com_outro_corpo_devolve_422(self):
+        self.view(self._pedido())
+        resposta = self.view(self._pedido(corpo='{"a": 2}'))
+        self.assertEqual(resposta.status_code, 422)
+        self.assertEqual(_ViewContador.chamadas, 1)
+
+    def test_pedido_ainda_em_processamento_devolve_409(self):
+        self.redis.set.return_value = False  # bloqueio já tomado por outro pedido com a mesma chave
+        resposta = self.view(self._pedido())
+        self.assertEqual(resposta.status_code, 409)
+        self.assertEqual(_ViewContador.chamadas, 0)
+
+    def test_sem_redis_executa_a_view(self):
+        self.redis.get.side_effect = redis.ConnectionError('indisponível')
+        self.assertEqual(self.view(self._pedido()).status_code, 201)
+        self.assertEqual(self.view(self._pedido()).status_code, 201)
+        self.assertEqual(_ViewContador.chamadas, 2)
@@ -8,4 +8,9 @@ urlpatterns = [
     path('filas/<uuid:pk>/', views.DetalheFila.as_view(), name='detalhe_fila'),
     path('filas/<uuid:pk>/emitir_ticket/', views.EmitirTicket.as_view(), name='emitir_ticket'),
     path('tickets/', views.ListarTickets.as_view(), name='listar_tickets'),
+    path('filas/<uuid:fila_id>/senhas_fisicas/lote/', views.GerarSenhasFisicasLoteView.as_view(), name='gerar_senhas_fisicas_lote'),
+    path('filas/<uuid:fila_id>/chamar_proximos/', views.ChamarProximasSenhasView.as_view(), name='chamar_proximos'),
+    path('filiais/<uuid:filial_id>/totens/', views.RegistrarTotemView.as_view(), name='registrar_totem'),
+    path('filas/<uuid:fila_id>/totens/<str:totem_id>/blocos/', views.ReservarBlocoTotemView.as_view(), name='reservar_bloco_totem'),
+    path('totens/<str:totem_id>/blocos/<uuid:reserva_id>/sincronizar/', views.SincronizarBlocoTotemView.as_view(), name='sincronizar_bloco_totem'),
 ]
\ No newline at end of file
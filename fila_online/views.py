@@ -3,6 +3,9 @@ from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated
 from .models import Fila, Ticket
 from .serializers import FilaSerializer, TicketSerializer
+from .services import AlocadorSenhas, IndiceFilaViva, CacheTempoEspera
+from .idempotencia import IdempotenciaMixin
+from django.db import transaction
 from django.utils import timezone
 import uuid
 
@@ -25,35 +28,37 @@ class DetalheFila(APIView):
         except Fila.DoesNotExist:
             return Response({"error": "Fila não encontrada"}, status=404)
 
-class EmitirTicket(APIView):
+class EmitirTicket(IdempotenciaMixin, APIView):
     permission_classes = [IsAuthenticated]
     
     def post(self, request, pk):
         try:
-            fila = Fila.objects.get(pk=pk)
+            fila = Fila.objects.select_related('departamento__filial').get(pk=pk)
             if fila.tickets_ativos >= fila.limite_diario:
                 return Response({"error": "Limite diário atingido"}, status=400)
-                
-            numero_ticket = fila.ticket_atual + 1
-            ticket = Ticket.objects.create(
-                fila=fila,
-                usuario=request.user,
-                numero_ticket=numero_ticket,
-                codigo_qr=str(uuid.uuid4()),
-                prioridade=0,
-                e_fisico=False,
-                status='Pendente',
-                emitido_em=timezone.now()
-            )
-            
-            fila.ticket_atual = numero_ticket
-            fila.tickets_ativos += 1
-            fila.save()
+
+            with transaction.atomic():
+                AlocadorSenhas.reservar_vaga(fila)
+                numero_ticket = AlocadorSenhas.alocar(fila)
+                ticket = Ticket.objects.create(
+                    fila=fila,
+                    usuario=request.user,
+                    numero_ticket=numero_ticket,
+                    codigo_qr=str(uuid.uuid4()),
+                    prioridade=0,
+                    e_fisico=False,
+                    status='Pendente',
+                    emitido_em=timezone.now()
+                )
+                IndiceFilaViva.adicionar_apos_commit([ticket])
+                CacheTempoEspera.invalidar_apos_commit([fila.id])
             
             serializer = TicketSerializer(ticket)
             return Response(serializer.data, status=201)
         except Fila.DoesNotExist:
             return Response({"error": "Fila não encontrada"}, status=404)
+        except ValueError as e:
+            return Response({"error": str(e)}, status=400)
 
 class ListarTickets(APIView):
     permission_classes = [IsAuthenticated]
@@ -77,13 +82,15 @@ from rest_framework.permissions import IsAuthenticated
 from rest_framework.exceptions import ValidationError, PermissionDenied, NotFound
 from geopy.distance import geodesic
 from sistema.auth import FirebaseAndTokenAuthentication
-from fila_online.models import Fila, Ticket, Departamento, Instituicao, Filial, HorarioFila
+from fila_online.models import Fila, Ticket, Departamento, Instituicao, Filial, HorarioFila, MotorTempoEspera, ReservaBlocoTotem, Totem
 from sistema.models import PerfilUsuario, PreferenciaUsuario, LogAuditoria
-from .services import ServicoFila
+from .services import ServicoFila, IndiceFilaViva, AgendaExpiracao, CacheTempoEspera
 from .ml_models import preditor_tempo_espera
+from django.db.models import F
+from django.db.models.functions import Greatest
 import redis
 from django.conf import settings
-from datetime import datetime
+from datetime import datetime, timedelta
 from channels.layers import get_channel_layer
 from asgiref.sync import async_to_sync
 import io
@@ -136,7 +143,7 @@ class SugerirServicoView(APIView):
             logger.error(f"Erro inesperado ao gerar sugestões: {e}")
             return Response({'erro': "Erro ao gerar sugestões."}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
-class AtualizarLocalizacaoView(APIView):
+class AtualizarLocalizacaoView(IdempotenciaMixin, APIView):
     authentication_classes = [FirebaseAndTokenAuthentication]
     permission_classes = [IsAuthenticated]
 
@@ -175,7 +182,7 @@ class AtualizarLocalizacaoView(APIView):
             logger.error(f"Erro ao atualizar localização: {e}")
             return Response({'erro': 'Erro ao atualizar localização'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
-class CriarFilaView(APIView):
+class CriarFilaView(IdempotenciaMixin, APIView):
     authentication_classes = [FirebaseAndTokenAuthentication]
     permission_classes = [IsAuthenticated]
 
@@ -199,6 +206,9 @@ class CriarFilaView(APIView):
         if not isinstance(data['num_balcoes'], int) or data['num_balcoes'] <= 0:
             logger.warning(f"Número de guichês inválido: {data['num_balcoes']}")
             return Response({'erro': 'Número de guichês deve ser um número positivo'}, status=status.HTTP_400_BAD_REQUEST)
+        if 'motor_tempo_espera' in data and data['motor_tempo_espera'] not in MotorTempoEspera.values:
+            logger.warning(f"Motor de tempo de espera inválido: {data['motor_tempo_espera']}")
+            return Response({'erro': f"motor_tempo_espera deve ser um de: {', '.join(MotorTempoEspera.values)}"}, status=status.HTTP_400_BAD_REQUEST)
 
         try:
             departamento = Departamento.objects.get(id=data['departamento_id'])
@@ -233,13 +243,14 @@ class CriarFilaView(APIView):
             hora_abertura=hora_abertura,
             limite_diario=data['limite_diario'],
             num_balcoes=data['num_balcoes'],
+            motor_tempo_espera=data.get('motor_tempo_espera', MotorTempoEspera.AUTOMATICO),
             tempo_espera_medio=0.0
         )
         fila.save()
         logger.info(f"Fila criada: {fila.servico} (ID: {fila.id})")
         return Response({'mensagem': f'Fila {data["servico"]} criada', 'fila_id': str(fila.id)}, status=status.HTTP_201_CREATED)
 
-class AtualizarFilaView(APIView):
+class AtualizarFilaView(IdempotenciaMixin, APIView):
     authentication_classes = [FirebaseAndTokenAuthentication]
     permission_classes = [IsAuthenticated]
 
@@ -273,6 +284,9 @@ class AtualizarFilaView(APIView):
         if 'num_balcoes' in data and (not isinstance(data['num_balcoes'], int) or data['num_balcoes'] <= 0):
             logger.warning(f"Número de guichês inválido: {data['num_balcoes']}")
             return Response({'erro': 'Número de guichês deve ser um número positivo'}, status=status.HTTP_400_BAD_REQUEST)
+        if 'motor_tempo_espera' in data and data['motor_tempo_espera'] not in MotorTempoEspera.values:
+            logger.warning(f"Motor de tempo de espera inválido: {data['motor_tempo_espera']}")
+            return Response({'erro': f"motor_tempo_espera deve ser um de: {', '.join(MotorTempoEspera.values)}"}, status=status.HTTP_400_BAD_REQUEST)
 
         fila.servico = data.get('servico', fila.servico)
         fila.prefixo = data.get('prefixo', fila.prefixo)
@@ -298,11 +312,16 @@ class AtualizarFilaView(APIView):
                 return Response({'erro': 'Formato de hora_abertura inválido (HH:MM)'}, status=status.HTTP_400_BAD_REQUEST)
         fila.limite_diario = data.get('limite_diario', fila.limite_diario)
         fila.num_balcoes = data.get('num_balcoes', fila.num_balcoes)
-        fila.save()
+        fila.motor_tempo_espera = data.get('motor_tempo_espera', fila.motor_tempo_espera)
+        # Só a configuração: contadores e estatísticas são atualizados em paralelo com F()
+        fila.save(update_fields=[
+            'servico', 'prefixo', 'departamento', 'hora_abertura', 'limite_diario', 'num_balcoes', 'motor_tempo_espera'
+        ])
+        CacheTempoEspera.invalidar([fila.id])
         logger.info(f"Fila atualizada: {fila.servico} (ID: {id})")
         return Response({'mensagem': 'Fila atualizada'}, status=status.HTTP_200_OK)
 
-class ExcluirFilaView(APIView):
+class ExcluirFilaView(IdempotenciaMixin, APIView):
     authentication_classes = [FirebaseAndTokenAuthentication]
     permission_classes = [IsAuthenticated]
 
@@ -334,7 +353,7 @@ class ExcluirFilaView(APIView):
         logger.info(f"Fila excluída: {id}")
         return Response({'mensagem': 'Fila excluída'}, status=status.HTTP_200_OK)
 
-class EmitirSenhaView(APIView):
+class EmitirSenhaView(IdempotenciaMixin, APIView):
     authentication_classes = [FirebaseAndTokenAuthentication]
     permission_classes = [IsAuthenticated]
 
@@ -361,7 +380,7 @@ class EmitirSenhaView(APIView):
             )
 
             tempo_espera = ServicoFila.calcular_tempo_espera(senha.fila_id, senha.numero_ticket, senha.prioridade)
-            posicao = max(0, senha.numero_ticket - senha.fila.ticket_atual)
+            posicao = ServicoFila.calcular_posicao(senha)
 
             resposta = {
                 'mensagem': 'Senha emitida',
@@ -421,7 +440,7 @@ class BaixarSenhaPDFView(APIView):
             logger.error(f"Senha não encontrada: id={senha_id}")
             raise NotFound('Senha não encontrada')
 
-        if senha.usuario_id != str(request.user.id) and senha.usuario_id != 'PRESENCIAL':
+        if senha.usuario_id != str(request.user.id) and not senha.e_presencial:
             logger.warning(f"Tentativa não autorizada de baixar PDF da senha {senha_id} por usuario_id={request.user.id}")
             raise PermissionDenied('Não autorizado')
 
@@ -450,13 +469,13 @@ class StatusSenhaView(APIView):
             logger.error(f"Senha não encontrada: id={senha_id}")
             raise NotFound('Senha não encontrada')
 
-        if senha.usuario_id != str(request.user.id) and senha.usuario_id != 'PRESENCIAL':
+        if senha.usuario_id != str(request.user.id) and not senha.e_presencial:
             logger.warning(f"Tentativa não autorizada de visualizar status da senha {senha_id} por usuario_id={request.user.id}")
             raise PermissionDenied('Não autorizado')
 
         fila = senha.fila
         tempo_espera = ServicoFila.calcular_tempo_espera(fila.id, senha.numero_ticket, senha.prioridade)
-        posicao = max(0, senha.numero_ticket - fila.ticket_atual)
+        posicao = ServicoFila.calcular_posicao(senha)
 
         return Response({
             'servico': fila.servico,
@@ -473,7 +492,7 @@ class StatusSenhaView(APIView):
             'expira_em': senha.expira_em.isoformat() if senha.expira_em else None
         }, status=status.HTTP_200_OK)
 
-class ChamarProximaSenhaView(APIView):
+class ChamarProximaSenhaView(IdempotenciaMixin, APIView):
     authentication_classes = [FirebaseAndTokenAuthentication]
     permission_classes = [IsAuthenticated]
 
@@ -482,8 +501,15 @@ class ChamarProximaSenhaView(APIView):
             logger.warning(f"Tentativa não autorizada de chamar senha por user_id={request.user.id}")
             raise PermissionDenied('Acesso restrito a administradores')
 
+        balcao = request.data.get('balcao')
+        try:
+            balcao = int(balcao) if balcao is not None else None
+        except (ValueError, TypeError):
+            logger.warning(f"Balcão inválido: {balcao}")
+            return Response({'erro': 'balcao deve ser um número inteiro'}, status=status.HTTP_400_BAD_REQUEST)
+
         try:
-            senha = ServicoFila.chamar_proximo(servico)
+            senha = ServicoFila.chamar_proximo(servico, filial_id=request.data.get('filial_id'), balcao=balcao)
             perfil = PerfilUsuario.objects.get(usuario_id=str(request.user.id))
 
             if request.user_tipo == 'admin_departamento' and senha.fila.departamento_id != perfil.departamento_id:
@@ -535,7 +561,53 @@ class ChamarProximaSenhaView(APIView):
             logger.error(f"Erro ao chamar próxima senha para serviço {servico}: {e}")
             return Response({'erro': str(e)}, status=status.HTTP_400_BAD_REQUEST)
 
-class ChamarSenhaView(APIView):
+class ChamarProximasSenhasView(IdempotenciaMixin, APIView):
+    authentication_classes = [FirebaseAndTokenAuthentication]
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request, fila_id):
+        if request.user_tipo not in ['admin_departamento', 'admin_instituicao', 'admin_sistema']:
+            logger.warning(f"Tentativa não autorizada de chamar senhas por user_id={request.user.id}")
+            raise PermissionDenied('Acesso restrito a administradores')
+
+        balcoes = request.data.get('balcoes')
+        try:
+            balcoes = [int(balcao) for balcao in balcoes] if balcoes else None
+        except (ValueError, TypeError):
+            logger.warning(f"Lista de balcões inválida: {balcoes}")
+            return Response({'erro': 'balcoes deve ser uma lista de números inteiros'}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            fila = Fila.objects.select_related('departamento__filial').get(id=fila_id)
+        except ObjectDoesNotExist:
+            logger.warning(f"Fila não encontrada: fila_id={fila_id}")
+            raise NotFound('Fila não encontrada')
+
+        perfil = PerfilUsuario.objects.get(usuario_id=str(request.user.id))
+        if request.user_tipo == 'admin_departamento' and fila.departamento_id != perfil.departamento_id:
+            logger.warning(f"Usuário {request.user.id} não tem permissão para fila {fila_id}")
+            raise PermissionDenied('Sem permissão para esta fila')
+        if request.user_tipo == 'admin_instituicao' and fila.departamento.filial.instituicao_id != perfil.instituicao_id:
+            logger.warning(f"Usuário {request.user.id} não tem permissão para instituição {fila.departamento.filial.instituicao_id}")
+            raise PermissionDenied('Sem permissão para esta instituição')
+
+        try:
+            senhas = ServicoFila.chamar_proximos(fila_id, balcoes)
+            logger.info(f"{len(senhas)} senhas chamadas na fila_id={fila_id} por user_id={request.user.id}")
+            return Response({
+                'mensagem': f'{len(senhas)} senhas chamadas',
+                'chamadas': [{
+                    'senha_id': str(senha.id),
+                    'numero': f"{fila.prefixo}{senha.numero_ticket}",
+                    'balcao': senha.balcao
+                } for senha in senhas],
+                'restantes': Fila.objects.values_list('tickets_ativos', flat=True).get(id=fila_id)
+            }, status=status.HTTP_200_OK)
+        except ValueError as e:
+            logger.error(f"Erro ao chamar próximas senhas na fila_id={fila_id}: {e}")
+            return Response({'erro': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+class ChamarSenhaView(IdempotenciaMixin, APIView):
     authentication_classes = [FirebaseAndTokenAuthentication]
     permission_classes = [IsAuthenticated]
 
@@ -567,12 +639,23 @@ class ChamarSenhaView(APIView):
             balcao = data.get('balcao', senha.fila.ultimo_balcao or 1)
             senha.status = 'Chamado'
             senha.atendido_em = timezone.now()
+            senha.expira_em = senha.atendido_em + timedelta(minutes=ServicoFila.MINUTOS_TIMEOUT_CHAMADA)
             senha.balcao = balcao
-            senha.fila.ticket_atual = senha.numero_ticket
-            senha.fila.tickets_ativos -= 1
-            senha.fila.ultimo_balcao = balcao
-            senha.fila.save()
-            senha.save()
+            with transaction.atomic():
+                # Condicional ao estado: outro pedido pode ter chamado ou cancelado a senha desde a leitura
+                if not Ticket.objects.filter(id=senha.id, status='Pendente').update(
+                    status=senha.status, atendido_em=senha.atendido_em, expira_em=senha.expira_em, balcao=balcao
+                ):
+                    return Response({'erro': 'Senha já não está pendente'}, status=status.HTTP_400_BAD_REQUEST)
+                Fila.objects.filter(id=senha.fila_id).update(
+                    ticket_atual=senha.numero_ticket,
+                    tickets_ativos=Greatest(F('tickets_ativos') - 1, 0),
+                    ultimo_balcao=balcao
+                )
+            senha.fila.refresh_from_db(fields=['ticket_atual', 'tickets_ativos', 'ultimo_balcao'])
+            IndiceFilaViva.remover(senha.fila_id, [senha.id])
+            AgendaExpiracao.agendar([senha])
+            CacheTempoEspera.invalidar([senha.fila_id])
 
             # Enviar atualização via WebSocket
             camada_canal = get_channel_layer()
@@ -621,13 +704,14 @@ class ChamarSenhaView(APIView):
             logger.error(f"Erro ao chamar senha {senha_id}: {e}")
             return Response({'erro': f'Erro ao chamar senha: {str(e)}'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
-class OferecerTrocaView(APIView):
+class OferecerTrocaView(IdempotenciaMixin, APIView):
     authentication_classes = [FirebaseAndTokenAuthentication]
     permission_classes = [IsAuthenticated]
 
     def post(self, request, senha_id):
         try:
             senha = ServicoFila.oferecer_troca(senha_id, str(request.user.id))
+            tempo_espera = ServicoFila.calcular_tempo_espera(senha.fila_id, senha.numero_ticket, senha.prioridade)
             camada_canal = get_channel_layer()
             async_to_sync(camada_canal.group_send)(
                 f"senha_{senha.id}",
@@ -637,8 +721,8 @@ class OferecerTrocaView(APIView):
                         "senha_id": str(senha.id),
                         "status": senha.status,
                         "balcao": f"{senha.balcao:02d}" if senha.balcao else None,
-                        "posicao": max(0, senha.numero_ticket - senha.fila.ticket_atual),
-                        "tempo_espera": f"{int(ServicoFila.calcular_tempo_espera(senha.fila_id, senha.numero_ticket, senha.prioridade))} minutos"
+                        "posicao": ServicoFila.calcular_posicao(senha),
+                        "tempo_espera": f"{int(tempo_espera)} minutos" if tempo_espera != "N/A" else "N/A"
                     }
                 }
             )
@@ -648,7 +732,7 @@ class OferecerTrocaView(APIView):
             logger.error(f"Erro ao oferecer troca para senha {senha_id}: {e}")
             return Response({'erro': str(e)}, status=status.HTTP_400_BAD_REQUEST)
 
-class TrocarSenhaView(APIView):
+class TrocarSenhaView(IdempotenciaMixin, APIView):
     authentication_classes = [FirebaseAndTokenAuthentication]
     permission_classes = [IsAuthenticated]
 
@@ -657,6 +741,7 @@ class TrocarSenhaView(APIView):
         try:
             resultado = ServicoFila.trocar_senhas(senha_de_id, senha_para_id, str(request.user.id))
             camada_canal = get_channel_layer()
+            tempos = ServicoFila.tempos_espera_senhas([resultado['senha_de'], resultado['senha_para']])
             for senha in [resultado['senha_de'], resultado['senha_para']]:
                 async_to_sync(camada_canal.group_send)(
                     f"senha_{senha.id}",
@@ -666,8 +751,8 @@ class TrocarSenhaView(APIView):
                             "senha_id": str(senha.id),
                             "status": senha.status,
                             "balcao": f"{senha.balcao:02d}" if senha.balcao else None,
-                            "posicao": max(0, senha.numero_ticket - senha.fila.ticket_atual),
-                            "tempo_espera": f"{int(ServicoFila.calcular_tempo_espera(senha.fila_id, senha.numero_ticket, senha.prioridade))} minutos"
+                            "posicao": ServicoFila.calcular_posicao(senha),
+                            "tempo_espera": f"{int(tempos[senha.id])} minutos" if isinstance(tempos.get(senha.id), (int, float)) else "N/A"
                         }
                     }
                 )
@@ -683,7 +768,7 @@ class TrocarSenhaView(APIView):
             logger.error(f"Erro ao realizar troca entre senhas {senha_de_id} e {senha_para_id}: {e}")
             return Response({'erro': str(e)}, status=status.HTTP_400_BAD_REQUEST)
 
-class ValidarSenhaView(APIView):
+class ValidarSenhaView(IdempotenciaMixin, APIView):
     def post(self, request):
         data = request.data
         codigo_qr = data.get('codigo_qr')
@@ -814,7 +899,12 @@ class ListarSenhasUsuarioView(APIView):
     permission_classes = [IsAuthenticated]
 
     def get(self, request):
-        senhas = Ticket.objects.filter(usuario_id=str(request.user.id))
+        senhas = list(
+            Ticket.objects.filter(usuario_id=str(request.user.id))
+            .select_related('fila__departamento__filial__instituicao')
+        )
+        tempos = ServicoFila.tempos_espera_senhas(senhas)
+        posicoes = ServicoFila.posicoes_senhas(senhas)
         resultado = [{
             'id': str(senha.id),
             'servico': senha.fila.servico,
@@ -823,8 +913,8 @@ class ListarSenhasUsuarioView(APIView):
             'numero': f"{senha.fila.prefixo}{senha.numero_ticket}",
             'status': senha.status,
             'balcao': f"{senha.balcao:02d}" if senha.balcao else None,
-            'posicao': max(0, senha.numero_ticket - senha.fila.ticket_atual) if senha.status == 'Pendente' else 0,
-            'tempo_espera': f"{int(ServicoFila.calcular_tempo_espera(senha.fila_id, senha.numero_ticket, senha.prioridade))} minutos" if senha.status == 'Pendente' else "N/A",
+            'posicao': posicoes[senha.id],
+            'tempo_espera': f"{int(tempos[senha.id])} minutos" if isinstance(tempos.get(senha.id), (int, float)) else "N/A",
             'codigo_qr': senha.codigo_qr,
             'troca_disponivel': senha.troca_disponivel
         } for senha in senhas]
@@ -842,12 +932,12 @@ class ListarSenhasTrocaDisponivelView(APIView):
         if not filas_ids:
             return Response([], status=status.HTTP_200_OK)
 
-        senhas = Ticket.objects.filter(
+        senhas = list(Ticket.objects.filter(
             fila_id__in=filas_ids,
             troca_disponivel=True,
-            status='Pendente',
-            usuario_id__ne=usuario_id
-        )
+            status='Pendente'
+        ).exclude(usuario_id=usuario_id).select_related('fila__departamento__filial__instituicao'))
+        posicoes = ServicoFila.posicoes_senhas(senhas)
 
         return Response([{
             'id': str(senha.id),
@@ -855,11 +945,11 @@ class ListarSenhasTrocaDisponivelView(APIView):
             'instituicao': senha.fila.departamento.filial.instituicao.nome,
             'filial': senha.fila.departamento.filial.nome,
             'numero': f"{senha.fila.prefixo}{senha.numero_ticket}",
-            'posicao': max(0, senha.numero_ticket - senha.fila.ticket_atual),
+            'posicao': posicoes[senha.id],
             'usuario_id': senha.usuario_id
         } for senha in senhas], status=status.HTTP_200_OK)
 
-class CancelarSenhaView(APIView):
+class CancelarSenhaView(IdempotenciaMixin, APIView):
     authentication_classes = [FirebaseAndTokenAuthentication]
     permission_classes = [IsAuthenticated]
 
@@ -902,6 +992,9 @@ class ListarTodasSenhasView(APIView):
             senhas = Ticket.objects.filter(fila__departamento__filial__instituicao_id=perfil.instituicao_id)
         else:
             senhas = Ticket.objects.filter(fila__departamento_id=perfil.departamento_id)
+        senhas = list(senhas.select_related('fila__departamento__filial__instituicao'))
+        tempos = ServicoFila.tempos_espera_senhas(senhas)
+        posicoes = ServicoFila.posicoes_senhas(senhas)
 
         return Response([{
             'id': str(senha.id),
@@ -911,14 +1004,14 @@ class ListarTodasSenhasView(APIView):
             'numero': f"{senha.fila.prefixo}{senha.numero_ticket}",
             'status': senha.status,
             'balcao': f"{senha.balcao:02d}" if senha.balcao else None,
-            'posicao': max(0, senha.numero_ticket - senha.fila.ticket_atual) if senha.status == 'Pendente' else 0,
-            'tempo_espera': f"{int(ServicoFila.calcular_tempo_espera(senha.fila_id, senha.numero_ticket, senha.prioridade))} minutos" if senha.status == 'Pendente' else "N/A",
+            'posicao': posicoes[senha.id],
+            'tempo_espera': f"{int(tempos[senha.id])} minutos" if isinstance(tempos.get(senha.id), (int, float)) else "N/A",
             'codigo_qr': senha.codigo_qr,
             'troca_disponivel': senha.troca_disponivel,
             'usuario_id': senha.usuario_id
         } for senha in senhas], status=status.HTTP_200_OK)
 
-class AtualizarTokenFCMView(APIView):
+class AtualizarTokenFCMView(IdempotenciaMixin, APIView):
     authentication_classes = [FirebaseAndTokenAuthentication]
     permission_classes = [IsAuthenticated]
 
@@ -1107,7 +1200,7 @@ class BuscarServicosInstituicaoView(APIView):
             logger.error(f"Erro ao buscar serviços para instituicao_id={instituicao_id}: {e}")
             return Response({'erro': f'Erro ao buscar serviços: {str(e)}'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
-class GerarSenhaFisicaView(APIView):
+class GerarSenhaFisicaView(IdempotenciaMixin, APIView):
     def post(self, request, instituicao_id):
         try:
             instituicao = Instituicao.objects.get(id=instituicao_id)
@@ -1136,6 +1229,7 @@ class GerarSenhaFisicaView(APIView):
         try:
             resultado = ServicoFila.gerar_senha_fisica_para_totem(fila_id, ip_cliente)
             senha = resultado['senha']
+            tempo_espera = ServicoFila.calcular_tempo_espera(fila_id, senha['numero_senha'], 0)
             camada_canal = get_channel_layer()
             async_to_sync(camada_canal.group_send)(
                 f"senha_{senha['id']}",
@@ -1145,8 +1239,8 @@ class GerarSenhaFisicaView(APIView):
                         "senha_id": senha['id'],
                         "status": senha['status'],
                         "balcao": None,
-                        "posicao": max(0, senha['numero_senha'] - fila.ticket_atual),
-                        "tempo_espera": f"{int(ServicoFila.calcular_tempo_espera(fila_id, senha['numero_senha'], 0))} minutos"
+                        "posicao": senha['posicao'],
+                        "tempo_espera": f"{int(tempo_espera)} minutos" if tempo_espera != "N/A" else "N/A"
                     }
                 }
             )
@@ -1165,6 +1259,150 @@ class GerarSenhaFisicaView(APIView):
             logger.error(f"Erro inesperado ao gerar senha física para fila_id={fila_id}: {e}")
             return Response({'erro': f'Erro ao gerar senha: {str(e)}'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
+class GerarSenhasFisicasLoteView(IdempotenciaMixin, APIView):
+    authentication_classes = [FirebaseAndTokenAuthentication]
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request, fila_id):
+        if request.user_tipo not in ['admin_departamento', 'admin_instituicao', 'admin_sistema']:
+            logger.warning(f"Tentativa não autorizada de emitir senhas em lote por user_id={request.user.id}")
+            raise PermissionDenied('Acesso restrito a administradores')
+
+        try:
+            quantidade = int(request.data.get('quantidade', 0))
+        except (ValueError, TypeError):
+            logger.warning(f"Quantidade inválida: {request.data.get('quantidade')}")
+            return Response({'erro': 'quantidade deve ser um número inteiro'}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            fila = Fila.objects.select_related('departamento__filial').get(id=fila_id)
+        except ObjectDoesNotExist:
+            logger.warning(f"Fila não encontrada: fila_id={fila_id}")
+            raise NotFound('Fila não encontrada')
+
+        perfil = PerfilUsuario.objects.get(usuario_id=str(request.user.id))
+        if request.user_tipo == 'admin_departamento' and fila.departamento_id != perfil.departamento_id:
+            logger.warning(f"Usuário {request.user.id} não tem permissão para fila {fila_id}")
+            raise PermissionDenied('Sem permissão para esta fila')
+        if request.user_tipo == 'admin_instituicao' and fila.departamento.filial.instituicao_id != perfil.instituicao_id:
+            logger.warning(f"Usuário {request.user.id} não tem permissão para instituição {fila.departamento.filial.instituicao_id}")
+            raise PermissionDenied('Sem permissão para esta instituição')
+
+        try:
+            resultado = ServicoFila.gerar_senhas_fisicas_em_lote(fila_id, quantidade, id_usuario=request.user.id)
+            senhas = resultado['senhas']
+            logger.info(f"{len(senhas)} senhas físicas geradas em lote para fila_id={fila_id} por user_id={request.user.id}")
+            return Response(resultado, status=status.HTTP_201_CREATED)
+        except ValueError as e:
+            logger.error(f"Erro ao gerar senhas em lote para fila_id={fila_id}: {e}")
+            return Response({'erro': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+class RegistrarTotemView(IdempotenciaMixin, APIView):
+    authentication_classes = [FirebaseAndTokenAuthentication]
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request, filial_id):
+        if request.user_tipo not in ['admin_departamento', 'admin_instituicao', 'admin_sistema']:
+            logger.warning(f"Tentativa não autorizada de registrar totem por user_id={request.user.id}")
+            raise PermissionDenied('Acesso restrito a administradores')
+
+        try:
+            filial = Filial.objects.get(id=filial_id)
+        except ObjectDoesNotExist:
+            logger.warning(f"Filial não encontrada: filial_id={filial_id}")
+            raise NotFound('Filial não encontrada')
+
+        perfil = PerfilUsuario.objects.get(usuario_id=str(request.user.id))
+        if request.user_tipo == 'admin_departamento' and not Departamento.objects.filter(id=perfil.departamento_id, filial_id=filial.id).exists():
+            logger.warning(f"Usuário {request.user.id} não tem permissão para filial {filial_id}")
+            raise PermissionDenied('Sem permissão para esta filial')
+        if request.user_tipo == 'admin_instituicao' and filial.instituicao_id != perfil.instituicao_id:
+            logger.warning(f"Usuário {request.user.id} não tem permissão para instituição {filial.instituicao_id}")
+            raise PermissionDenied('Sem permissão para esta instituição')
+
+        codigo = str(request.data.get('codigo', '')).strip()
+        if not codigo or len(codigo) > 50:
+            return Response({'erro': 'codigo é obrigatório (até 50 caracteres)'}, status=status.HTTP_400_BAD_REQUEST)
+        totem, criado = Totem.objects.get_or_create(codigo=codigo, defaults={'filial': filial})
+        if not criado and totem.filial_id != filial.id:
+            logger.warning(f"Totem {codigo} já registrado noutra filial ({totem.filial_id})")
+            return Response({'erro': 'Totem já registrado noutra filial'}, status=status.HTTP_409_CONFLICT)
+        ativo = bool(request.data.get('ativo', True))
+        if totem.ativo != ativo:
+            totem.ativo = ativo
+            totem.save(update_fields=['ativo'])
+
+        logger.info(f"Totem {codigo} registrado na filial {filial_id} por user_id={request.user.id} (ativo={ativo})")
+        return Response(
+            {'totem_id': totem.codigo, 'filial_id': str(filial.id), 'ativo': totem.ativo},
+            status=status.HTTP_201_CREATED if criado else status.HTTP_200_OK
+        )
+
+def _verificar_permissao_totem(request, fila):
+    """Blocos de totem: só administradores com acesso à fila, como na emissão em lote."""
+    if request.user_tipo not in ['admin_departamento', 'admin_instituicao', 'admin_sistema']:
+        logger.warning(f"Tentativa não autorizada de operar blocos de totem por user_id={request.user.id}")
+        raise PermissionDenied('Acesso restrito a administradores')
+    perfil = PerfilUsuario.objects.get(usuario_id=str(request.user.id))
+    if request.user_tipo == 'admin_departamento' and fila.departamento_id != perfil.departamento_id:
+        logger.warning(f"Usuário {request.user.id} não tem permissão para fila {fila.id}")
+        raise PermissionDenied('Sem permissão para esta fila')
+    if request.user_tipo == 'admin_instituicao' and fila.departamento.filial.instituicao_id != perfil.instituicao_id:
+        logger.warning(f"Usuário {request.user.id} não tem permissão para instituição {fila.departamento.filial.instituicao_id}")
+        raise PermissionDenied('Sem permissão para esta instituição')
+
+class ReservarBlocoTotemView(IdempotenciaMixin, APIView):
+    authentication_classes = [FirebaseAndTokenAuthentication]
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request, fila_id, totem_id):
+        try:
+            fila = Fila.objects.select_related('departamento__filial').get(id=fila_id)
+        except ObjectDoesNotExist:
+            logger.warning(f"Fila não encontrada: fila_id={fila_id}")
+            raise NotFound('Fila não encontrada')
+        _verificar_permissao_totem(request, fila)
+
+        quantidade = request.data.get('quantidade')
+        try:
+            quantidade = int(quantidade) if quantidade is not None else None
+        except (ValueError, TypeError):
+            logger.warning(f"Quantidade inválida: {quantidade}")
+            return Response({'erro': 'quantidade deve ser um número inteiro'}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            resultado = ServicoFila.reservar_bloco_totem(fila_id, totem_id, quantidade)
+            logger.info(f"Bloco reservado para totem {totem_id} na fila_id={fila_id} por user_id={request.user.id}")
+            return Response(resultado, status=status.HTTP_201_CREATED)
+        except ValueError as e:
+            logger.error(f"Erro ao reservar bloco para totem {totem_id} na fila_id={fila_id}: {e}")
+            return Response({'erro': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+class SincronizarBlocoTotemView(IdempotenciaMixin, APIView):
+    authentication_classes = [FirebaseAndTokenAuthentication]
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request, totem_id, reserva_id):
+        reserva = ReservaBlocoTotem.objects.select_related('fila__departamento__filial').filter(id=reserva_id, totem_id=totem_id).first()
+        if not reserva:
+            logger.warning(f"Reserva {reserva_id} não encontrada para totem {totem_id}")
+            raise NotFound('Reserva de bloco não encontrada')
+        _verificar_permissao_totem(request, reserva.fila)
+
+        senhas = request.data.get('senhas', [])
+        if not isinstance(senhas, list):
+            logger.warning(f"Lista de senhas inválida enviada pelo totem {totem_id}")
+            return Response({'erro': 'senhas deve ser uma lista'}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            resultado = ServicoFila.sincronizar_bloco_totem(
+                reserva_id, totem_id, senhas, encerrar=bool(request.data.get('encerrar', False))
+            )
+            return Response(resultado, status=status.HTTP_200_OK)
+        except ValueError as e:
+            logger.error(f"Erro ao sincronizar bloco {reserva_id} do totem {totem_id}: {e}")
+            return Response({'erro': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
 class PainelView(APIView):
     def get(self, request, instituicao_id):
         try:
@@ -1214,7 +1452,7 @@ logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 redis_client = redis.Redis.from_url('redis://localhost:6379')
 
-class CriarInstituicaoView(APIView):
+class CriarInstituicaoView(IdempotenciaMixin, APIView):
     authentication_classes = [FirebaseAndTokenAuthentication]
 
     def post(self, request):
@@ -1268,7 +1506,7 @@ class CriarInstituicaoView(APIView):
             logger.error(f"Erro ao criar instituição: {str(e)}")
             return Response({'erro': 'Erro interno ao criar instituição'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
-class AtualizarInstituicaoView(APIView):
+class AtualizarInstituicaoView(IdempotenciaMixin, APIView):
     authentication_classes = [FirebaseAndTokenAuthentication]
 
     def put(self, request, instituicao_id):
@@ -1320,7 +1558,7 @@ class AtualizarInstituicaoView(APIView):
             logger.error(f"Erro ao atualizar instituição {instituicao_id}: {str(e)}")
             return Response({'erro': 'Erro interno ao atualizar instituição'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
-class ExcluirInstituicaoView(APIView):
+class ExcluirInstituicaoView(IdempotenciaMixin, APIView):
     authentication_classes = [FirebaseAndTokenAuthentication]
 
     def delete(self, request, instituicao_id):
@@ -1352,7 +1590,7 @@ class ExcluirInstituicaoView(APIView):
             logger.error(f"Erro ao excluir instituição {instituicao_id}: {str(e)}")
             return Response({'erro': 'Erro interno ao excluir instituição'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
-class CriarFilialView(APIView):
+class CriarFilialView(IdempotenciaMixin, APIView):
     authentication_classes = [FirebaseAndTokenAuthentication]
 
     def post(self, request, instituicao_id):
@@ -1431,7 +1669,7 @@ class CriarFilialView(APIView):
             logger.error(f"Erro ao criar filial: {str(e)}")
             return Response({'erro': 'Erro interno ao criar filial'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
-class AtualizarFilialView(APIView):
+class AtualizarFilialView(IdempotenciaMixin, APIView):
     authentication_classes = [FirebaseAndTokenAuthentication]
 
     def put(self, request, instituicao_id, filial_id):
@@ -1534,7 +1772,7 @@ class ListarFiliaisView(APIView):
             logger.error(f"Erro ao listar filiais para user_id={user.id}: {str(e)}")
             return Response({'erro': 'Erro interno ao listar filiais'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
-class CriarAdminInstituicaoView(APIView):
+class CriarAdminInstituicaoView(IdempotenciaMixin, APIView):
     authentication_classes = [FirebaseAndTokenAuthentication]
 
     def post(self, request, instituicao_id):
@@ -1600,7 +1838,7 @@ class CriarAdminInstituicaoView(APIView):
             logger.error(f"Erro ao criar admin de instituição: {str(e)}")
             return Response({'erro': 'Erro interno ao criar administrador'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
-class AtualizarGestorView(APIView):
+class AtualizarGestorView(IdempotenciaMixin, APIView):
     authentication_classes = [FirebaseAndTokenAuthentication]
 
     def put(self, request, instituicao_id, usuario_id):
@@ -1686,7 +1924,7 @@ class AtualizarGestorView(APIView):
             logger.error(f"Erro ao atualizar gestor {usuario_id}: {str(e)}")
             return Response({'erro': 'Erro interno ao atualizar gestor'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
-class ExcluirGestorView(APIView):
+class ExcluirGestorView(IdempotenciaMixin, APIView):
     authentication_classes = [FirebaseAndTokenAuthentication]
 
     def delete(self, request, instituicao_id, usuario_id):
@@ -1729,7 +1967,7 @@ class ExcluirGestorView(APIView):
             logger.error(f"Erro ao excluir gestor {usuario_id}: {str(e)}")
             return Response({'erro': 'Erro interno ao excluir gestor'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
-class CriarDepartamentoView(APIView):
+class CriarDepartamentoView(IdempotenciaMixin, APIView):
     authentication_classes = [FirebaseAndTokenAuthentication]
 
     def post(self, request, instituicao_id):
@@ -1799,7 +2037,7 @@ class CriarDepartamentoView(APIView):
             logger.error(f"Erro ao criar departamento: {str(e)}")
             return Response({'erro': 'Erro interno ao criar departamento'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
-class AdicionarUsuarioDepartamentoView(APIView):
+class AdicionarUsuarioDepartamentoView(IdempotenciaMixin, APIView):
     authentication_classes = [FirebaseAndTokenAuthentication]
 
     def post(self, request, departamento_id):
@@ -2017,7 +2255,7 @@ class ListarFilasAdminView(APIView):
             logger.error(f"Erro ao listar filas para user_id={user.id}: {str(e)}")
             return Response({'erro': 'Erro interno ao listar filas'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
-class ChamarProximaSenhaAdminView(APIView):
+class ChamarProximaSenhaAdminView(IdempotenciaMixin, APIView):
     authentication_classes = [FirebaseAndTokenAuthentication]
 
     def post(self, request, fila_id):
@@ -2035,8 +2273,15 @@ class ChamarProximaSenhaAdminView(APIView):
             logger.warning(f"Admin {request.user.id} tentou acessar fila fora de sua instituição")
             return Response({'erro': 'Acesso negado: fila não pertence à sua instituição'}, status=status.HTTP_403_FORBIDDEN)
 
+        balcao = request.data.get('balcao')
+        try:
+            balcao = int(balcao) if balcao is not None else None
+        except (ValueError, TypeError):
+            logger.warning(f"Balcão inválido: {balcao}")
+            return Response({'erro': 'balcao deve ser um número inteiro'}, status=status.HTTP_400_BAD_REQUEST)
+
         try:
-            senha = ServicoFila.chamar_proximo(fila.servico)
+            senha = ServicoFila.chamar_proximo(fila.servico, filial_id=fila.departamento.filial_id, balcao=balcao)
             response = {
                 'mensagem': f'Senha {senha.fila.prefixo}{senha.numero_senha} chamada',
                 'senha_id': str(senha.id),
@@ -2201,7 +2446,7 @@ class ListarGestoresView(APIView):
             logger.error(f"Erro ao listar gestores para user_id={user.id}: {str(e)}")
             return Response({'erro': 'Erro interno ao listar gestores'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
-class CriarGestorView(APIView):
+class CriarGestorView(IdempotenciaMixin, APIView):
     authentication_classes = [FirebaseAndTokenAuthentication]
 
     def post(self, request, instituicao_id):
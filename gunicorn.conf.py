@@ -0,0 +1,19 @@
+import os
+
+# Carregar a aplicação no mestre, antes do fork: o que ela deixar em memória é partilhado pelos workers
+preload_app = True
+
+
+def on_starting(server):
+    """Carrega os modelos de ML no mestre, uma só vez, para os workers os herdarem já carregados.
+
+    Corre depois de a aplicação ser importada (preload_app) e antes de os workers
+    serem criados; importar facilita.wsgi noutros contextos já não carrega modelos.
+    """
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'facilita.settings')
+    import django
+    django.setup()
+    from django.conf import settings
+    if settings.MODELOS_ML_PRECARREGAR:
+        from fila_online.ml_models import precarregar_modelos
+        precarregar_modelos()
@@ -0,0 +1,18 @@
+# Generated by Django 5.0.6 on 2026-10-17 01:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sistema', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='filial',
+            name='fuso_horario',
+            field=models.CharField(default='Africa/Luanda', max_length=50),
+        ),
+    ]
@@ -34,6 +34,7 @@ class Filial(models.Model):
     bairro = models.CharField(max_length=100, null=True, blank=True)
     latitude = models.FloatField(null=True, blank=True)
     longitude = models.FloatField(null=True, blank=True)
+    fuso_horario = models.CharField(max_length=50, default='Africa/Luanda')
 
     class Meta:
         indexes = [